@@ -215,7 +215,10 @@ class base_client_job(base_job.base_job):
             logging.info(rendered_entry)
         self._logger = base_job.status_logger(
             self, status_indenter(self), record_hook=client_job_record_hook,
-            tap_writer=self._tap)
+            tap_writer=self._tap,
+            buffer_entries=settings.get_value('COMMON',
+                                              'status_log_buffer_entries',
+                                              type=int, default=0))
 
     def _post_record_init(self, control, options, drop_caches,
                           extra_copy_cmdline):
@@ -440,6 +443,25 @@ class base_client_job(base_job.base_job):
         if self.pkgmgr.repositories:
             self.pkgmgr.install_pkg(name, pkg_type, self.pkgdir, install_dir)
 
+    def prefetch_pkgs(self, tests=(), deps=(), profilers=()):
+        '''
+        Fetch the packages of the given tests, deps and profilers from the
+        repositories concurrently, ahead of their installation. Control files
+        can call it first thing to avoid fetching one package at a time as
+        the job goes. Packages that can't be fetched are left to the regular
+        install, which falls back to local copies.
+
+        :param tests: names of the test packages (ex: sleeptest, dbench)
+        :param deps: names of the dep packages
+        :param profilers: names of the profiler packages
+        '''
+        if not self.pkgmgr.repositories:
+            return
+        pkgs = ([(name, 'test') for name in tests] +
+                [(name, 'dep') for name in deps] +
+                [(name, 'profiler') for name in profilers])
+        self.pkgmgr.prefetch_pkgs(pkgs, self.pkgdir)
+
     def add_repository(self, repo_urls):
         '''
         Adds the repository locations to the job so that packages
@@ -482,6 +504,8 @@ class base_client_job(base_job.base_job):
         deps is a list of libraries required for this test.
         """
         # Fetch the deps from the repositories and set them up.
+        if len(deps) > 1:
+            self.prefetch_pkgs(deps=deps)
         for dep in deps:
             dep_dir = os.path.join(self.autodir, 'deps', dep)
             # Search for the dependency in the repositories if specified,
@@ -929,10 +953,16 @@ class base_client_job(base_job.base_job):
             logging.error("Error writing job HTML report: %s", e)
 
         # We are about to exit 'complete' so clean up the control file.
+        # Detaching leaves a complete state file without a journal behind.
+        self._state.set_backing_file(None)
         dest = os.path.join(self.resultdir, os.path.basename(self._state_file))
         shutil.move(self._state_file, dest)
+        state_lock = self._state_file + self._state.LOCK_SUFFIX
+        if os.path.exists(state_lock):
+            os.remove(state_lock)
 
         self.harness.run_complete()
+        self._logger.close()
         self.disable_external_logging()
         sys.exit(status)
 
@@ -950,9 +980,15 @@ class base_client_job(base_job.base_job):
                                         ("%s.state" %
                                          os.path.basename(self.control)))
 
+        journal = settings.get_value('CLIENT', 'job_state_journal', type=bool,
+                                     default=False)
         if os.path.exists(init_state_file):
             shutil.move(init_state_file, self._state_file)
-        self._state.set_backing_file(self._state_file)
+            # a journal left by a previous job doesn't apply to the new state
+            stale_journal = self._state_file + self._state.JOURNAL_SUFFIX
+            if os.path.exists(stale_journal):
+                os.remove(stale_journal)
+        self._state.set_backing_file(self._state_file, journal=journal)
 
         # initialize the state engine, if necessary
         has_steps = self._state.has('client', 'steps')
@@ -1265,9 +1301,13 @@ def runjob(control, drop_caches, options):
         myjob.step_engine()
 
     except error.JobContinue:
+        if myjob:
+            myjob._logger.close()
         sys.exit(5)
 
     except error.JobComplete:
+        if myjob:
+            myjob._logger.close()
         sys.exit(1)
 
     except error.JobError as instance:
@@ -1,13 +1,19 @@
 import pickle as pickle
+import atexit
+import collections
 import copy
 import errno
 import fcntl
 import logging
 import os
 import re
+import stat
+import struct
 import tarfile
+import tempfile
 import time
 import traceback
+import uuid
 import weakref
 
 from autotest.client.shared import autotemp, error, log
@@ -213,23 +219,50 @@ class job_state(object):
     as names. Additionally, the namespace 'stateful_property' is used for
     storing the valued associated with properties constructed using the
     property_factory method.
+
+    The backing file can optionally be journaled (see set_backing_file). The
+    state is then kept in memory and every change is appended to a journal
+    next to the backing file, instead of reading and rewriting the whole
+    backing file on every access. The backing file is rewritten, and the
+    journal restarted, once the journal holds JOURNAL_COMPACT_RECORDS
+    changes and when the backing file is changed or turned off.
     """
 
     NO_DEFAULT = object()
     PICKLE_PROTOCOL = 2  # highest protocol available in python 2.4
 
+    JOURNAL_SUFFIX = '.journal'
+    LOCK_SUFFIX = '.lock'
+    JOURNAL_COMPACT_RECORDS = 1000
+    _JOURNAL_RECORD_HEADER = struct.Struct('>I')
+
     def __init__(self):
         """Initialize the job state."""
         self._state = {}
         self._backing_file = None
         self._backing_file_initialized = False
         self._backing_file_lock = None
+        self._journal = False
+        self._journal_header = None
+        self._journal_offset = 0
+        self._journal_records = 0
+        self._journal_pending = []
 
     def _lock_backing_file(self):
-        """Acquire a lock on the backing file."""
+        """
+        Acquire a lock on the backing file.
+
+        The lock is taken on a separate file next to the backing file,
+        since compaction renames a new file over the backing file and a
+        lock on the backing file itself would not exclude processes that
+        open it after the rename.
+        """
         if self._backing_file:
-            self._backing_file_lock = open(self._backing_file, 'a')
-            fcntl.flock(self._backing_file_lock, fcntl.LOCK_EX)
+            lock_file = open(self._backing_file + self.LOCK_SUFFIX, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._backing_file_lock = lock_file
+            # create the backing file, the readers expect it to exist
+            open(self._backing_file, 'a').close()
 
     def _unlock_backing_file(self):
         """Release a lock on the backing file."""
@@ -259,11 +292,7 @@ class job_state(object):
         attempt to control concurrent access to the file at ``file_path``.
         """
 
-        # we can assume that the file exists
-        if os.path.getsize(file_path) == 0:
-            on_disk_state = {}
-        else:
-            on_disk_state = pickle.load(open(file_path, 'rb'))
+        on_disk_state = self._load_state_file(file_path)[0]
 
         if merge:
             # merge the on-disk state with the in-memory state
@@ -288,7 +317,7 @@ class job_state(object):
             self._state = on_disk_state
 
         # lock the backing file before we refresh it
-        with_backing_lock(self.__class__._write_to_backing_file)(self)
+        with_backing_lock(self.__class__._compact_backing_file)(self)
 
     def write_to_file(self, file_path):
         """
@@ -307,6 +336,190 @@ class job_state(object):
         finally:
             outfile.close()
 
+    @classmethod
+    def _journal_header_for(cls, file_path, generation):
+        """
+        Header of a journal continuing the state in file_path. It ties the
+        journal to one version of the file, so a journal that was not
+        restarted after the file was rewritten is recognized as stale.
+        """
+        file_stat = os.stat(file_path)
+        return ('%s %d %d %d\n' % (generation, file_stat.st_ino,
+                                   file_stat.st_size,
+                                   file_stat.st_mtime_ns)).encode()
+
+    @staticmethod
+    def _apply_journal_record(state, record):
+        operation, namespace, name, value = record
+        if operation == 'set':
+            state.setdefault(namespace, {})[name] = value
+        elif operation == 'discard':
+            namespace_dict = state.get(namespace, {})
+            namespace_dict.pop(name, None)
+            if not namespace_dict:
+                state.pop(namespace, None)
+        elif operation == 'discard_namespace':
+            state.pop(namespace, None)
+
+    @classmethod
+    def _replay_journal(cls, journal_file, state):
+        """
+        Apply the records of journal_file, from its current position, to
+        state. A trailing partial record, left by a writer that died, is
+        ignored.
+
+        :return: A tuple (offset after the last whole record, records read).
+        """
+        records = 0
+        offset = journal_file.tell()
+        header_size = cls._JOURNAL_RECORD_HEADER.size
+        while True:
+            header = journal_file.read(header_size)
+            if len(header) < header_size:
+                break
+            size = cls._JOURNAL_RECORD_HEADER.unpack(header)[0]
+            data = journal_file.read(size)
+            if len(data) < size:
+                break
+            cls._apply_journal_record(state, pickle.loads(data))
+            offset += header_size + size
+            records += 1
+        return offset, records
+
+    def _load_state_file(self, file_path):
+        """
+        Load the state in file_path, replaying its journal if it has a
+        current one.
+
+        :return: A tuple (state, journal header, journal offset, journal
+                 records), the journal fields are None, 0, 0 without a
+                 current journal.
+        """
+        # we can assume that the file exists
+        if os.path.getsize(file_path) == 0:
+            state = {}
+        else:
+            state = pickle.load(open(file_path, 'rb'))
+
+        journal_path = file_path + self.JOURNAL_SUFFIX
+        try:
+            journal_file = open(journal_path, 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return state, None, 0, 0
+        try:
+            header = journal_file.readline()
+            generation = header.split(b' ', 1)[0].decode()
+            if header != self._journal_header_for(file_path, generation):
+                logging.debug('Ignoring stale state journal %s', journal_path)
+                return state, None, 0, 0
+            offset, records = self._replay_journal(journal_file, state)
+        finally:
+            journal_file.close()
+        return state, header, offset, records
+
+    def _compact_backing_file(self):
+        """
+        Write the whole current state to the backing file and, when
+        journaled, restart the journal.
+
+        The state is written to a new file renamed over the backing file,
+        so a journal left behind by a crash before it is restarted belongs
+        to another inode and is not replayed over the new state.
+        """
+        if not self._backing_file:
+            return
+        fd, new_path = tempfile.mkstemp(
+            prefix=os.path.basename(self._backing_file) + '.',
+            dir=os.path.dirname(self._backing_file) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as new_file:
+                pickle.dump(self._state, new_file, self.PICKLE_PROTOCOL)
+                new_file.flush()
+                os.fsync(new_file.fileno())
+            # keep the mode the backing file was created with
+            os.chmod(new_path,
+                     stat.S_IMODE(os.stat(self._backing_file).st_mode))
+            os.rename(new_path, self._backing_file)
+        except BaseException:
+            if os.path.exists(new_path):
+                os.remove(new_path)
+            raise
+        self._journal_pending = []
+        if not self._journal:
+            return
+        header = self._journal_header_for(self._backing_file,
+                                          uuid.uuid4().hex)
+        journal_file = open(self._backing_file + self.JOURNAL_SUFFIX, 'wb')
+        try:
+            journal_file.write(header)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        finally:
+            journal_file.close()
+        self._journal_header = header
+        self._journal_offset = len(header)
+        self._journal_records = 0
+
+    def _refresh_from_journal(self):
+        """
+        Bring the in-memory state up to date with the journal, reloading
+        the backing file if another process has compacted it.
+        """
+        journal_path = self._backing_file + self.JOURNAL_SUFFIX
+        try:
+            journal_file = open(journal_path, 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            journal_file = None
+        if journal_file:
+            try:
+                if journal_file.readline() == self._journal_header:
+                    journal_file.seek(self._journal_offset)
+                    offset, records = self._replay_journal(journal_file,
+                                                           self._state)
+                    self._journal_offset = offset
+                    self._journal_records += records
+                    return
+            finally:
+                journal_file.close()
+
+        (self._state, self._journal_header, self._journal_offset,
+         self._journal_records) = self._load_state_file(self._backing_file)
+        if self._journal_header is None:
+            self._compact_backing_file()
+
+    def _append_to_journal(self):
+        """Append the pending changes to the journal."""
+        if not self._journal_pending:
+            return
+        journal_file = open(self._backing_file + self.JOURNAL_SUFFIX, 'r+b')
+        try:
+            # drop any partial record left by a writer that died
+            journal_file.truncate(self._journal_offset)
+            journal_file.seek(self._journal_offset)
+            for record in self._journal_pending:
+                data = pickle.dumps(record, self.PICKLE_PROTOCOL)
+                journal_file.write(self._JOURNAL_RECORD_HEADER.pack(len(data)))
+                journal_file.write(data)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+            self._journal_offset = journal_file.tell()
+        finally:
+            journal_file.close()
+        self._journal_records += len(self._journal_pending)
+        self._journal_pending = []
+        if self._journal_records >= self.JOURNAL_COMPACT_RECORDS:
+            self._compact_backing_file()
+
+    def _record_change(self, operation, namespace, name=None, value=None):
+        """Queue a change for the journal, if there is one."""
+        if self._journal and self._backing_file:
+            self._journal_pending.append((operation, namespace, name,
+                                          copy.deepcopy(value)))
+
     def _read_from_backing_file(self):
         """
         Refresh the current state from the backing file.
@@ -316,6 +529,9 @@ class job_state(object):
         in-memory state, rather than overwriting it.
         """
         if self._backing_file:
+            if self._journal and self._backing_file_initialized:
+                self._refresh_from_journal()
+                return
             merge_backing_file = not self._backing_file_initialized
             self.read_from_file(self._backing_file, merge=merge_backing_file)
             self._backing_file_initialized = True
@@ -323,7 +539,10 @@ class job_state(object):
     def _write_to_backing_file(self):
         """Flush the current state to the backing file."""
         if self._backing_file:
-            self.write_to_file(self._backing_file)
+            if self._journal:
+                self._append_to_journal()
+            else:
+                self.write_to_file(self._backing_file)
 
     @with_backing_file
     def _synchronize_backing_file(self):
@@ -333,7 +552,22 @@ class job_state(object):
         # state is implicitly synchronized in _with_backing_file methods
         pass
 
-    def set_backing_file(self, file_path):
+    @with_backing_lock
+    def _detach_journal(self):
+        """
+        Leave a complete backing file behind, without a journal, so it can
+        be used by readers that don't know about journals.
+        """
+        if self._backing_file and self._journal:
+            if self._backing_file_initialized:
+                self._refresh_from_journal()
+            self._journal = False
+            self._compact_backing_file()
+            journal_path = self._backing_file + self.JOURNAL_SUFFIX
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+
+    def set_backing_file(self, file_path, journal=False):
         """
         Change the path used as the backing file for the persistent state.
 
@@ -346,10 +580,18 @@ class job_state(object):
         :param file_path: A path on the filesystem that can be read from and
                           written to, or None to turn off the backing store.
         :type file_path: string
+
+        :param journal: If true, changes are appended to a journal next to
+                        the backing file instead of rewriting the file on
+                        every access, see the class docstring.
+        :type journal: bool
         """
         self._synchronize_backing_file()
+        self._detach_journal()
         self._backing_file = file_path
         self._backing_file_initialized = False
+        self._journal = bool(journal and file_path)
+        self._journal_header = None
         self._synchronize_backing_file()
 
     @with_backing_file
@@ -396,6 +638,7 @@ class job_state(object):
         """
         namespace_dict = self._state.setdefault(namespace, {})
         namespace_dict[name] = copy.deepcopy(value)
+        self._record_change('set', namespace, name, value)
         logging.debug('Persistent state %s.%s now set to %r', namespace,
                       name, value)
 
@@ -431,6 +674,7 @@ class job_state(object):
             del self._state[namespace][name]
             if len(self._state[namespace]) == 0:
                 del self._state[namespace]
+            self._record_change('discard', namespace, name)
             logging.debug('Persistent state %s.%s deleted', namespace, name)
         else:
             logging.debug(
@@ -447,6 +691,7 @@ class job_state(object):
         """
         if namespace in self._state:
             del self._state[namespace]
+            self._record_change('discard_namespace', namespace)
         logging.debug('Persistent state %s.* deleted', namespace)
 
     @staticmethod
@@ -642,18 +887,62 @@ class status_indenter(object):
         """Decrease indentation by one level."""
 
 
+# status loggers that may hold buffered entries, flushed before forking and
+# at exit
+_status_loggers = weakref.WeakSet()
+
+
+def _flush_status_loggers():
+    for logger in list(_status_loggers):
+        logger.flush()
+
+
+def _share_status_logs():
+    # once forked, parent and child may both append to the same status
+    # logs, so neither buffers from then on
+    for logger in list(_status_loggers):
+        logger.flush()
+        logger.sole_writer = False
+
+
+def _forget_buffered_entries():
+    for logger in list(_status_loggers):
+        logger._pending_lines.clear()
+        logger._buffered_entries = 0
+        logger._buffered_since = None
+        logger.sole_writer = False
+
+
+atexit.register(_flush_status_loggers)
+os.register_at_fork(before=_share_status_logs,
+                    after_in_child=_forget_buffered_entries)
+
+
 class status_logger(object):
     """
     Represents a status log file. Responsible for translating messages
     into on-disk status log lines.
 
+    The log files are kept open between entries, in append mode, and every
+    line is written with a single write() so lines appended by other
+    processes never get mixed with it.
+
+    Entries can be buffered, as long as this process is the only writer of
+    the logs (it never forked): they are then written out when a group
+    STARTs or ENDs, when the buffer holds buffer_entries entries or, when
+    the next entry is recorded, buffer_seconds old ones, at exit and on
+    flush(). Buffered entries are lost if the process crashes.
+
     :property global_filename: The filename to write top-level logs to.
     :property subdir_filename: The filename to write subdir-level logs to.
     """
 
+    # open log files kept, the least recently used is closed past this
+    MAX_OPEN_FILES = 32
+
     def __init__(self, job, indenter, global_filename='status',
                  subdir_filename='status', record_hook=None,
-                 tap_writer=None):
+                 tap_writer=None, buffer_entries=0, buffer_seconds=5):
         """
         Construct a logger instance.
 
@@ -676,6 +965,13 @@ class status_logger(object):
 
         :param tap_writer: An instance of the class TAPReport for addionally
                            writing TAP files
+
+        :param buffer_entries: Number of entries that may be buffered before
+                               being written out, 0 (the default) writes
+                               every entry out right away.
+
+        :param buffer_seconds: Age after which buffered entries are written
+                               out, checked when an entry is recorded.
         """
         self._jobref = weakref.ref(job)
         self._indenter = indenter
@@ -686,6 +982,53 @@ class status_logger(object):
             self._tap_writer = TAPReport(None)
         else:
             self._tap_writer = tap_writer
+        self.buffer_entries = buffer_entries
+        self.buffer_seconds = buffer_seconds
+        self.sole_writer = True
+        # path -> file descriptor
+        self._log_files = collections.OrderedDict()
+        # path -> buffered lines
+        self._pending_lines = collections.OrderedDict()
+        self._buffered_entries = 0
+        self._buffered_since = None
+        _status_loggers.add(self)
+
+    def _get_log_fd(self, path):
+        fd = self._log_files.pop(path, None)
+        if fd is None:
+            if len(self._log_files) >= self.MAX_OPEN_FILES:
+                os.close(self._log_files.popitem(last=False)[1])
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        # keep the most recently used files last
+        self._log_files[path] = fd
+        return fd
+
+    def _write(self, path, text):
+        data = text.encode('utf-8')
+        fd = self._get_log_fd(path)
+        while data:
+            data = data[os.write(fd, data):]
+
+    def flush(self):
+        """Write out the buffered entries."""
+        while self._pending_lines:
+            path, lines = self._pending_lines.popitem(last=False)
+            self._write(path, ''.join(lines))
+        self._buffered_entries = 0
+        self._buffered_since = None
+
+    def close(self):
+        """Write out the buffered entries and close the log files."""
+        self.flush()
+        while self._log_files:
+            os.close(self._log_files.popitem()[1])
+
+    def _must_flush(self, log_entry):
+        if log_entry.is_start() or log_entry.is_end():
+            return True
+        if self._buffered_entries >= self.buffer_entries:
+            return True
+        return time.time() - self._buffered_since >= self.buffer_seconds
 
     def render_entry(self, log_entry):
         """
@@ -731,13 +1074,20 @@ class status_logger(object):
                                           self.subdir_filename))
 
         # write out to entry to the log files
-        log_text = self.render_entry(log_entry)
-        for log_file in log_files:
-            fileobj = open(log_file, 'a')
-            try:
-                print(log_text, file=fileobj)
-            finally:
-                fileobj.close()
+        log_line = self.render_entry(log_entry) + '\n'
+        if self.buffer_entries and self.sole_writer:
+            for log_file in log_files:
+                # open the file now, so errors show up with the entry
+                self._get_log_fd(log_file)
+                self._pending_lines.setdefault(log_file, []).append(log_line)
+            if self._buffered_since is None:
+                self._buffered_since = time.time()
+            self._buffered_entries += 1
+            if self._must_flush(log_entry):
+                self.flush()
+        else:
+            for log_file in log_files:
+                self._write(log_file, log_line)
 
         # write to TAPRecord instance
         if log_entry.is_end() and self._tap_writer.do_tap_report:
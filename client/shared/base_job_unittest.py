@@ -2,9 +2,11 @@
 
 import logging
 import os
+import pickle
 import shutil
 import stat
 import tempfile
+import time
 import unittest
 
 try:
@@ -47,6 +49,7 @@ class stub_job_state(base_job.job_state):
     def __init__(self):
         self._state = {}
         self._backing_file_lock = None
+        self._journal = False
 
     def read_from_file(self, file_path):
         pass
@@ -54,7 +57,7 @@ class stub_job_state(base_job.job_state):
     def write_to_file(self, file_path):
         pass
 
-    def set_backing_file(self, file_path):
+    def set_backing_file(self, file_path, journal=False):
         pass
 
     def _read_from_backing_file(self):
@@ -514,8 +517,10 @@ class test_job_state_with_backing_file(test_job_state):
         self.state.set_backing_file(self.backing_file)
 
     def tearDown(self):
-        if os.path.exists(self.backing_file):
-            os.remove(self.backing_file)
+        for path in (self.backing_file,
+                     self.backing_file + base_job.job_state.LOCK_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_set_is_persistent(self):
         self.state.set('persist', 'var', 'value')
@@ -538,6 +543,149 @@ class test_job_state_with_backing_file(test_job_state):
         self.assertRaises(KeyError, written_state.get, 'persist', 'var')
 
 
+# run the same tests again, with the backing file journaled
+class test_job_state_with_journal(test_job_state_with_backing_file):
+
+    def setUp(self):
+        self.backing_file = tempfile.mktemp()
+        self.journal_file = self.backing_file + base_job.job_state.JOURNAL_SUFFIX
+        self.state = base_job.job_state()
+        self.state.set_backing_file(self.backing_file, journal=True)
+
+    def tearDown(self):
+        for path in (self.backing_file, self.journal_file,
+                     self.backing_file + base_job.job_state.LOCK_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _snapshot(self):
+        return pickle.load(open(self.backing_file, 'rb'))
+
+    def test_changes_only_append_to_journal(self):
+        self.state.set('ns', 'var', 'value')
+        journal_size = os.path.getsize(self.journal_file)
+        self.assertEqual({}, self._snapshot())
+        self.state.set('ns', 'var2', 'value2')
+        self.assertTrue(os.path.getsize(self.journal_file) > journal_size)
+        self.assertEqual({}, self._snapshot())
+
+    def test_reads_do_not_write(self):
+        self.state.set('ns', 'var', 'value')
+        journal_size = os.path.getsize(self.journal_file)
+        self.assertEqual('value', self.state.get('ns', 'var'))
+        self.assertEqual(journal_size, os.path.getsize(self.journal_file))
+
+    def test_changes_propagate_between_instances(self):
+        other = base_job.job_state()
+        other.set_backing_file(self.backing_file, journal=True)
+        self.state.set('ns', 'var', 1)
+        self.assertEqual(1, other.get('ns', 'var'))
+        other.discard('ns', 'var')
+        self.assertFalse(self.state.has('ns', 'var'))
+
+    def test_compaction(self):
+        self.state.JOURNAL_COMPACT_RECORDS = 3
+        for value in range(3):
+            self.state.set('ns', 'var%d' % value, value)
+        self.assertEqual({'ns': {'var0': 0, 'var1': 1, 'var2': 2}},
+                         self._snapshot())
+        self.assertEqual(self.state._journal_offset,
+                         os.path.getsize(self.journal_file))
+
+    def test_compaction_is_seen_by_other_instances(self):
+        other = base_job.job_state()
+        other.set_backing_file(self.backing_file, journal=True)
+        self.state.JOURNAL_COMPACT_RECORDS = 2
+        self.state.set('ns', 'var0', 0)
+        self.state.set('ns', 'var1', 1)
+        self.state.set('ns', 'var2', 2)
+        self.assertEqual(2, other.get('ns', 'var2'))
+        self.assertEqual(0, other.get('ns', 'var0'))
+
+    def test_read_from_file_replays_journal(self):
+        self.state.set('ns', 'var', 'value')
+        written_state = base_job.job_state()
+        written_state.read_from_file(self.backing_file)
+        self.assertEqual('value', written_state.get('ns', 'var'))
+
+    def test_stale_journal_is_ignored(self):
+        self.state.set('ns', 'var', 'value')
+        # the state file is replaced, e.g. with a new init state
+        base_job.job_state().write_to_file(self.backing_file)
+        written_state = base_job.job_state()
+        written_state.read_from_file(self.backing_file)
+        self.assertFalse(written_state.has('ns', 'var'))
+
+    def test_journal_of_replaced_state_is_ignored(self):
+        self.state.set('ns', 'var', 'journaled')
+        old_journal = open(self.journal_file, 'rb').read()
+        old_stat = os.stat(self.backing_file)
+        self.state._state = {}
+        self.state._compact_backing_file()
+        # a crash after the state was written, before the journal restarted
+        open(self.journal_file, 'wb').write(old_journal)
+        os.utime(self.backing_file,
+                 ns=(old_stat.st_atime_ns, old_stat.st_mtime_ns))
+        self.assertEqual(old_stat.st_size,
+                         os.path.getsize(self.backing_file))
+        written_state = base_job.job_state()
+        written_state.read_from_file(self.backing_file)
+        self.assertFalse(written_state.has('ns', 'var'))
+
+    def test_compaction_excludes_other_processes(self):
+        self.state.set('ns', 'var', 'value')
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(write_end)
+                os.read(read_end, 1)
+                other = base_job.job_state()
+                other.set_backing_file(self.backing_file, journal=True)
+                other.set('ns', 'child', 'value')
+            finally:
+                os._exit(0)
+        os.close(read_end)
+
+        def rename(src, dst):
+            real_rename(src, dst)
+            # the other process opens the renamed file while we compact
+            os.write(write_end, b'x')
+            time.sleep(0.2)
+        real_rename = os.rename
+        os.rename = rename
+        try:
+            self.state._lock_backing_file()
+            self.state._compact_backing_file()
+            self.state._unlock_backing_file()
+        finally:
+            os.rename = real_rename
+            os.close(write_end)
+        os.waitpid(pid, 0)
+
+        written_state = base_job.job_state()
+        written_state.read_from_file(self.backing_file)
+        self.assertEqual('value', written_state.get('ns', 'var'))
+        self.assertEqual('value', written_state.get('ns', 'child'))
+
+    def test_partial_record_is_dropped(self):
+        self.state.set('ns', 'var', 'value')
+        journal = open(self.journal_file, 'ab')
+        journal.write(b'\x00\x00\x01\x00partial')
+        journal.close()
+        other = base_job.job_state()
+        other.set_backing_file(self.backing_file, journal=True)
+        self.assertEqual('value', other.get('ns', 'var'))
+        self.state.set('ns', 'var2', 'value2')
+        self.assertEqual('value2', other.get('ns', 'var2'))
+
+    def test_detaching_removes_journal(self):
+        self.state.set('ns', 'var', 'value')
+        self.state.set_backing_file(None)
+        self.assertFalse(os.path.exists(self.journal_file))
+        self.assertEqual({'ns': {'var': 'value'}}, self._snapshot())
+
+
 class test_job_state_read_write_file(unittest.TestCase):
 
     def setUp(self):
@@ -1220,7 +1368,90 @@ class test_status_logger(unittest.TestCase):
             self.logger.record_entry(entry)
         self.assertEqual(entries, recorded_entries)
 
+    def test_buffers_entries_until_group_boundary(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             buffer_entries=10)
+        self.logger.record_entry(self.make_dummy_entry('LINE1', start=True))
+        self.logger.record_entry(self.make_dummy_entry('LINE2'))
+        self.logger.record_entry(self.make_dummy_entry('LINE3'))
+        self.assertEqual('LINE1\n', open('status').read())
+        self.logger.record_entry(self.make_dummy_entry('LINE4', end=True))
+        self.assertEqual('LINE1\n\tLINE2\n\tLINE3\nLINE4\n',
+                         open('status').read())
+
+    def test_flushes_full_buffer(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             buffer_entries=2)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        self.assertEqual('', open('status').read())
+        self.logger.record_entry(self.make_dummy_entry('LINE2'))
+        self.assertEqual('LINE1\nLINE2\n', open('status').read())
+
+    def test_flushes_old_buffer(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             buffer_entries=10,
+                                             buffer_seconds=0)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        self.assertEqual('LINE1\n', open('status').read())
+
+    def test_flush(self):
+        os.mkdir('sub')
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             buffer_entries=10)
+        self.logger.record_entry(self.make_dummy_entry('LINE1', subdir='sub'))
+        self.logger.flush()
+        self.assertEqual('LINE1\n', open('status').read())
+        self.assertEqual('LINE1\n', open('sub/status').read())
+
+    def test_writes_each_line_whole(self):
+        writes = []
+        real_write = os.write
+
+        def write(fd, data):
+            writes.append(data)
+            return real_write(fd, data)
+        os.write = write
+        try:
+            self.logger.record_entry(self.make_dummy_entry('LINE1\n  blah'))
+        finally:
+            os.write = real_write
+        self.assertEqual([b'LINE1\n  blah\n'], writes)
+
+    def test_no_buffering_once_forked(self):
+        self.logger = base_job.status_logger(self.job, self.indenter,
+                                             buffer_entries=10)
+        self.logger.record_entry(self.make_dummy_entry('LINE1'))
+        self.assertEqual('', open('status').read())
+        # what happens before a fork
+        base_job._share_status_logs()
+        self.assertEqual('LINE1\n', open('status').read())
+        self.logger.record_entry(self.make_dummy_entry('LINE2'))
+        self.assertEqual('LINE1\nLINE2\n', open('status').read())
+
+    def test_closes_least_recently_used_file(self):
+        self.logger.MAX_OPEN_FILES = 2
+        for subdir in ('sub1', 'sub2'):
+            os.mkdir(subdir)
+            self.logger.record_entry(self.make_dummy_entry(subdir,
+                                                           subdir=subdir))
+        self.assertEqual([os.path.join(self.testdir, 'status'),
+                          os.path.join(self.testdir, 'sub2', 'status')],
+                         list(self.logger._log_files))
+        self.assertEqual('sub1\nsub2\n', open('status').read())
+        self.assertEqual('sub1\n', open('sub1/status').read())
+
+    def test_close_releases_files(self):
+        os.mkdir('sub')
+        self.logger.record_entry(self.make_dummy_entry('LINE1', subdir='sub'))
+        fds = list(self.logger._log_files.values())
+        self.assertEqual(2, len(fds))
+        self.logger.close()
+        self.assertEqual({}, dict(self.logger._log_files))
+        for fd in fds:
+            self.assertRaises(OSError, os.fstat, fd)
+
     def tearDown(self):
+        self.logger.close()
         os.chdir(self.original_wd)
         shutil.rmtree(self.testdir, ignore_errors=True)
 
@@ -5,11 +5,18 @@ upload and remove packages. Site specific extensions to any of these methods
 should inherit this class.
 """
 
+import collections
+import concurrent.futures
+import contextlib
 import fcntl
+import hashlib
 import logging
 import os
 import re
 import shutil
+import tempfile
+import threading
+import time
 
 from autotest.client import os_dep
 from autotest.client.shared import error, utils
@@ -18,6 +25,11 @@ from autotest.client.shared.settings import settings, SettingsError
 # the name of the checksum file that stores the packages' checksums
 CHECKSUM_FILE = "packages.checksum"
 
+# health of the mirrors, as seen by the fetches of the current run
+MIRROR_OK = 'ok'
+MIRROR_SLOW = 'slow'
+MIRROR_UNREACHABLE = 'unreachable'
+
 
 def has_pbzip2():
     '''
@@ -282,8 +294,17 @@ class HttpFetcher(RepositoryFetcher):
         Runs a wget command with a 30s timeout
 
         This checks that the repository is reachable, and avoids the need to
-        wait for a full 10min timeout.
+        wait for a full 10min timeout. Its outcome is remembered in the
+        package manager mirror health, the test is only done again once an
+        unreachable mirror may have come back.
         """
+        if not self.pkgmgr.mirror_needs_test(self.url):
+            if (self.pkgmgr.get_mirror_health(self.url) ==
+                    MIRROR_UNREACHABLE):
+                raise error.PackageFetchError('HTTP test failed earlier, %s '
+                                              'is unreachable' % self.url)
+            return
+
         # just make a temp file to write a test fetch into
         mktemp = 'mktemp -u /tmp/tmp.XXXXXX'
         dest_file_path = self.run_command(mktemp).stdout.strip()
@@ -291,11 +312,17 @@ class HttpFetcher(RepositoryFetcher):
         try:
             # build up a wget command
             http_cmd = self.wget_cmd_pattern % (self.url, dest_file_path)
+            start_time = time.time()
             try:
                 self.run_command(http_cmd, _run_command_dargs={'timeout': 30})
             except Exception as e:
                 msg = 'HTTP test failed, unable to contact %s: %s'
+                self.pkgmgr.set_mirror_health(self.url, MIRROR_UNREACHABLE)
                 raise error.PackageFetchError(msg % (self.url, e))
+            if time.time() - start_time > self.pkgmgr.mirror_slow_seconds:
+                self.pkgmgr.set_mirror_health(self.url, MIRROR_SLOW)
+            else:
+                self.pkgmgr.set_mirror_health(self.url, MIRROR_OK)
         finally:
             self.run_command('rm -rf %s' % dest_file_path)
 
@@ -319,7 +346,9 @@ class HttpFetcher(RepositoryFetcher):
         package_url = os.path.join(self.url, filename)
         try:
             cmd = self.wget_cmd_pattern % (package_url, dest_path)
+            start_time = time.time()
             result = self.run_command(cmd)
+            fetch_time = time.time() - start_time
 
             file_exists = self.run_command(
                 'ls %s' % dest_path,
@@ -330,6 +359,12 @@ class HttpFetcher(RepositoryFetcher):
 
             logging.debug('Successfully fetched %s from %s', filename,
                           package_url)
+            # the last fetch tells whether the mirror is slow, so a mirror
+            # that was slow once is not left behind for the whole run
+            if fetch_time > self.pkgmgr.mirror_slow_seconds:
+                self.pkgmgr.set_mirror_health(self.url, MIRROR_SLOW)
+            else:
+                self.pkgmgr.set_mirror_health(self.url, MIRROR_OK)
         except error.CmdError:
             # remove whatever junk was retrieved when the get failed
             self.run_command('rm -f %s' % dest_path)
@@ -483,6 +518,26 @@ class BasePackageManager(object):
         '''
         # In memory dictionary that stores the checksum's of packages
         self._checksum_dict = {}
+        # checksum file changes not written yet, and the repos to upload the
+        # checksum file to, while in a checksum_batch()
+        self._checksum_batch_depth = 0
+        self._checksum_dirty = False
+        self._checksum_upload_paths = []
+        # checksums of local files, by path, with the size and mtime they
+        # were computed for
+        self._file_checksums = {}
+        # without a custom run_function files are local and handled in
+        # process instead of through commands
+        self._local = run_function is utils.run
+        # serializes checksum updates of concurrent fetches
+        self._checksum_lock = threading.RLock()
+        # mirror url -> (one of the MIRROR_* states, time it was last seen)
+        self._mirror_health = {}
+        self._mirror_health_lock = threading.Lock()
+        self.mirror_slow_seconds = settings.get_value(
+            'PACKAGES', 'mirror_slow_seconds', type=int, default=10)
+        self.mirror_retry_seconds = settings.get_value(
+            'PACKAGES', 'mirror_retry_seconds', type=int, default=300)
 
         self.pkgmgr_dir = pkgmgr_dir
         self.do_locking = do_locking
@@ -580,6 +635,86 @@ class BasePackageManager(object):
         subcommand.parallel_simple(trim_custom_directories, custom_repos,
                                    log=False)
 
+    def get_mirror_health(self, url):
+        """
+        :return: The MIRROR_* state of the mirror at url, None if it was not
+                tried yet.
+        """
+        with self._mirror_health_lock:
+            return self._mirror_health.get(url, (None, None))[0]
+
+    def set_mirror_health(self, url, health):
+        with self._mirror_health_lock:
+            previous = self._mirror_health.get(url, (None, None))[0]
+            self._mirror_health[url] = (health, time.time())
+        if health != previous:
+            if health == MIRROR_UNREACHABLE:
+                logging.warning('Package mirror %s is unreachable, it will be '
+                                'tried last and tested again in %d seconds',
+                                url, self.mirror_retry_seconds)
+            elif health == MIRROR_SLOW:
+                logging.warning('Package mirror %s is slow, it will be tried '
+                                'after the other mirrors', url)
+
+    def mirror_needs_test(self, url):
+        """
+        :return: True if the mirror at url was not tried yet, or was found
+                unreachable longer than mirror_retry_seconds ago.
+        """
+        with self._mirror_health_lock:
+            health, seen_time = self._mirror_health.get(url, (None, None))
+        if health is None:
+            return True
+        return (health == MIRROR_UNREACHABLE and
+                time.time() - seen_time >= self.mirror_retry_seconds)
+
+    def _forget_unreachable_mirrors(self, urls, before):
+        """
+        Forget that the mirrors at urls were unreachable, if they were last
+        tested before the time before, so that they are tested again.
+
+        :return: The urls forgotten.
+        """
+        forgotten = []
+        with self._mirror_health_lock:
+            for url in urls:
+                health, seen_time = self._mirror_health.get(url, (None, None))
+                if health == MIRROR_UNREACHABLE and seen_time < before:
+                    del self._mirror_health[url]
+                    forgotten.append(url)
+        return forgotten
+
+    def _order_by_health(self, repositories):
+        """
+        Stable sort of fetchers: the mirrors known to be slow come after the
+        others, and the unreachable ones last.
+        """
+        rank = {MIRROR_SLOW: 1, MIRROR_UNREACHABLE: 2}
+        return sorted(repositories,
+                      key=lambda fetcher: rank.get(
+                          self.get_mirror_health(fetcher.url), 0))
+
+    @contextlib.contextmanager
+    def _package_lock(self, name, pkg_type):
+        """
+        Hold the lock file of a package while it is fetched or installed.
+        """
+        # do_locking flag is on by default unless you disable it (typically
+        # in the cases where packages are directly installed from the server
+        # onto the client in which case fcntl stuff wont work as the code
+        # will run on the server in that case..
+        if not self.do_locking:
+            yield
+            return
+        lockfile_name = '.%s-%s-lock' % (re.sub("/", "_", name), pkg_type)
+        with open(os.path.join(self.pkgmgr_dir, lockfile_name),
+                  'w') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
     def install_pkg(self, name, pkg_type, fetch_dir, install_dir,
                     preserve_install_dir=False, repo_url=None):
         '''
@@ -596,18 +731,7 @@ class BasePackageManager(object):
         repo_url    : the url of the repository to fetch the package from.
         '''
 
-        # do_locking flag is on by default unless you disable it (typically
-        # in the cases where packages are directly installed from the server
-        # onto the client in which case fcntl stuff wont work as the code
-        # will run on the server in that case..
-        if self.do_locking:
-            lockfile_name = '.%s-%s-lock' % (re.sub("/", "_", name), pkg_type)
-            lockfile = open(os.path.join(self.pkgmgr_dir, lockfile_name), 'w')
-
-        try:
-            if self.do_locking:
-                fcntl.flock(lockfile, fcntl.LOCK_EX)
-
+        with self._package_lock(name, pkg_type):
             self._run_command('mkdir -p %s' % fetch_dir)
             pkg_name = self.get_tarball_name(name, pkg_type)
             try:
@@ -620,10 +744,51 @@ class BasePackageManager(object):
                 raise error.PackageInstallError(
                     'Installation of %s(type:%s) failed : %s'
                     % (name, pkg_type, why))
-        finally:
-            if self.do_locking:
-                fcntl.flock(lockfile, fcntl.LOCK_UN)
-                lockfile.close()
+
+    def prefetch_pkgs(self, pkgs, fetch_dir, max_parallel=None):
+        '''
+        Fetch many packages into fetch_dir concurrently, ahead of their
+        install. The later install_pkg() calls with the same fetch_dir find
+        the packages up to date and only untar them.
+        pkgs         : iterable of (name, pkg_type) tuples
+        fetch_dir    : the fetch_dir install_pkg() will be called with
+        max_parallel : maximum number of concurrent fetches, defaults to
+                       PACKAGES.prefetch_parallel
+        Return a dict mapping the (name, pkg_type) tuples of the packages
+        that could not be fetched to the PackageFetchError.
+        '''
+        pkgs = list(collections.OrderedDict.fromkeys(pkgs))
+        if not pkgs or not self.repositories:
+            return {}
+        if max_parallel is None:
+            max_parallel = settings.get_value('PACKAGES', 'prefetch_parallel',
+                                              type=int, default=4)
+
+        self._run_command('mkdir -p %s' % fetch_dir)
+        # load the checksum file once, not from every fetch
+        self._get_checksum_dict()
+
+        def prefetch(name, pkg_type):
+            with self._package_lock(name, pkg_type):
+                self.fetch_pkg(self.get_tarball_name(name, pkg_type),
+                               fetch_dir, use_checksum=True, install=True)
+
+        failures = {}
+        with self.checksum_batch():
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max(1, max_parallel)) as executor:
+                futures = dict((executor.submit(prefetch, name, pkg_type),
+                                (name, pkg_type))
+                               for name, pkg_type in pkgs)
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        future.result()
+                    except error.PackageFetchError as why:
+                        failures[futures[future]] = why
+        if failures:
+            logging.warning('Could not prefetch %d of %d packages',
+                            len(failures), len(pkgs))
+        return failures
 
     def fetch_pkg(self, pkg_name, dest_path, repo_url=None, use_checksum=False, install=False):
         '''
@@ -644,21 +809,10 @@ class BasePackageManager(object):
                        here as opposed to install_pkg.
         '''
 
-        try:
-            self._run_command("ls %s" % os.path.dirname(dest_path))
-        except (error.CmdError, error.AutoservRunError):
-            raise error.PackageFetchError("Please provide a valid "
-                                          "destination: %s " % dest_path)
-
         # See if the package was already fetched earlier, if so
         # the checksums need to be compared and the package is now
         # fetched only if they differ.
-        pkg_exists = False
-        try:
-            self._run_command("ls %s" % dest_path)
-            pkg_exists = True
-        except (error.CmdError, error.AutoservRunError):
-            pass
+        pkg_exists = self._check_fetch_destination(dest_path)
 
         # if a repository location is explicitly provided, fetch the package
         # from there and return
@@ -670,29 +824,42 @@ class BasePackageManager(object):
             raise error.PackageFetchError("No repository urls specified")
 
         # install the package from the package repos, try the repos in
-        # reverse order, assuming that the 'newest' repos are most desirable
-        for fetcher in reversed(repositories):
-            try:
-                if isinstance(fetcher, GitFetcher):
-                    use_checksum = False
-                # different fetchers have different install requirements
-                dest = fetcher.install_pkg_setup(pkg_name, dest_path, install)[1]
-
-                # Fetch the package if it is not there, the checksum does
-                # not match, or checksums are disabled entirely
-                need_to_fetch = (not use_checksum or
-                                 not pkg_exists or
-                                 not self.compare_checksum(dest, fetcher.url))
-                if need_to_fetch:
-                    fetcher.fetch_pkg_file(pkg_name, dest)
-                    # update checksum so we won't refetch next time.
-                    if use_checksum:
-                        self.update_checksum(dest)
-                return fetcher
-            except (error.PackageFetchError, error.AutoservRunError):
-                # The package could not be found in this repo, continue looking
-                logging.debug('%s could not be fetched from %s', pkg_name,
-                              fetcher.url)
+        # reverse order, assuming that the 'newest' repos are most desirable,
+        # but leave the mirrors that were slow or unreachable for last
+        fetch_start_time = time.time()
+        fetchers = self._order_by_health(reversed(repositories))
+        while fetchers:
+            for fetcher in fetchers:
+                try:
+                    if isinstance(fetcher, GitFetcher):
+                        use_checksum = False
+                    # different fetchers have different install requirements
+                    dest = fetcher.install_pkg_setup(pkg_name, dest_path,
+                                                     install)[1]
+
+                    # Fetch the package if it is not there, the checksum does
+                    # not match, or checksums are disabled entirely
+                    need_to_fetch = (
+                        not use_checksum or not pkg_exists or
+                        not self.compare_checksum(dest, fetcher.url))
+                    if need_to_fetch:
+                        fetcher.fetch_pkg_file(pkg_name, dest)
+                        # update checksum so we won't refetch next time.
+                        if use_checksum:
+                            self.update_checksum(dest)
+                    return fetcher
+                except (error.PackageFetchError, error.AutoservRunError):
+                    # The package could not be found in this repo, continue
+                    # looking
+                    logging.debug('%s could not be fetched from %s', pkg_name,
+                                  fetcher.url)
+
+            # none of the repos had the package, test the mirrors that were
+            # skipped as unreachable again instead of giving up on them
+            retry_urls = self._forget_unreachable_mirrors(
+                [fetcher.url for fetcher in fetchers], fetch_start_time)
+            fetchers = [fetcher for fetcher in fetchers
+                        if fetcher.url in retry_urls]
 
         repo_url_list = [repo.url for repo in repositories]
         message = ('%s could not be fetched from any of the repos %s' %
@@ -718,6 +885,10 @@ class BasePackageManager(object):
             # get the packages' checksum file and update it with the current
             # package's checksum
             self.update_checksum(pkg_path)
+            if self._checksum_batch_depth:
+                # the checksum file gets uploaded at the end of the batch
+                self._defer_checksum_upload(upload_path_list)
+                update_checksum = False
 
         commands = []
         for path in upload_path_list:
@@ -842,7 +1013,11 @@ class BasePackageManager(object):
         # remove the package and upload the checksum file to the repos
         for path in remove_path_list:
             self.remove_pkg_file(pkg_name, path)
-            self.upload_pkg_file(checksum_path, path)
+        if self._checksum_batch_depth:
+            self._defer_checksum_upload(remove_path_list)
+        else:
+            for path in remove_path_list:
+                self.upload_pkg_file(checksum_path, path)
 
     def remove_pkg_file(self, filename, pkg_dir):
         '''
@@ -886,63 +1061,159 @@ class BasePackageManager(object):
         the checksum file.
         The checksum file is assumed to be present in self.pkgmgr_dir
         '''
-        checksum_path = self._get_checksum_file_path()
-        if not self._checksum_dict:
-            # Fetch the checksum file
-            try:
-                try:
-                    self._run_command("ls %s" % checksum_path)
-                except (error.CmdError, error.AutoservRunError):
+        with self._checksum_lock:
+            checksum_path = self._get_checksum_file_path()
+            if not self._checksum_dict:
+                # Read the checksum file into memory
+                checksum_file_contents = self._read_file(checksum_path)
+                if checksum_file_contents is None:
                     # The packages checksum file does not exist locally.
                     # See if it is present in the repositories.
-                    self.fetch_pkg(CHECKSUM_FILE, checksum_path)
-            except error.PackageFetchError:
-                # This should not happen whilst fetching a package..if a
-                # package is present in the repository, the corresponding
-                # checksum file should also be automatically present. This
-                # case happens only when a package
-                # is being uploaded and if it is the first package to be
-                # uploaded to the repos (hence no checksum file created yet)
-                # Return an empty dictionary in that case
-                return {}
-
-            # Read the checksum file into memory
-            checksum_file_contents = self._run_command('cat %s' %
-                                                       checksum_path).stdout
-
-            # Return {} if we have an empty checksum file present
-            if not checksum_file_contents.strip():
-                return {}
-
-            # Parse the checksum file contents into self._checksum_dict
-            for line in checksum_file_contents.splitlines():
-                checksum, package_name = line.split(None, 1)
-                self._checksum_dict[package_name] = checksum
-
-        return self._checksum_dict
+                    try:
+                        self.fetch_pkg(CHECKSUM_FILE, checksum_path)
+                    except error.PackageFetchError:
+                        # This should not happen whilst fetching a
+                        # package..if a package is present in the repository,
+                        # the corresponding checksum file should also be
+                        # automatically present. This case happens only when
+                        # a package is being uploaded and if it is the first
+                        # package to be uploaded to the repos (hence no
+                        # checksum file created yet)
+                        # Return an empty dictionary in that case
+                        return {}
+                    checksum_file_contents = (
+                        self._read_file(checksum_path) or '')
+
+                # Return {} if we have an empty checksum file present
+                if not checksum_file_contents.strip():
+                    return {}
+
+                # Parse the checksum file contents into self._checksum_dict
+                for line in checksum_file_contents.splitlines():
+                    checksum, package_name = line.split(None, 1)
+                    self._checksum_dict[package_name] = checksum
+
+            return self._checksum_dict
 
     def _save_checksum_dict(self, checksum_dict):
         '''
         Save the checksum dictionary onto the checksum file. Update the
         local _checksum_dict variable with this new set of values.
+        Within a checksum_batch() the file is only written at the end.
         checksum_dict :  New checksum dictionary
-        checksum_dir  :  The directory in which to store the checksum file to.
         '''
-        checksum_path = self._get_checksum_file_path()
         self._checksum_dict = checksum_dict.copy()
+        self._checksum_dirty = True
+        if not self._checksum_batch_depth:
+            self._write_checksum_file()
+
+    def _write_checksum_file(self):
+        checksum_path = self._get_checksum_file_path()
         checksum_contents = '\n'.join(checksum + ' ' + pkg_name
                                       for pkg_name, checksum in
-                                      checksum_dict.items())
+                                      sorted(self._checksum_dict.items()))
         # Write the checksum file back to disk
-        self._run_command('echo "%s" > %s' % (checksum_contents,
-                                              checksum_path),
-                          _run_command_dargs={'verbose': False})
+        if self._local:
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(checksum_path),
+                                             prefix='.' + CHECKSUM_FILE)
+            with os.fdopen(fd, 'w') as checksum_file:
+                checksum_file.write(checksum_contents + '\n')
+            os.chmod(temp_path, 0o644)
+            os.rename(temp_path, checksum_path)
+        else:
+            self._run_command('echo "%s" > %s' % (checksum_contents,
+                                                  checksum_path),
+                              _run_command_dargs={'verbose': False})
+        self._checksum_dirty = False
+
+    def _defer_checksum_upload(self, upload_paths):
+        for path in upload_paths:
+            if path not in self._checksum_upload_paths:
+                self._checksum_upload_paths.append(path)
+
+    @contextlib.contextmanager
+    def checksum_batch(self):
+        '''
+        Context manager to update the checksums of many packages at once:
+        the checksum file is written, and uploaded to the repos packages
+        were uploaded to or removed from, once at the end of the block.
+        '''
+        self._checksum_batch_depth += 1
+        try:
+            yield
+        finally:
+            self._checksum_batch_depth -= 1
+            if not self._checksum_batch_depth:
+                if self._checksum_dirty:
+                    self._write_checksum_file()
+                upload_paths = self._checksum_upload_paths
+                self._checksum_upload_paths = []
+                for path in upload_paths:
+                    self.upload_pkg_file(self._get_checksum_file_path(), path)
+
+    def _read_file(self, path):
+        '''
+        Return the contents of the file at path, or None if it can't be read.
+        '''
+        if self._local:
+            try:
+                with open(path) as fileobj:
+                    return fileobj.read()
+            except IOError:
+                return None
+        try:
+            return self._run_command('cat %s' % path).stdout
+        except (error.CmdError, error.AutoservRunError):
+            return None
+
+    def _check_fetch_destination(self, dest_path):
+        '''
+        Check that the directory of dest_path exists, in a single command
+        when the run function is remote.
+
+        :return: Whether dest_path itself exists.
+        :raise PackageFetchError: If the directory of dest_path doesn't exist.
+        '''
+        dest_dir = os.path.dirname(dest_path)
+        if self._local:
+            dir_exists = os.path.exists(dest_dir)
+            pkg_exists = os.path.exists(dest_path)
+        else:
+            try:
+                result = self._run_command(
+                    'ls -d %s > /dev/null 2>&1 || exit 2; '
+                    'ls -d %s > /dev/null 2>&1 || exit 1' % (dest_dir,
+                                                             dest_path),
+                    _run_command_dargs={'ignore_status': True})
+            except (error.CmdError, error.AutoservRunError):
+                dir_exists = pkg_exists = False
+            else:
+                dir_exists = result.exit_status in (0, 1)
+                pkg_exists = result.exit_status == 0
+        if not dir_exists:
+            raise error.PackageFetchError("Please provide a valid "
+                                          "destination: %s " % dest_path)
+        return pkg_exists
 
     def compute_checksum(self, pkg_path):
         '''
         Compute the MD5 checksum for the package file and return it.
+        Checksums of local files are cached until their size or mtime change.
         pkg_path : The complete path for the package file
         '''
+        if self._local:
+            pkg_stat = os.stat(pkg_path)
+            key = (pkg_stat.st_size, pkg_stat.st_mtime_ns)
+            cached = self._file_checksums.get(pkg_path)
+            if cached and cached[0] == key:
+                return cached[1]
+            md5 = hashlib.md5()
+            with open(pkg_path, 'rb') as pkg_file:
+                for block in iter(lambda: pkg_file.read(1 << 20), b''):
+                    md5.update(block)
+            checksum = md5.hexdigest()
+            self._file_checksums[pkg_path] = (key, checksum)
+            return checksum
         os_dep.command("md5sum")
         md5sum_output = self._run_command("md5sum %s " % pkg_path).stdout
         return md5sum_output.split()[0]
@@ -956,9 +1227,10 @@ class BasePackageManager(object):
         '''
         # Compute the new checksum
         new_checksum = self.compute_checksum(pkg_path)
-        checksum_dict = self._get_checksum_dict()
-        checksum_dict[os.path.basename(pkg_path)] = new_checksum
-        self._save_checksum_dict(checksum_dict)
+        with self._checksum_lock:
+            checksum_dict = self._get_checksum_dict()
+            checksum_dict[os.path.basename(pkg_path)] = new_checksum
+            self._save_checksum_dict(checksum_dict)
 
     def remove_checksum(self, pkg_name):
         '''
@@ -967,10 +1239,11 @@ class BasePackageManager(object):
         repositories in order clean its corresponding checksum.
         pkg_name :  The name of the package to be removed
         '''
-        checksum_dict = self._get_checksum_dict()
-        if pkg_name in checksum_dict:
-            del checksum_dict[pkg_name]
-        self._save_checksum_dict(checksum_dict)
+        with self._checksum_lock:
+            checksum_dict = self._get_checksum_dict()
+            if pkg_name in checksum_dict:
+                del checksum_dict[pkg_name]
+            self._save_checksum_dict(checksum_dict)
 
     def compare_checksum(self, pkg_path, repo_url):
         '''
@@ -16,13 +16,16 @@
 #
 #  The full GNU General Public License is included in this distribution in
 #  the file called "COPYING".
+import os
+import shutil
+import tempfile
 import unittest
 try:
     import autotest.common as common  # pylint: disable=W0611
 except ImportError:
     from . import common  # pylint: disable=W0611
 from autotest.client.utils import error
-from autotest.client.shared import base_packages
+from autotest.client.shared import base_packages, utils
 
 
 class TestParseSSH(unittest.TestCase):
@@ -42,5 +45,217 @@ class TestParseSSH(unittest.TestCase):
             self.assertEqual(expected, base_packages.parse_ssh_path(val))
 
 
+
+class TestChecksums(unittest.TestCase):
+
+    def setUp(self):
+        self.pkgmgr_dir = tempfile.mkdtemp(suffix='unittest')
+        self.pkgmgr = base_packages.BasePackageManager(self.pkgmgr_dir)
+        self.pkg_path = os.path.join(self.pkgmgr_dir, 'test-foo.tar.bz2')
+        self._write_pkg('contents')
+
+    def tearDown(self):
+        shutil.rmtree(self.pkgmgr_dir, ignore_errors=True)
+
+    def _write_pkg(self, contents, mtime=1000000000):
+        open(self.pkg_path, 'w').write(contents)
+        os.utime(self.pkg_path, (mtime, mtime))
+
+    def _read_checksum_file(self):
+        return open(os.path.join(self.pkgmgr_dir,
+                                 base_packages.CHECKSUM_FILE)).read()
+
+    def test_compute_checksum(self):
+        self.assertEqual('98bf7d8c15784f0a3d63204441e1e2aa',
+                         self.pkgmgr.compute_checksum(self.pkg_path))
+
+    def test_checksum_cached_until_file_changes(self):
+        checksum = self.pkgmgr.compute_checksum(self.pkg_path)
+        # same size and mtime, the cached checksum is used
+        self._write_pkg('CONTENTS')
+        self.assertEqual(checksum, self.pkgmgr.compute_checksum(self.pkg_path))
+        self._write_pkg('CONTENTS', mtime=1000000001)
+        self.assertNotEqual(checksum,
+                            self.pkgmgr.compute_checksum(self.pkg_path))
+
+    def test_update_checksum(self):
+        self.pkgmgr.update_checksum(self.pkg_path)
+        self.assertEqual('98bf7d8c15784f0a3d63204441e1e2aa test-foo.tar.bz2\n',
+                         self._read_checksum_file())
+        self.assertTrue(self.pkgmgr.compare_checksum(self.pkg_path, None))
+
+    def test_checksum_batch(self):
+        writes = []
+        write_checksum_file = self.pkgmgr._write_checksum_file
+
+        def counting_write():
+            writes.append(1)
+            write_checksum_file()
+        self.pkgmgr._write_checksum_file = counting_write
+        with self.pkgmgr.checksum_batch():
+            self.pkgmgr.update_checksum(self.pkg_path)
+            self.pkgmgr.remove_checksum('test-foo.tar.bz2')
+            self.pkgmgr.update_checksum(self.pkg_path)
+            self.assertEqual([], writes)
+        self.assertEqual([1], writes)
+        self.assertTrue('test-foo.tar.bz2' in self._read_checksum_file())
+
+    def test_check_fetch_destination(self):
+        self.assertTrue(self.pkgmgr._check_fetch_destination(self.pkg_path))
+        self.assertFalse(self.pkgmgr._check_fetch_destination(
+            os.path.join(self.pkgmgr_dir, 'missing')))
+        self.assertRaises(error.PackageFetchError,
+                          self.pkgmgr._check_fetch_destination,
+                          os.path.join(self.pkgmgr_dir, 'missing', 'pkg'))
+
+    def test_check_fetch_destination_remote(self):
+        commands = []
+
+        def run(command, **dargs):
+            commands.append(command)
+            return utils.run(command, **dargs)
+        pkgmgr = base_packages.BasePackageManager(self.pkgmgr_dir,
+                                                  run_function=run)
+        self.assertTrue(pkgmgr._check_fetch_destination(self.pkg_path))
+        self.assertFalse(pkgmgr._check_fetch_destination(
+            os.path.join(self.pkgmgr_dir, 'missing')))
+        self.assertRaises(error.PackageFetchError,
+                          pkgmgr._check_fetch_destination,
+                          os.path.join(self.pkgmgr_dir, 'missing', 'pkg'))
+        self.assertEqual(3, len(commands))
+
+
+class FakeFetcher(base_packages.RepositoryFetcher):
+
+    def __init__(self, package_manager, repository_url, packages):
+        super(FakeFetcher, self).__init__(package_manager, repository_url)
+        self.packages = packages
+        self.fetched = []
+
+    def fetch_pkg_file(self, filename, dest_path):
+        if filename not in self.packages:
+            raise error.PackageFetchError('%s not found' % filename)
+        self.fetched.append(filename)
+        open(dest_path, 'w').write(self.packages[filename])
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.pkgmgr_dir = tempfile.mkdtemp(suffix='unittest')
+        self.fetch_dir = os.path.join(self.pkgmgr_dir, 'packages')
+        self.pkgmgr = base_packages.BasePackageManager(self.pkgmgr_dir)
+        self.mirror = FakeFetcher(self.pkgmgr, 'mirror',
+                                  {'test-foo.tar.bz2': 'foo',
+                                   'test-bar.tar.bz2': 'bar',
+                                   'dep-baz.tar.bz2': 'baz'})
+        self.pkgmgr.add_repository(self.mirror)
+
+    def tearDown(self):
+        shutil.rmtree(self.pkgmgr_dir, ignore_errors=True)
+
+    def test_prefetch_pkgs(self):
+        pkgs = [('foo', 'test'), ('bar', 'test'), ('baz', 'dep'),
+                ('foo', 'test')]
+        self.assertEqual({}, self.pkgmgr.prefetch_pkgs(pkgs, self.fetch_dir,
+                                                       max_parallel=2))
+        self.assertEqual(['dep-baz.tar.bz2', 'test-bar.tar.bz2',
+                          'test-foo.tar.bz2'], sorted(self.mirror.fetched))
+        self.assertEqual(sorted(self.mirror.fetched),
+                         sorted(os.listdir(self.fetch_dir)))
+        # the install finds the prefetched package up to date
+        self.pkgmgr.fetch_pkg('test-foo.tar.bz2', self.fetch_dir,
+                              use_checksum=True, install=True)
+        self.assertEqual(3, len(self.mirror.fetched))
+
+    def test_prefetch_pkgs_failures(self):
+        failures = self.pkgmgr.prefetch_pkgs(
+            [('foo', 'test'), ('missing', 'test')], self.fetch_dir)
+        self.assertEqual([('missing', 'test')], list(failures))
+        self.assertEqual(['test-foo.tar.bz2'], self.mirror.fetched)
+
+    def test_unhealthy_mirror_tried_last(self):
+        newer_mirror = FakeFetcher(self.pkgmgr, 'newer',
+                                   {'test-foo.tar.bz2': 'newer foo'})
+        self.pkgmgr.add_repository(newer_mirror)
+        os.mkdir(self.fetch_dir)
+        dest_path = os.path.join(self.fetch_dir, 'test-foo.tar.bz2')
+        self.assertEqual(newer_mirror, self.pkgmgr.fetch_pkg(
+            'test-foo.tar.bz2', dest_path))
+        self.pkgmgr.set_mirror_health('newer', base_packages.MIRROR_SLOW)
+        self.assertEqual(self.mirror, self.pkgmgr.fetch_pkg(
+            'test-foo.tar.bz2', dest_path))
+
+
+class TestHttpFetcherHealth(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.fail_wget = False
+        self.pkgmgr = base_packages.BasePackageManager('/tmp',
+                                                       run_function=self._run)
+        self.fetcher = base_packages.HttpFetcher(self.pkgmgr, 'http://mirror')
+
+    def _run(self, command, **dargs):
+        self.commands.append(command)
+        if command.startswith('wget') and self.fail_wget:
+            raise error.CmdError(command, utils.CmdResult(command,
+                                                          exit_status=4))
+        return utils.CmdResult(command, stdout='/tmp/tmp.fake\n',
+                               exit_status=0)
+
+    def _wget_count(self):
+        return len([command for command in self.commands
+                    if command.startswith('wget')])
+
+    def test_reachable_mirror_tested_once(self):
+        self.fetcher._quick_http_test()
+        self.fetcher._quick_http_test()
+        self.assertEqual(1, self._wget_count())
+        self.assertEqual(base_packages.MIRROR_OK,
+                         self.pkgmgr.get_mirror_health('http://mirror'))
+
+    def test_unreachable_mirror_fails_fast(self):
+        self.fail_wget = True
+        self.assertRaises(error.PackageFetchError,
+                          self.fetcher._quick_http_test)
+        self.assertRaises(error.PackageFetchError,
+                          self.fetcher._quick_http_test)
+        self.assertEqual(1, self._wget_count())
+        self.assertEqual(base_packages.MIRROR_UNREACHABLE,
+                         self.pkgmgr.get_mirror_health('http://mirror'))
+
+    def test_unreachable_mirror_tested_again(self):
+        self.pkgmgr.mirror_retry_seconds = 0
+        self.fail_wget = True
+        self.assertRaises(error.PackageFetchError,
+                          self.fetcher._quick_http_test)
+        self.fail_wget = False
+        self.fetcher._quick_http_test()
+        self.assertEqual(2, self._wget_count())
+        self.assertEqual(base_packages.MIRROR_OK,
+                         self.pkgmgr.get_mirror_health('http://mirror'))
+
+    def test_unreachable_mirror_tested_when_no_other_has_package(self):
+        self.fail_wget = True
+        self.assertRaises(error.PackageFetchError,
+                          self.fetcher._quick_http_test)
+        self.fail_wget = False
+        self.pkgmgr.add_repository(self.fetcher)
+        self.pkgmgr.fetch_pkg('test-foo.tar.bz2', '/tmp/test-foo.tar.bz2')
+        self.assertEqual(3, self._wget_count())
+
+    def test_slow_fetch(self):
+        self.fetcher._quick_http_test()
+        self.pkgmgr.mirror_slow_seconds = -1
+        self.fetcher.fetch_pkg_file('test-foo.tar.bz2', '/tmp/foo')
+        self.assertEqual(base_packages.MIRROR_SLOW,
+                         self.pkgmgr.get_mirror_health('http://mirror'))
+        self.pkgmgr.mirror_slow_seconds = 10
+        self.fetcher.fetch_pkg_file('test-foo.tar.bz2', '/tmp/foo')
+        self.assertEqual(base_packages.MIRROR_OK,
+                         self.pkgmgr.get_mirror_health('http://mirror'))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -20,6 +20,7 @@ import random
 import re
 import resource
 import select
+import selectors
 import shutil
 import signal
 import socket
@@ -82,6 +83,9 @@ DEFAULT_STDERR_LEVEL = logging.ERROR
 STDOUT_PREFIX = '[stdout] '
 STDERR_PREFIX = '[stderr] '
 
+# bytes read from or written to the pipes of a BgJob at a time
+PIPE_IO_SIZE = 65536
+
 
 def get_stream_tee_file(stream, level, prefix=''):
     if stream is None:
@@ -131,7 +135,11 @@ class BgJob(object):
         self.stderr_file = stderr_file
 
     def process_output(self, stdout=True, final_read=False):
-        """output_prepare must be called prior to calling this"""
+        """
+        output_prepare must be called prior to calling this
+
+        :return: The data read, empty at the end of the output.
+        """
         if stdout:
             pipe, buf, tee = self.sp.stdout, self.stdout_file, self.stdout_tee
         else:
@@ -141,15 +149,17 @@ class BgJob(object):
             # read in all the data we can from pipe and then stop
             data = []
             while select.select([pipe], [], [], 0)[0]:
-                data.append(os.read(pipe.fileno(), 1024).decode('latin-1'))
+                data.append(os.read(pipe.fileno(),
+                                    PIPE_IO_SIZE).decode('latin-1'))
                 if len(data[-1]) == 0:
                     break
             data = "".join(data)
         else:
             # perform a single read
-            data = os.read(pipe.fileno(), 1024).decode('latin-1')
+            data = os.read(pipe.fileno(), PIPE_IO_SIZE).decode('latin-1')
         buf.write(data)
         tee.write(data)
+        return data
 
     def cleanup(self):
         self.stdout_tee.flush()
@@ -1057,81 +1067,166 @@ def join_bg_jobs(bg_jobs, timeout=None):
     return bg_jobs
 
 
-def _wait_for_commands(bg_jobs, start_time, timeout):
-    # This returns True if it must return due to a timeout, otherwise False.
+def _open_pidfd(pid):
+    """
+    :return: A file descriptor that becomes readable when process pid exits,
+             or None where pidfds aren't supported (before Linux 5.3).
+    """
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
 
-    # To check for processes which terminate without producing any output
-    # a 1 second timeout is used in select.
-    SELECT_TIMEOUT = 1
 
-    read_list = []
-    write_list = []
-    reverse_dict = {}
+class _command_waiter(object):
+
+    """
+    Event loop feeding the stdin of BgJobs and reading their output.
+
+    Process exits are noticed through pidfds registered with the selector,
+    without polling. Where pidfds aren't available, processes are polled
+    every POLL_INTERVAL seconds, and right after they close their output.
+    """
+
+    POLL_INTERVAL = 1
+    # exit status is usually available right after the output is closed
+    POLL_AFTER_EOF_INTERVAL = 0.01
+
+    def __init__(self, bg_jobs, start_time):
+        self.start_time = start_time
+        self.selector = selectors.DefaultSelector()
+        self.running = set()
+        self.polled = set()
+        self.pidfds = {}
+        self.stdin_data = {}
+        self.open_outputs = {}
 
-    for bg_job in bg_jobs:
-        read_list.append(bg_job.sp.stdout)
-        read_list.append(bg_job.sp.stderr)
-        reverse_dict[bg_job.sp.stdout] = (bg_job, True)
-        reverse_dict[bg_job.sp.stderr] = (bg_job, False)
-        if bg_job.string_stdin is not None:
-            write_list.append(bg_job.sp.stdin)
-            reverse_dict[bg_job.sp.stdin] = bg_job
-
-    if timeout:
-        stop_time = start_time + timeout
-        time_left = stop_time - time.time()
-    else:
-        time_left = None  # so that select never times out
-
-    while not timeout or time_left > 0:
-        # select will return when we may write to stdin or when there is
-        # stdout/stderr output we can read (including when it is
-        # EOF, that is the process has terminated).
-        read_ready, write_ready, _ = select.select(read_list, write_list, [],
-                                                   SELECT_TIMEOUT)
-
-        # os.read() has to be used instead of
-        # subproc.stdout.read() which will otherwise block
-        for file_obj in read_ready:
-            bg_job, is_stdout = reverse_dict[file_obj]
-            bg_job.process_output(is_stdout)
-
-        for file_obj in write_ready:
-            # we can write PIPE_BUF bytes without blocking
-            # POSIX requires PIPE_BUF is >= 512
-            bg_job = reverse_dict[file_obj]
-            msg = bg_job.string_stdin[:512]
-            if type(msg) == str:
-                msg = msg.encode()
-            file_obj.write(msg)
-            bg_job.string_stdin = bg_job.string_stdin[512:]
-            # no more input data, close stdin, remove it from the select set
-            if not bg_job.string_stdin:
-                file_obj.close()
-                write_list.remove(file_obj)
-                del reverse_dict[file_obj]
-
-        all_jobs_finished = True
         for bg_job in bg_jobs:
             if bg_job.result.exit_status is not None:
                 continue
-
-            bg_job.result.exit_status = bg_job.sp.poll()
-            if bg_job.result.exit_status is not None:
-                # process exited, remove its stdout/stdin from the select set
-                bg_job.result.duration = time.time() - start_time
-                read_list.remove(bg_job.sp.stdout)
-                read_list.remove(bg_job.sp.stderr)
-                del reverse_dict[bg_job.sp.stdout]
-                del reverse_dict[bg_job.sp.stderr]
+            self.running.add(bg_job)
+            self.open_outputs[bg_job] = 2
+            self.selector.register(bg_job.sp.stdout, selectors.EVENT_READ,
+                                   (self._read, bg_job, True))
+            self.selector.register(bg_job.sp.stderr, selectors.EVENT_READ,
+                                   (self._read, bg_job, False))
+            if bg_job.string_stdin is not None:
+                data = bg_job.string_stdin
+                if isinstance(data, str):
+                    data = data.encode()
+                self.stdin_data[bg_job] = memoryview(data)
+                os.set_blocking(bg_job.sp.stdin.fileno(), False)
+                self.selector.register(bg_job.sp.stdin, selectors.EVENT_WRITE,
+                                       (self._write, bg_job, None))
+            pidfd = _open_pidfd(bg_job.sp.pid)
+            if pidfd is None:
+                self.polled.add(bg_job)
             else:
-                all_jobs_finished = False
+                self.pidfds[bg_job] = pidfd
+                self.selector.register(pidfd, selectors.EVENT_READ,
+                                       (self._reap, bg_job, None))
+
+    def _read(self, file_obj, bg_job, is_stdout):
+        if not bg_job.process_output(is_stdout):
+            self.selector.unregister(file_obj)
+            self.open_outputs[bg_job] -= 1
+
+    def _close_stdin(self, bg_job):
+        self.selector.unregister(bg_job.sp.stdin)
+        bg_job.sp.stdin.close()
+        bg_job.string_stdin = bg_job.string_stdin[:0]
+        del self.stdin_data[bg_job]
+
+    def _write(self, file_obj, bg_job, unused):
+        data = self.stdin_data[bg_job]
+        try:
+            written = os.write(file_obj.fileno(), data[:PIPE_IO_SIZE])
+        except BlockingIOError:
+            return
+        except BrokenPipeError:
+            # the process won't read the rest of its input
+            self._close_stdin(bg_job)
+            return
+        self.stdin_data[bg_job] = data = data[written:]
+        # no more input data, close stdin
+        if not data:
+            self._close_stdin(bg_job)
 
-        if all_jobs_finished:
+    def _reap(self, unused_file_obj, bg_job, unused):
+        if bg_job.sp.poll() is None:
+            return
+        # process exited, stop watching it; the output left in the pipes is
+        # read by join_bg_jobs
+        bg_job.result.exit_status = bg_job.sp.returncode
+        bg_job.result.duration = time.time() - self.start_time
+        self.running.discard(bg_job)
+        self.polled.discard(bg_job)
+        for file_obj in (bg_job.sp.stdout, bg_job.sp.stderr):
+            if self._is_registered(file_obj):
+                self.selector.unregister(file_obj)
+        if bg_job in self.stdin_data:
+            self.selector.unregister(bg_job.sp.stdin)
+            del self.stdin_data[bg_job]
+        pidfd = self.pidfds.pop(bg_job, None)
+        if pidfd is not None:
+            self.selector.unregister(pidfd)
+            os.close(pidfd)
+
+    def _is_registered(self, file_obj):
+        try:
+            self.selector.get_key(file_obj)
+        except KeyError:
             return False
+        return True
+
+    def _poll_timeout(self):
+        if not self.polled:
+            return None
+        for bg_job in self.polled:
+            if not self.open_outputs[bg_job]:
+                return self.POLL_AFTER_EOF_INTERVAL
+        return self.POLL_INTERVAL
+
+    def wait(self, timeout):
+        """
+        Wait for all the jobs to finish.
 
+        :return: True if the timeout expired first, otherwise False.
+        """
         if timeout:
-            time_left = stop_time - time.time()
+            stop_time = self.start_time + timeout
+        while self.running:
+            select_timeout = self._poll_timeout()
+            if timeout:
+                time_left = stop_time - time.time()
+                if time_left <= 0:
+                    return True
+                if select_timeout is None or time_left < select_timeout:
+                    select_timeout = time_left
+            for key, _ in self.selector.select(select_timeout):
+                handler, bg_job, arg = key.data
+                # skip the events of jobs reaped earlier in this batch
+                if bg_job in self.running:
+                    handler(key.fileobj, bg_job, arg)
+            for bg_job in list(self.polled):
+                self._reap(None, bg_job, None)
+        return False
+
+    def close(self):
+        for pidfd in self.pidfds.values():
+            os.close(pidfd)
+        self.pidfds.clear()
+        self.selector.close()
+
+
+def _wait_for_commands(bg_jobs, start_time, timeout):
+    # This returns True if it must return due to a timeout, otherwise False.
+    waiter = _command_waiter(bg_jobs, start_time)
+    try:
+        if not waiter.wait(timeout):
+            return False
+    finally:
+        waiter.close()
 
     # Kill all processes which did not complete prior to timeout
     for bg_job in bg_jobs:
@@ -5,6 +5,7 @@ import logging
 import os
 import socket
 import subprocess
+import time
 import unittest
 import urllib.request, urllib.error, urllib.parse
 
@@ -664,6 +665,31 @@ class test_run(unittest.TestCase):
         self.__check_result(utils.run(cmd, verbose=False, stdin='hi!\n'),
                             cmd, stdout='hi!\n')
 
+    def test_stdin_large_string(self):
+        data = 'x' * (utils.PIPE_IO_SIZE * 4 + 1)
+        self.__check_result(utils.run('cat', verbose=False, stdin=data),
+                            'cat', stdout=data)
+
+    def test_stdin_not_read(self):
+        data = 'x' * (utils.PIPE_IO_SIZE * 4)
+        self.__check_result(utils.run('true', verbose=False, stdin=data),
+                            'true')
+
+    def test_exit_with_output_still_open(self):
+        # a background child keeps the output pipes open
+        cmd = 'sleep 10 & echo done'
+        start = time.time()
+        self.__check_result(utils.run(cmd, verbose=False), cmd,
+                            stdout='done\n')
+        self.assertTrue(time.time() - start < 5)
+
+    def test_without_pidfd(self):
+        self.god.stub_function(utils, '_open_pidfd')
+        utils._open_pidfd.expect_any_call().and_return(None)
+        cmd = 'echo output'
+        self.__check_result(utils.run(cmd, verbose=False), cmd,
+                            stdout='output\n')
+
     def test_safe_args(self):
         cmd = 'echo "hello \\"world" "again"'
         self.__check_result(utils.run(
@@ -169,6 +169,8 @@ class DatabaseConnection(object):
     * max_reconnect_attempts: maximum number of time to try reconnecting before
       giving up.  Setting to RECONNECT_FOREVER removes the limit.
     * rowcount - will hold cursor.rowcount after each call to execute().
+    * query_count, row_count - number of queries executed and rows returned
+      or affected since the object was created.
     * settings_section - the section in which to find DB information. this
       should be passed to the constructor, not set later, and may be None, in
       which case information must be passed to connect().
@@ -181,6 +183,8 @@ class DatabaseConnection(object):
         self.settings_section = settings_section
         self._backend = None
         self.rowcount = None
+        self.query_count = 0
+        self.row_count = 0
         self.debug = debug
 
         # reconnect defaults
@@ -279,6 +283,11 @@ class DatabaseConnection(object):
             results = self._backend.execute(query, parameters)
 
         self.rowcount = self._backend.rowcount
+        self.query_count += 1
+        if results:
+            self.row_count += len(results)
+        elif self.rowcount and self.rowcount > 0:
+            self.row_count += self.rowcount
         return results
 
     def get_database_info(self):
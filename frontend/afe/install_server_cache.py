@@ -0,0 +1,119 @@
+"""
+Cached install server lookups for the RPC interface.
+
+Listing hosts needs the install server system of every host and the list of
+install server profiles. Both are kept for INSTALL_SERVER.cache_ttl seconds,
+and the systems of many hosts are looked up with a single call, so the number
+of XML-RPC calls doesn't grow with the number of hosts listed.
+"""
+
+import threading
+import time
+import xmlrpc.client
+
+from autotest.client.shared.settings import settings
+from autotest.server.hosts.remote import get_install_server_info
+
+# looking up more hosts than this fetches all the systems at once
+BULK_LOOKUP_MIN_HOSTS = 20
+
+
+class CobblerCache(object):
+
+    """
+    Cobbler XML-RPC lookups with a time bounded cache.
+
+    :param xmlrpc_url: URL of the Cobbler XML-RPC API.
+    :param ttl: Seconds cached profiles and systems are used for.
+    """
+
+    def __init__(self, xmlrpc_url, ttl):
+        self.xmlrpc_url = xmlrpc_url
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._profiles = None
+        self._profiles_time = 0
+        # hostname -> (lookup time, list of systems with that name)
+        self._systems = {}
+
+    def _server(self):
+        # proxies are not thread safe, and cheap to create
+        return xmlrpc.client.ServerProxy(self.xmlrpc_url)
+
+    def get_profiles(self):
+        """:return: A new list with the names of the install server profiles."""
+        with self._lock:
+            if (self._profiles is not None and
+                    time.time() - self._profiles_time < self.ttl):
+                return list(self._profiles)
+        profiles = self._server().get_item_names('profile')
+        with self._lock:
+            self._profiles = profiles
+            self._profiles_time = time.time()
+        return list(profiles)
+
+    def find_systems(self, hostnames):
+        """
+        :param hostnames: Names of the systems to look up.
+        :return: A dict mapping each hostname to the list of install server
+                systems with that name.
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            for hostname in hostnames:
+                cached = self._systems.get(hostname)
+                if cached is not None and now - cached[0] < self.ttl:
+                    found[hostname] = cached[1]
+        missing = [hostname for hostname in hostnames
+                   if hostname not in found]
+        if not missing:
+            return found
+
+        server = self._server()
+        looked_up = {}
+        if len(missing) >= BULK_LOOKUP_MIN_HOSTS:
+            for system in server.get_systems():
+                looked_up.setdefault(system['name'], []).append(system)
+            for hostname in missing:
+                looked_up.setdefault(hostname, [])
+        else:
+            for hostname in missing:
+                looked_up[hostname] = server.find_system({"name": hostname},
+                                                         True)
+        with self._lock:
+            for hostname, systems in looked_up.items():
+                self._systems[hostname] = (now, systems)
+        for hostname in missing:
+            found[hostname] = looked_up[hostname]
+        return found
+
+    def invalidate(self):
+        with self._lock:
+            self._profiles = None
+            self._systems.clear()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cobbler_cache():
+    """
+    :return: The CobblerCache of the configured install server, None if no
+            Cobbler install server is configured.
+    """
+    install_server_info = get_install_server_info()
+    install_server_type = install_server_info.get('type', None)
+    install_server_url = install_server_info.get('xmlrpc_url', None)
+    if install_server_type != 'cobbler' or not install_server_url:
+        return None
+    ttl = settings.get_value('INSTALL_SERVER', 'cache_ttl', type=int,
+                             default=60)
+    with _caches_lock:
+        cache = _caches.get(install_server_url)
+        if cache is None:
+            cache = CobblerCache(install_server_url, ttl)
+            _caches[install_server_url] = cache
+        cache.ttl = ttl
+        return cache
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+import unittest
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    from . import common  # pylint: disable=W0611
+from autotest.frontend.afe import install_server_cache
+
+
+class FakeCobblerServer(object):
+
+    def __init__(self, systems, profiles):
+        self.systems = systems
+        self.profiles = profiles
+        self.calls = []
+
+    def get_item_names(self, item_type):
+        self.calls.append('get_item_names')
+        return list(self.profiles)
+
+    def find_system(self, criteria, return_list):
+        self.calls.append('find_system')
+        return [system for system in self.systems
+                if system['name'] == criteria['name']]
+
+    def get_systems(self):
+        self.calls.append('get_systems')
+        return list(self.systems)
+
+
+class CobblerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        systems = [{'name': 'host%d' % index, 'profile': 'fedora'}
+                   for index in range(50)]
+        self.server = FakeCobblerServer(systems, ['rhel', 'fedora'])
+        self.cache = install_server_cache.CobblerCache('http://cobbler', 60)
+        self.cache._server = lambda: self.server
+
+    def test_profiles_cached(self):
+        profiles = self.cache.get_profiles()
+        profiles.sort()
+        self.assertEqual(['rhel', 'fedora'], self.cache.get_profiles())
+        self.assertEqual(['get_item_names'], self.server.calls)
+
+    def test_profiles_expire(self):
+        self.cache.ttl = 0
+        self.cache.get_profiles()
+        self.cache.get_profiles()
+        self.assertEqual(['get_item_names'] * 2, self.server.calls)
+
+    def test_find_few_systems(self):
+        systems = self.cache.find_systems(['host1', 'missing'])
+        self.assertEqual({'host1': [{'name': 'host1', 'profile': 'fedora'}],
+                          'missing': []}, systems)
+        self.assertEqual(['find_system'] * 2, self.server.calls)
+        self.cache.find_systems(['host1', 'missing'])
+        self.assertEqual(['find_system'] * 2, self.server.calls)
+
+    def test_find_many_systems_at_once(self):
+        hostnames = ['host%d' % index for index in range(40)] + ['missing']
+        systems = self.cache.find_systems(hostnames)
+        self.assertEqual(['get_systems'], self.server.calls)
+        self.assertEqual(41, len(systems))
+        self.assertEqual([], systems['missing'])
+        self.assertEqual('host39', systems['host39'][0]['name'])
+        # the systems not asked for were cached as well
+        self.cache.find_systems(['host45'])
+        self.assertEqual(['get_systems'], self.server.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
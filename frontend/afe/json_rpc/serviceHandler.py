@@ -164,3 +164,44 @@ class ServiceHandler(object):
                                         "error": err})
 
         return data
+
+    @staticmethod
+    def translateResultStream(result_dict, rows_per_chunk=100):
+        """
+        Like translateResult, for a result that is an iterable of rows: yield
+        the json result in chunks, encoding the rows as they are produced.
+        An error raised while producing or encoding the rows is reported in
+        the error member, after the rows sent so far.
+
+        :param result_dict: a dictionary containing the result, error,
+                            traceback and id.
+        :param rows_per_chunk: number of rows encoded in each chunk.
+        """
+        if result_dict['err'] is not None:
+            yield ServiceHandler.translateResult(result_dict)
+            return
+
+        yield '{"id": %s, "result": [' % json_encoder.encode(result_dict['id'])
+        err = None
+        separator = ''
+        rows = []
+        try:
+            for row in result_dict['result']:
+                rows.append(json_encoder.encode(row))
+                if len(rows) >= rows_per_chunk:
+                    yield separator + ', '.join(rows)
+                    separator = ', '
+                    rows = []
+        except Exception as e:
+            err_traceback = traceback.format_exc()
+            if isinstance(e, TypeError):
+                err = {"name": "JSONEncodeException",
+                       "message": "Result Object Not Serializable",
+                       "traceback": err_traceback}
+            else:
+                err = {"name": e.__class__.__name__,
+                       "message": str(e),
+                       "traceback": err_traceback}
+        if rows:
+            yield separator + ', '.join(rows)
+        yield '], "error": %s}' % json_encoder.encode(err)
@@ -68,6 +68,27 @@ class TestServiceHandler(unittest.TestCase):
         response_obj = eval(response.replace('null', 'None'))
         self.assertNotEqual(response_obj['error'], 'None')
 
+    def _translate_stream(self, rows):
+        result_dict = {'id': 1, 'result': rows, 'err': None,
+                       'err_traceback': None}
+        return ''.join(serviceHandler.ServiceHandler.translateResultStream(
+            result_dict, rows_per_chunk=2))
+
+    def test_translateResultStream(self):
+        response = self._translate_stream(iter([{'a': 1}, {'b': 2}, 3]))
+        response_obj = eval(response.replace('null', 'None'))
+        self.assertEqual(response_obj, {'id': 1, 'error': None,
+                                        'result': [{'a': 1}, {'b': 2}, 3]})
+
+    def test_translateResultStream_error(self):
+        def rows():
+            yield 1
+            raise ValueError('lost the database')
+        response = self._translate_stream(rows())
+        response_obj = eval(response.replace('null', 'None'))
+        self.assertEqual(response_obj['result'], [1])
+        self.assertEqual(response_obj['error']['name'], 'ValueError')
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -2,6 +2,8 @@
 Extensions to Django's model logic.
 """
 
+import re
+
 import django.core.exceptions
 import django.db.models.sql.where
 from autotest.frontend.afe import readonly_connection
@@ -768,9 +770,16 @@ class ModelExtensions(object):
         self.do_validate()
         self.save()
 
+    # aggregate functions, which can't be used in a WHERE clause
+    _AGGREGATE_SQL_RE = re.compile(
+        r'\b(AVG|BIT_AND|BIT_OR|BIT_XOR|COUNT|GROUP_CONCAT|MAX|MIN|STD|'
+        r'STDDEV|STDDEV_POP|STDDEV_SAMP|SUM|VAR_POP|VAR_SAMP|VARIANCE)\s*\(',
+        re.IGNORECASE)
+
     # see query_objects()
-    _SPECIAL_FILTER_KEYS = ('query_start', 'query_limit', 'sort_by',
-                            'extra_args', 'extra_where', 'no_distinct')
+    _SPECIAL_FILTER_KEYS = ('query_start', 'query_limit', 'query_after',
+                            'sort_by', 'extra_args', 'extra_where',
+                            'no_distinct')
 
     @classmethod
     def _extract_special_params(cls, filter_data):
@@ -786,6 +795,58 @@ class ModelExtensions(object):
                 special_params[key] = regular_filters.pop(key)
         return special_params, regular_filters
 
+    @classmethod
+    def _get_sort_column_sql(cls, query, sort_field):
+        """
+        :return: a tuple (sql, params) of the expression sort_field (a
+        sort_by entry without its '-' prefix) sorts on.
+        """
+        if sort_field in query.query.extra_select:
+            sql, params = query.query.extra_select[sort_field]
+            if cls._AGGREGATE_SQL_RE.search(sql):
+                raise ValueError('Cannot pass query_after when sorting on '
+                                 'the aggregate %s' % sort_field)
+            return '(%s)' % sql, list(params)
+        if '.' in sort_field:
+            # a table.column, as accepted by extra(order_by=...)
+            return sort_field, []
+        try:
+            field = cls._meta.get_field(sort_field)
+        except django.core.exceptions.FieldDoesNotExist:
+            # e.g. a related field__column
+            raise ValueError('Cannot pass query_after when sorting on %s' %
+                             sort_field)
+        return cls.objects.get_key_on_this_table(field.column), []
+
+    @classmethod
+    def _apply_keyset(cls, query, sort_by, query_after):
+        """
+        Restrict query to the rows following, in the order of sort_by, the
+        row whose sort_by values are query_after.
+        """
+        if not sort_by:
+            raise ValueError('Cannot pass query_after without sort_by')
+        if len(query_after) != len(sort_by):
+            raise ValueError('query_after must have one value per sort_by '
+                             'field')
+        # (a > %s) OR (a = %s AND b > %s) OR ..., with < for descending
+        # fields
+        equal_clauses, equal_params = [], []
+        clauses, params = [], []
+        for sort_field, value in zip(sort_by, query_after):
+            operator = '>'
+            if sort_field.startswith('-'):
+                operator = '<'
+                sort_field = sort_field[1:]
+            sql, sql_params = cls._get_sort_column_sql(query, sort_field)
+            clauses.append(' AND '.join(equal_clauses +
+                                        ['%s %s %%s' % (sql, operator)]))
+            params.extend(equal_params + sql_params + [value])
+            equal_clauses.append('%s = %%s' % sql)
+            equal_params.extend(sql_params + [value])
+        where = ' OR '.join('(%s)' % clause for clause in clauses)
+        return query.extra(where=[where], params=params)
+
     @classmethod
     def apply_presentation(cls, query, filter_data):
         """
@@ -799,6 +860,13 @@ class ModelExtensions(object):
             assert isinstance(sort_by, list) or isinstance(sort_by, tuple)
             query = query.extra(order_by=sort_by)
 
+        query_after = special_params.get('query_after', None)
+        if query_after:
+            if special_params.get('query_start', None) is not None:
+                raise ValueError('Cannot pass both query_start and '
+                                 'query_after')
+            query = cls._apply_keyset(query, sort_by, query_after)
+
         query_start = special_params.get('query_start', None)
         query_limit = special_params.get('query_limit', None)
         if query_start is not None:
@@ -817,6 +885,12 @@ class ModelExtensions(object):
         filter_data include:
         -query_start: index of first return to return
         -query_limit: maximum number of results to return
+        -query_after: list with the sort_by values of the last row of the
+         previous page, to return the rows that follow it. Unlike
+         query_start, the cost of a page doesn't depend on how deep it is.
+         The sort_by fields must identify a row (end them with the primary
+         key) and must not be NULL, or rows can be skipped. They can't be
+         aggregates, such as the counts of grouped queries.
         -sort_by: list of fields to sort on.  prefixing a '-' onto a
          field name changes the sort to descending order.
         -extra_args: keyword args to pass to query.extra() (see Django
@@ -861,6 +935,7 @@ class ModelExtensions(object):
         """
         filter_data.pop('query_start', None)
         filter_data.pop('query_limit', None)
+        filter_data.pop('query_after', None)
         query = cls.query_objects(filter_data, initial_query=initial_query)
         return query.count()
 
@@ -882,11 +957,19 @@ class ModelExtensions(object):
         """
         Like query_objects, but return a list of dictionaries.
         """
+        return list(cls.iter_objects(filter_data,
+                                     initial_query=initial_query))
+
+    @classmethod
+    def iter_objects(cls, filter_data, initial_query=None):
+        """
+        Like list_objects, but yield the dictionaries as the rows are read,
+        without caching the model objects.
+        """
         query = cls.query_objects(filter_data, initial_query=initial_query)
         extra_fields = list(query.query.extra_select.keys())
-        field_dicts = [model_object.get_object_dict(extra_fields=extra_fields)
-                       for model_object in query]
-        return field_dicts
+        for model_object in query.iterator():
+            yield model_object.get_object_dict(extra_fields=extra_fields)
 
     @classmethod
     def smart_get(cls, id_or_name, valid_only=True):
@@ -3,7 +3,7 @@ import os
 from datetime import datetime
 from xml.sax import saxutils
 
-from django.db import models as dbmodels, connection
+from django.db import models as dbmodels, connection, transaction
 
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -163,12 +163,22 @@ class Label(model_logic.ModelWithInvalid, dbmodels.Model):
                             job (False). Default is a regular job (False).
         :type is_template: boolean
         """
-        queue_entry = HostQueueEntry.create(meta_host=self, job=job,
-                                            profile=profile,
-                                            is_template=is_template,
-                                            atomic_group=atomic_group)
+        queue_entry = self.create_queue_entry(job, profile, atomic_group,
+                                              is_template)
         queue_entry.save()
 
+    def create_queue_entry(self, job, profile, atomic_group=None,
+                           is_template=False):
+        """
+        Create, without saving it, the queue entry that enqueues a job on
+        any host of this label. See :meth:`enqueue_job`.
+
+        :return: a :class:`HostQueueEntry`
+        """
+        return HostQueueEntry.create(meta_host=self, job=job, profile=profile,
+                                     is_template=is_template,
+                                     atomic_group=atomic_group)
+
     class Meta:
         db_table = 'afe_labels'
 
@@ -530,19 +540,47 @@ class Host(model_logic.ModelWithInvalid, dbmodels.Model,
                             job (False). Default is a regular job (False).
         :type is_template: boolean
         """
-        queue_entry = HostQueueEntry.create(host=self, job=job, profile=profile,
-                                            is_template=is_template,
-                                            atomic_group=atomic_group)
-        # allow recovery of dead hosts from the frontend
-        if not self.active_queue_entry() and self.is_dead():
-            self.status = Host.Status.READY
-            self.save()
+        queue_entry = self.create_queue_entry(job, profile, atomic_group,
+                                              is_template)
+        Host.recover_dead_hosts([self])
         queue_entry.save()
 
         # pylint: disable=E1123
         block = IneligibleHostQueue(job=job, host=self)
         block.save()
 
+    def create_queue_entry(self, job, profile, atomic_group=None,
+                           is_template=False):
+        """
+        Create, without saving it, the queue entry that enqueues a job on
+        this host. See :meth:`enqueue_job`.
+
+        :return: a :class:`HostQueueEntry`
+        """
+        return HostQueueEntry.create(host=self, job=job, profile=profile,
+                                     is_template=is_template,
+                                     atomic_group=atomic_group)
+
+    @classmethod
+    def recover_dead_hosts(cls, hosts):
+        """
+        Allow recovery of dead hosts from the frontend: the dead hosts among
+        the given ones that have no active queue entry are set back to Ready.
+
+        :param hosts: the :class:`hosts <Host>` a job is being enqueued on
+        :type hosts: list of :class:`Host`
+        """
+        dead_hosts = [host for host in hosts if host.is_dead()]
+        if not dead_hosts:
+            return
+        busy_host_ids = set(HostQueueEntry.objects.filter(
+            host__in=dead_hosts, active=True).values_list('host_id',
+                                                          flat=True))
+        for host in dead_hosts:
+            if host.id not in busy_host_ids:
+                host.status = Host.Status.READY
+                host.save()
+
     def platform(self):
         # TODO(showard): slightly hacky?
         platforms = self.labels.filter(platform=True)
@@ -1055,6 +1093,9 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
     Priority = enum.Enum('Low', 'Medium', 'High', 'Urgent')
     ControlType = enum.Enum('Server', 'Client', start_value=1)
 
+    # rows per multi-row INSERT when queueing a job
+    BULK_INSERT_BATCH_SIZE = 500
+
     #: username of job owner
     owner = dbmodels.CharField(max_length=255)
 
@@ -1216,8 +1257,9 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
         job.dependency_labels = options['dependencies']
 
         if options.get('keyvals'):
-            for key, value in options['keyvals'].items():
-                JobKeyval.objects.create(job=job, key=key, value=value)
+            JobKeyval.objects.bulk_create(
+                [JobKeyval(job=job, key=key, value=value)
+                 for key, value in options['keyvals'].items()])
 
         return job
 
@@ -1242,9 +1284,26 @@ class Job(dbmodels.Model, model_logic.ModelExtensions):
 
         if not profiles:
             profiles = [''] * len(hosts)
+        # the equivalent of enqueue_job() on every host or label, with all
+        # the rows written by multi-row inserts
+        queue_entries = []
+        blocks = []
         for host, profile in zip(hosts, profiles):
-            host.enqueue_job(self, profile=profile, atomic_group=atomic_group,
-                             is_template=is_template)
+            queue_entry = host.create_queue_entry(
+                self, profile=profile, atomic_group=atomic_group,
+                is_template=is_template)
+            queue_entry._set_active_and_complete()
+            queue_entries.append(queue_entry)
+            if queue_entry.host is not None:
+                # pylint: disable=E1123
+                blocks.append(IneligibleHostQueue(job=self, host=host))
+
+        with transaction.atomic():
+            Host.recover_dead_hosts([block.host for block in blocks])
+            HostQueueEntry.objects.bulk_create(
+                queue_entries, batch_size=self.BULK_INSERT_BATCH_SIZE)
+            IneligibleHostQueue.objects.bulk_create(
+                blocks, batch_size=self.BULK_INSERT_BATCH_SIZE)
 
     def create_recurring_job(self, start_date, loop_period, loop_count, owner):
         # pylint: disable=E1123
@@ -204,6 +204,48 @@ class ModelWithInvalidTest(unittest.TestCase,
         self.assertEqual(0, models.Job.objects.all().count())
 
 
+class QueryObjectsTest(unittest.TestCase, test_utils.FrontendTestMixin):
+
+    def setUp(self):
+        self._frontend_common_setup()
+
+    def tearDown(self):
+        self._frontend_common_teardown()
+
+    def _label_names(self, **filter_data):
+        return [label.name
+                for label in models.Label.query_objects(filter_data)]
+
+    def test_query_after(self):
+        sort_by = ['-platform', 'name']
+        self.assertEqual(['myplatform', 'label1', 'label2'],
+                         self._label_names(sort_by=sort_by, query_limit=3))
+        self.assertEqual(['label3', 'label4', 'label5'],
+                         self._label_names(sort_by=sort_by, query_limit=3,
+                                           query_after=[False, 'label2']))
+        self.assertEqual(['label1', 'label2'],
+                         self._label_names(sort_by=sort_by, query_limit=2,
+                                           query_after=[True, 'myplatform']))
+        self.assertEqual([],
+                         self._label_names(sort_by=sort_by,
+                                           query_after=[False, 'label8']))
+
+    def test_query_after_errors(self):
+        self.assertRaises(ValueError, self._label_names,
+                          query_after=['label2'])
+        self.assertRaises(ValueError, self._label_names, sort_by=['name'],
+                          query_after=['label2', 1])
+        self.assertRaises(ValueError, self._label_names, sort_by=['name'],
+                          query_after=['label2'], query_start=2,
+                          query_limit=2)
+        self.assertRaises(ValueError, self._label_names,
+                          extra_args={'select': {'hosts': 'COUNT(1)'}},
+                          sort_by=['hosts', 'name'], query_after=[1, 'label2'])
+        self.assertRaises(ValueError, self._label_names,
+                          sort_by=['atomic_group__name', 'name'],
+                          query_after=['atomic1', 'label2'])
+
+
 class KernelTest(unittest.TestCase, test_utils.FrontendTestMixin):
 
     def setUp(self):
@@ -282,6 +324,29 @@ class JobTest(unittest.TestCase, test_utils.FrontendTestMixin):
         self.assertRaises(Exception, models.Job.check_parameterized_job,
                           control_file=object(), parameterized_job=None)
 
+    def test_queue(self):
+        job = self._create_job()
+        host, dead_host = self.hosts[0:2]
+        dead_host.status = models.Host.Status.REPAIR_FAILED
+        dead_host.save()
+
+        job.queue([host, dead_host, self.labels[0]],
+                  profiles=['profile0', 'profile1', 'profile2'])
+
+        entries = job.hostqueueentry_set.order_by('id')
+        self.assertEqual([(host.id, None, 'profile0'),
+                          (dead_host.id, None, 'profile1'),
+                          (None, self.labels[0].id, 'profile2')],
+                         [(entry.host_id, entry.meta_host_id, entry.profile)
+                          for entry in entries])
+        self.assertEqual(set([models.HostQueueEntry.Status.QUEUED]),
+                         set(entry.status for entry in entries))
+        blocked_host_ids = models.IneligibleHostQueue.objects.filter(
+            job=job).values_list('host_id', flat=True)
+        self.assertEqual(set([host.id, dead_host.id]), set(blocked_host_ids))
+        self.assertEqual(models.Host.Status.READY,
+                         models.Host.objects.get(id=dead_host.id).status)
+
 
 class SoftwareComponentKindTest(unittest.TestCase,
                                 test_utils.FrontendTestMixin):
@@ -83,10 +83,19 @@ class RpcHandler(object):
         user = models.User.current_user()
         json_request = self.raw_request_data(request)
         decoded_request = self.decode_request(json_request)
-        decoded_result = self.dispatch_request(decoded_request)
-        result = self.encode_result(decoded_result)
+        # requests with "stream": true get the rows of the RPCs that support
+        # it written as they are read from the database
+        if decoded_request.get('stream'):
+            with rpc_utils.streaming_results():
+                decoded_result = self.dispatch_request(decoded_request)
+        else:
+            decoded_result = self.dispatch_request(decoded_request)
         if rpcserver_logging.LOGGING_ENABLED:
             self.log_request(user, decoded_request, decoded_result)
+        if isinstance(decoded_result['result'], rpc_utils.ResultStream):
+            return rpc_utils.streaming_http_response(
+                self._dispatcher.translateResultStream(decoded_result))
+        result = self.encode_result(decoded_result)
         return rpc_utils.raw_http_response(result)
 
     def handle_jsonp_rpc_request(self, request):
@@ -32,7 +32,6 @@ __author__ = 'showard@google.com (Steve Howard)'
 import datetime
 import logging
 import os
-import xmlrpc.client
 # psutil is a non stdlib import, it needs to be installed
 import psutil
 try:
@@ -41,6 +40,7 @@ except ImportError:
     from . import common  # pylint: disable=W0611
 from autotest.frontend.afe import models, model_logic, model_attributes
 from autotest.frontend.afe import control_file, rpc_utils, reservations
+from autotest.frontend.afe import install_server_cache, static_data_cache
 from autotest.server.hosts.remote import get_install_server_info
 from autotest.client.shared import version
 from autotest.client.shared.settings import settings
@@ -333,13 +333,14 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
     models.Host.objects.populate_relationships(hosts, models.HostAttribute,
                                                'attribute_list')
 
-    install_server = None
-    install_server_info = get_install_server_info()
-    install_server_type = install_server_info.get('type', None)
-    install_server_url = install_server_info.get('xmlrpc_url', None)
-
-    if install_server_type == 'cobbler' and install_server_url:
-        install_server = xmlrpc.client.ServerProxy(install_server_url)
+    install_server = install_server_cache.get_cobbler_cache()
+    if install_server is not None:
+        # a single lookup for all the hosts
+        systems = install_server.find_systems([host_obj.hostname
+                                               for host_obj in hosts])
+        use_current_profile = settings.get_value('INSTALL_SERVER',
+                                                 'use_current_profile',
+                                                 type=bool, default=True)
 
     host_dicts = []
     for host_obj in hosts:
@@ -353,8 +354,7 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
 
         error_encountered = True
         if install_server is not None:
-            system_params = {"name": host_dict['hostname']}
-            system_list = install_server.find_system(system_params, True)
+            system_list = systems[host_dict['hostname']]
 
             if len(system_list) < 1:
                 msg = 'System "%s" not found on install server'
@@ -362,10 +362,8 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
                 rpc_logger.info(msg, host_dict['hostname'])
 
             elif len(system_list) > 1:
-                msg = 'Found multiple systems on install server named %s'
-
-                if install_server_type == 'cobbler':
-                    msg = '%s. This should never happen on cobbler' % msg
+                msg = ('Found multiple systems on install server named %s. '
+                       'This should never happen on cobbler')
                 rpc_logger = logging.getLogger('rpc_logger')
                 rpc_logger.error(msg, host_dict['hostname'])
 
@@ -374,11 +372,9 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
 
                 if host_dict['platform']:
                     error_encountered = False
-                    profiles = sorted(install_server.get_item_names('profile'))
+                    profiles = sorted(install_server.get_profiles())
                     host_dict['profiles'] = profiles
                     host_dict['profiles'].insert(0, 'Do_not_install')
-                    use_current_profile = settings.get_value('INSTALL_SERVER',
-                                                             'use_current_profile', type=bool, default=True)
                     if use_current_profile:
                         host_dict['current_profile'] = system['profile']
                     else:
@@ -414,18 +410,11 @@ def get_install_server_profiles():
 
     :return: Sequence of profiles.
     """
-    install_server = None
-    install_server_info = get_install_server_info()
-    install_server_type = install_server_info.get('type', None)
-    install_server_url = install_server_info.get('xmlrpc_url', None)
-
-    if install_server_type == 'cobbler' and install_server_url:
-        install_server = xmlrpc.client.ServerProxy(install_server_url)
-
+    install_server = install_server_cache.get_cobbler_cache()
     if install_server is None:
         return None
 
-    return install_server.get_item_names('profile')
+    return install_server.get_profiles()
 
 
 def get_profiles():
@@ -1283,7 +1272,23 @@ def get_static_data():
     status_dictionary: A mapping from one word job status names to a more
             informative description.
     """
+    result = dict(static_data_cache.instance().get('afe',
+                                                   _build_static_data))
+    result['current_user'] = rpc_utils.prepare_for_serialization(
+        models.User.current_user().get_object_dict())
+    result['motd'] = rpc_utils.get_motd()
+    return result
 
+
+# changes to these invalidate the cached get_static_data()
+static_data_cache.watch_models(models.User, models.Label, models.AtomicGroup,
+                               models.Test, models.Profiler, models.DroneSet)
+
+
+def _build_static_data():
+    """
+    (Internal) Build the part of get_static_data() shared by all users.
+    """
     job_fields = models.Job.get_field_dict()
     default_drone_set_name = models.DroneSet.default_drone_set_name()
     drone_sets = ([default_drone_set_name] +
@@ -1301,8 +1306,6 @@ def get_static_data():
     result['atomic_groups'] = get_atomic_groups(sort_by=['name'])
     result['tests'] = get_tests(sort_by=['name'])
     result['profilers'] = get_profilers(sort_by=['name'])
-    result['current_user'] = rpc_utils.prepare_for_serialization(
-        models.User.current_user().get_object_dict())
     result['host_statuses'] = sorted(models.Host.Status.names)
     result['job_statuses'] = sorted(models.HostQueueEntry.Status.names)
     result['job_timeout_default'] = models.Job.DEFAULT_TIMEOUT
@@ -1311,7 +1314,6 @@ def get_static_data():
         models.Job.DEFAULT_PARSE_FAILED_REPAIR)
     result['reboot_before_options'] = model_attributes.RebootBefore.names
     result['reboot_after_options'] = model_attributes.RebootAfter.names
-    result['motd'] = rpc_utils.get_motd()
     result['drone_sets_enabled'] = models.DroneSet.drone_sets_enabled()
     result['drone_sets'] = drone_sets
     result['parameterized_jobs'] = models.Job.parameterized_jobs_enabled()
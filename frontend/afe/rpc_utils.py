@@ -5,16 +5,22 @@ only RPC interface functions go into that file.
 
 __author__ = 'showard@google.com (Steve Howard)'
 
+import contextlib
 import datetime
 import inspect
 import os
+import threading
 
 import django.http
+from django.db import transaction
 from autotest.frontend.afe import models, model_logic, model_attributes
 
 NULL_DATETIME = datetime.datetime.max
 NULL_DATE = datetime.date.max
 
+# whether the response of the RPC being dispatched by this thread is streamed
+_streaming = threading.local()
+
 
 def prepare_for_serialization(objects):
     """
@@ -26,6 +32,44 @@ def prepare_for_serialization(objects):
     return _prepare_data(objects)
 
 
+class ResultStream(object):
+
+    """
+    An RPC result made of rows that are prepared for serialization as they
+    are iterated, so that the response can be written as they come.
+    """
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+@contextlib.contextmanager
+def streaming_results():
+    """
+    Within this block, the RPCs that support it return a ResultStream
+    instead of a list.
+    """
+    _streaming.enabled = True
+    try:
+        yield
+    finally:
+        _streaming.enabled = False
+
+
+def prepare_rows_for_serialization(rows):
+    """
+    Like prepare_for_serialization(), for an iterable of object dicts. When
+    the response is streamed, return a ResultStream preparing the rows lazily
+    instead of a list.
+    """
+    if not getattr(_streaming, 'enabled', False):
+        return prepare_for_serialization(list(rows))
+    return ResultStream(_prepare_data(row) for row in rows)
+
+
 def prepare_rows_as_nested_dicts(query, nested_dict_column_names):
     """
     Prepare a Django query to be returned via RPC as a sequence of nested
@@ -36,16 +80,17 @@ def prepare_rows_as_nested_dicts(query, nested_dict_column_names):
             rows returned by query to expand into nested dictionaries using
             their get_object_dict() method when not None.
 
-    :return: An list suitable to returned in an RPC.
+    :return: An list suitable to returned in an RPC, or a ResultStream when
+            the response is streamed.
     """
-    all_dicts = []
-    for row in query.select_related():
-        row_dict = row.get_object_dict()
-        for column in nested_dict_column_names:
-            if row_dict[column] is not None:
-                row_dict[column] = getattr(row, column).get_object_dict()
-        all_dicts.append(row_dict)
-    return prepare_for_serialization(all_dicts)
+    def nested_dicts():
+        for row in query.select_related().iterator():
+            row_dict = row.get_object_dict()
+            for column in nested_dict_column_names:
+                if row_dict[column] is not None:
+                    row_dict[column] = getattr(row, column).get_object_dict()
+            yield row_dict
+    return prepare_rows_for_serialization(nested_dicts())
 
 
 def _prepare_data(data):
@@ -77,6 +122,15 @@ def raw_http_response(response_data, content_type=None):
     return response
 
 
+def streaming_http_response(response_chunks, content_type=None):
+    """
+    A response written as response_chunks are produced, without a
+    Content-length.
+    """
+    return django.http.StreamingHttpResponse(response_chunks,
+                                             content_type=content_type)
+
+
 def gather_unique_dicts(dict_iterable):
     """
     Pick out unique objects (by ID) from an iterable of object dicts.
@@ -534,10 +588,13 @@ def create_new_job(owner, options, host_objects, profiles, metahost_objects,
                  '%r instead of the supplied atomic_group_name=%r.' %
                                              (label.name, label.atomic_group.name, atomic_group.name)})
 
-    job = models.Job.create(owner=owner, options=options,
-                            hosts=all_host_objects)
-    job.queue(all_host_objects, profiles=all_profiles, atomic_group=atomic_group,
-              is_template=options.get('is_template', False))
+    # the job, its keyvals and all its queue entries are created at once
+    with transaction.atomic():
+        job = models.Job.create(owner=owner, options=options,
+                                hosts=all_host_objects)
+        job.queue(all_host_objects, profiles=all_profiles,
+                  atomic_group=atomic_group,
+                  is_template=options.get('is_template', False))
     return job.id
 
 
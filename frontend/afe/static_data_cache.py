@@ -0,0 +1,85 @@
+"""
+Cache of the get_static_data() RPC payloads.
+
+The AFE and TKO UIs call get_static_data() on every load, and building it
+takes a query per model listed in it. The parts shared by all users are kept
+until a watched model is saved or deleted, or for at most
+AUTOTEST_WEB.static_data_cache_ttl seconds, which bounds how stale the data
+is after changes made by other processes (other frontend processes, the cli
+through them, or the scheduler).
+"""
+
+import threading
+import time
+
+from django.db.models import signals
+
+from autotest.client.shared.settings import settings
+
+
+class StaticDataCache(object):
+
+    """
+    Named payloads, all dropped when invalidate() is called.
+
+    :param ttl: Seconds a payload is used for at most.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # name -> (build time, payload)
+        self._payloads = {}
+        self._generation = 0
+
+    def get(self, name, build_function):
+        """
+        :param name: Name of the payload.
+        :param build_function: Called without arguments to build the payload
+                when it is not cached.
+        :return: The payload, which must not be modified.
+        """
+        with self._lock:
+            cached = self._payloads.get(name)
+            if cached is not None and time.time() - cached[0] < self.ttl:
+                return cached[1]
+            generation = self._generation
+        build_time = time.time()
+        payload = build_function()
+        with self._lock:
+            # a payload built while the models changed may be stale already
+            if generation == self._generation:
+                self._payloads[name] = (build_time, payload)
+        return payload
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._payloads.clear()
+
+
+_the_instance = None
+
+
+def instance():
+    if _the_instance is None:
+        _set_instance(StaticDataCache(settings.get_value(
+            'AUTOTEST_WEB', 'static_data_cache_ttl', type=int, default=300)))
+    return _the_instance
+
+
+def _set_instance(instance):  # usable for testing
+    global _the_instance
+    _the_instance = instance
+
+
+def _invalidate(sender, **kwargs):
+    instance().invalidate()
+
+
+def watch_models(*model_classes):
+    """Invalidate the cache when an object of model_classes changes."""
+    for model_class in model_classes:
+        for signal in (signals.post_save, signals.post_delete):
+            signal.connect(_invalidate, sender=model_class,
+                           dispatch_uid='static_data_cache')
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+import unittest
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    from . import common  # pylint: disable=W0611
+from autotest.frontend.afe import static_data_cache
+
+from django.db.models import signals
+
+
+class FakeModel(object):
+    pass
+
+
+class StaticDataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = static_data_cache.StaticDataCache(60)
+        static_data_cache._set_instance(self.cache)
+        self.builds = 0
+
+    def tearDown(self):
+        static_data_cache._set_instance(None)
+
+    def _build(self):
+        self.builds += 1
+        return {'builds': self.builds}
+
+    def test_get(self):
+        self.assertEqual({'builds': 1}, self.cache.get('afe', self._build))
+        self.assertEqual({'builds': 1}, self.cache.get('afe', self._build))
+        self.assertEqual({'builds': 2}, self.cache.get('tko', self._build))
+
+    def test_ttl(self):
+        self.cache.ttl = 0
+        self.cache.get('afe', self._build)
+        self.assertEqual({'builds': 2}, self.cache.get('afe', self._build))
+
+    def test_invalidate_while_building(self):
+        def build():
+            self.cache.invalidate()
+            return self._build()
+        self.assertEqual({'builds': 1}, self.cache.get('afe', build))
+        # the payload built while the models changed wasn't kept
+        self.assertEqual({'builds': 2}, self.cache.get('afe', self._build))
+
+    def test_watch_models(self):
+        static_data_cache.watch_models(FakeModel)
+        self.cache.get('afe', self._build)
+        signals.post_save.send(sender=FakeModel, instance=FakeModel(),
+                               created=True)
+        self.assertEqual({'builds': 2}, self.cache.get('afe', self._build))
+        signals.post_delete.send(sender=FakeModel, instance=FakeModel())
+        self.assertEqual({'builds': 3}, self.cache.get('afe', self._build))
+        # other models don't invalidate the cache
+        signals.post_save.send(sender=object, instance=None, created=True)
+        self.assertEqual({'builds': 3}, self.cache.get('afe', self._build))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,5 @@
+import re
+
 from django.db import models as dbmodels, connection
 from autotest.frontend.afe import model_logic, readonly_connection
 from autotest.frontend.afe.models import TestEnvironment
@@ -714,3 +716,170 @@ class TestView(dbmodels.Model, model_logic.ModelExtensions):
     class Meta:
         db_table = 'tko_test_view_2'
         managed = False
+
+
+# rollups
+
+class StatusCountRollupManager(TempManager):
+
+    """
+    Maintains and queries the StatusCountRollup table.
+    """
+    _GROUP_COUNT_SQL = 'CAST(SUM(test_count) AS SIGNED)'
+
+    # TestView fields stored in the rollup, besides the test_count
+    _COLUMNS = ('job_idx', 'job_tag', 'job_name', 'job_owner',
+                'job_queued_time', 'hostname', 'platform', 'test_name',
+                'kernel', 'status')
+    # TestView expressions that map to rollup columns
+    _EXPRESSIONS = {
+        'DATE(job_queued_time)': 'DATE(job_queued_time)',
+        'DATE(test_finished_time)': 'test_finished_day',
+    }
+    # get_query_set_with_joins() parameters that need joins the rollup can't
+    # answer
+    _JOIN_PARAMETERS = ('test_attribute_fields', 'test_label_fields',
+                        'machine_label_fields', 'iteration_result_fields',
+                        'job_keyval_fields', 'iteration_attribute_fields',
+                        'include_labels', 'exclude_labels',
+                        'include_attributes_where',
+                        'exclude_attributes_where')
+    _SQL_WORDS = frozenset(['and', 'or', 'not', 'in', 'is', 'null', 'like',
+                            'between', 'date', 'escape'])
+    _STRING_LITERAL_RE = re.compile(r'"(?:[^"\\]|\\.)*"|'
+                                    r"'(?:[^'\\]|\\.)*'")
+    _IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_.]*')
+
+    def get_query_set(self):
+        query = super(StatusCountRollupManager, self).get_query_set()
+        return query.extra(select=self._EXPRESSIONS)
+
+    def _refresh_sql(self, where):
+        columns = ', '.join(self._COLUMNS)
+        return ('INSERT INTO tko_status_count_rollups '
+                '(%s, test_finished_day, test_count) '
+                'SELECT %s, DATE(test_finished_time), COUNT(1) '
+                'FROM tko_test_view_2 %s '
+                'GROUP BY %s, DATE(test_finished_time)'
+                % (columns, columns, where, columns))
+
+    def refresh_jobs(self, job_ids):
+        """
+        Recompute the rollup rows of the given jobs from their tests, this
+        must be called whenever tests of a job are added, changed or deleted.
+        """
+        job_ids = [int(job_id) for job_id in job_ids]
+        if not job_ids:
+            return
+        where = 'WHERE job_idx IN (%s)' % ','.join(str(job_id)
+                                                   for job_id in job_ids)
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM tko_status_count_rollups ' + where)
+        cursor.execute(self._refresh_sql(where))
+
+    def refresh_machine(self, machine_idx):
+        """
+        Recompute the rollup rows of all the jobs of a machine, this must be
+        called whenever the machine's platform changes.
+        """
+        where = ('WHERE job_idx IN (SELECT job_idx FROM tko_jobs '
+                 'WHERE machine_idx = %d)' % int(machine_idx))
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM tko_status_count_rollups ' + where)
+        cursor.execute(self._refresh_sql(where))
+
+    def rebuild(self):
+        """Recompute the whole rollup table."""
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM tko_status_count_rollups')
+        cursor.execute(self._refresh_sql(''))
+
+    def _is_supported_field(self, field):
+        return field in self._COLUMNS or field in self._EXPRESSIONS
+
+    def _is_supported_where(self, where):
+        """
+        Allow only conditions on rollup columns in user supplied SQL.
+        """
+        where = self._STRING_LITERAL_RE.sub("''", where)
+        for identifier in self._IDENTIFIER_RE.findall(where):
+            if (identifier.lower() not in self._SQL_WORDS and
+                    identifier not in self._COLUMNS):
+                return False
+        return True
+
+    def can_answer(self, fields, filter_data):
+        """
+        :param fields: All the TestView fields grouped and sorted on.
+        :param filter_data: The TestView filter_data of the query.
+        :return: True if the query can be answered from the rollup.
+        """
+        for field in fields:
+            if field.startswith('-'):
+                field = field[1:]
+            if not self._is_supported_field(field):
+                return False
+
+        for key, value in filter_data.items():
+            if key in self._JOIN_PARAMETERS:
+                if value:
+                    return False
+            elif key == 'extra_where':
+                if value and not self._is_supported_where(value):
+                    return False
+            elif key == 'extra_args':
+                if value:
+                    return False
+            elif key in StatusCountRollup._SPECIAL_FILTER_KEYS:
+                continue
+            elif key.split('__', 1)[0] not in self._COLUMNS:
+                return False
+        return True
+
+    def get_group_count_query(self, filter_data, extra_select_fields=None):
+        """
+        Rollup equivalent of a grouped TestView query with a group count,
+        for use with execute_group_query(). The caller must check
+        can_answer() first.
+        """
+        filter_data = dict(filter_data)
+        for key in self._JOIN_PARAMETERS:
+            filter_data.pop(key, None)
+        filter_data['no_distinct'] = True
+
+        query = StatusCountRollup.query_objects(filter_data,
+                                                apply_presentation=False)
+        query = query.extra(select={self._GROUP_COUNT_NAME:
+                                    self._GROUP_COUNT_SQL})
+        if extra_select_fields:
+            query = query.extra(select=extra_select_fields)
+        return StatusCountRollup.apply_presentation(query, filter_data)
+
+
+class StatusCountRollup(dbmodels.Model, model_logic.ModelExtensions):
+
+    """
+    Number of tests per job and per the TestView fields spreadsheets group
+    on most, so group counts don't need the TestView joins over every test.
+
+    The parser keeps it up to date through refresh_jobs(), and through
+    refresh_machine() when it changes the platform of a machine. Rows go
+    away with their job.
+    """
+    job_idx = dbmodels.ForeignKey(Job, db_column='job_idx')
+    job_tag = dbmodels.CharField(blank=True, max_length=100)
+    job_name = dbmodels.CharField(blank=True, max_length=300)
+    job_owner = dbmodels.CharField(blank=True, max_length=240)
+    job_queued_time = dbmodels.DateTimeField(null=True, blank=True)
+    hostname = dbmodels.CharField(blank=True, max_length=255)
+    platform = dbmodels.CharField(blank=True, max_length=240)
+    test_name = dbmodels.CharField(blank=True, max_length=300)
+    kernel = dbmodels.CharField(blank=True, max_length=300)
+    status = dbmodels.CharField(blank=True, max_length=30)
+    test_finished_day = dbmodels.DateField(null=True, blank=True)
+    test_count = dbmodels.IntegerField(default=0)
+
+    objects = StatusCountRollupManager()
+
+    class Meta:
+        db_table = 'tko_status_count_rollups'
@@ -58,5 +58,34 @@ class IterationAttributeTest(unittest.TestCase,
         test.delete()
 
 
+class StatusCountRollupManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = models.StatusCountRollup.objects
+
+    def test_can_answer_fields(self):
+        self.assertTrue(self.manager.can_answer(
+            ['job_name', 'DATE(test_finished_time)', '-status'], {}))
+        self.assertFalse(self.manager.can_answer(['reason'], {}))
+
+    def test_can_answer_filters(self):
+        self.assertTrue(self.manager.can_answer(
+            ['status'], {'hostname__in': ['foo'], 'sort_by': ['status'],
+                         'test_label_fields': []}))
+        self.assertFalse(self.manager.can_answer(
+            ['status'], {'test_started_time__gt': '2012-01-01'}))
+        self.assertFalse(self.manager.can_answer(
+            ['status'], {'test_attribute_fields': ['myattr']}))
+
+    def test_can_answer_extra_where(self):
+        self.assertTrue(self.manager.can_answer(
+            ['status'], {'extra_where': "job_tag LIKE '1-%' AND "
+                                        "test_name IN ('reason', \"x\")"}))
+        self.assertFalse(self.manager.can_answer(
+            ['status'], {'extra_where': 'reason IS NULL'}))
+        self.assertFalse(self.manager.can_answer(
+            ['status'], {'extra_where': 'tko_test_labels.id = 1'}))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -4,7 +4,7 @@ import operator
 import pickle
 
 from autotest.frontend.afe import models as afe_models, readonly_connection
-from autotest.frontend.afe import rpc_utils, model_logic
+from autotest.frontend.afe import rpc_utils, model_logic, static_data_cache
 from autotest.frontend.tko import models, tko_rpc_utils, graphing_utils
 from autotest.frontend.tko import preconfigs
 from django.db import models as dbmodels
@@ -19,8 +19,8 @@ INTERFACE_VERSION = (2013, 0o5, 23)
 # table/spreadsheet view support
 
 def get_test_views(**filter_data):
-    return rpc_utils.prepare_for_serialization(
-        models.TestView.list_objects(filter_data))
+    return rpc_utils.prepare_rows_for_serialization(
+        models.TestView.iter_objects(filter_data))
 
 
 def get_num_test_views(**filter_data):
@@ -52,15 +52,18 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
       The keys for the extra_select_fields are determined by the "AS" alias of
       the field.
     """
-    query = models.TestView.objects.get_query_set_with_joins(filter_data)
-    # don't apply presentation yet, since we have extra selects to apply
-    query = models.TestView.query_objects(filter_data, initial_query=query,
-                                          apply_presentation=False)
-    count_alias, count_sql = models.TestView.objects.get_count_sql(query)
-    query = query.extra(select={count_alias: count_sql})
-    if extra_select_fields:
-        query = query.extra(select=extra_select_fields)
-    query = models.TestView.apply_presentation(query, filter_data)
+    query = _get_rollup_group_query(group_by, header_groups, fixed_headers,
+                                    extra_select_fields, filter_data)
+    if query is None:
+        query = models.TestView.objects.get_query_set_with_joins(filter_data)
+        # don't apply presentation yet, since we have extra selects to apply
+        query = models.TestView.query_objects(filter_data, initial_query=query,
+                                              apply_presentation=False)
+        count_alias, count_sql = models.TestView.objects.get_count_sql(query)
+        query = query.extra(select={count_alias: count_sql})
+        if extra_select_fields:
+            query = query.extra(select=extra_select_fields)
+        query = models.TestView.apply_presentation(query, filter_data)
 
     group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
                                                        header_groups or [],
@@ -69,10 +72,39 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
     return rpc_utils.prepare_for_serialization(group_processor.get_info_dict())
 
 
+def _get_rollup_group_query(group_by, header_groups, fixed_headers,
+                            extra_select_fields, filter_data):
+    """
+    Get the query answering get_group_counts() from the status count
+    rollup, or None if the grouping, filters or extra selects need the live
+    TestView query.
+    """
+    if extra_select_fields == tko_rpc_utils.STATUS_FIELDS:
+        extra_select_fields = tko_rpc_utils.ROLLUP_STATUS_FIELDS
+    elif extra_select_fields:
+        return None
+
+    fields = list(group_by) + list(filter_data.get('sort_by', []))
+    for header_group in header_groups or []:
+        fields.extend(header_group)
+    rollup_manager = models.StatusCountRollup.objects
+    if not rollup_manager.can_answer(fields, filter_data):
+        return None
+    # fixed headers are applied as field__in filters
+    for field in fixed_headers or {}:
+        if not rollup_manager.can_answer([], {field + '__in': []}):
+            return None
+
+    return rollup_manager.get_group_count_query(filter_data,
+                                                extra_select_fields)
+
+
 def get_num_groups(group_by, **filter_data):
     """
     Gets the count of unique groups with the given grouping fields.
     """
+    # the count is the same for all pages
+    filter_data.pop('query_after', None)
     query = models.TestView.objects.get_query_set_with_joins(filter_data)
     query = models.TestView.query_objects(filter_data, initial_query=query)
     return models.TestView.objects.get_num_groups(query, group_by)
@@ -392,6 +424,19 @@ def get_motd():
 
 
 def get_static_data():
+    result = dict(static_data_cache.instance().get('tko',
+                                                   _build_static_data))
+    result['current_user'] = rpc_utils.prepare_for_serialization(
+        afe_models.User.current_user().get_object_dict())
+    result['motd'] = rpc_utils.get_motd()
+    return result
+
+
+# changes to these invalidate the cached get_static_data()
+static_data_cache.watch_models(models.TestLabel)
+
+
+def _build_static_data():
     result = {}
     group_fields = []
     for field in models.TestView.group_fields:
@@ -446,13 +491,10 @@ def get_static_data():
     result['group_fields'] = sorted(group_fields)
     result['all_fields'] = sorted(model_fields + extra_fields)
     result['test_labels'] = get_test_labels(sort_by=['name'])
-    result['current_user'] = rpc_utils.prepare_for_serialization(
-        afe_models.User.current_user().get_object_dict())
     result['benchmark_key'] = benchmark_key
     result['tko_perf_view'] = tko_perf_view
     result['tko_test_view'] = model_fields
     result['preconfigs'] = preconfigs.manager.all_preconfigs()
-    result['motd'] = rpc_utils.get_motd()
 
     return result
 
@@ -197,6 +197,8 @@ class RpcInterfaceTest(unittest.TestCase, TkoTestMixin):
         self._patch_sqlite_stuff()
         setup_test_view()
         self._create_initial_data()
+        # the parser keeps the rollup up to date, the initial data bypasses it
+        models.StatusCountRollup.objects.rebuild()
 
     def tearDown(self):
         setup_test_environment.tear_down()
@@ -317,6 +319,18 @@ class RpcInterfaceTest(unittest.TestCase, TkoTestMixin):
         self.assertEqual(group2['header_indices'], [1])
         self.assertEqual(group2['extra'], 'mykernel2')
 
+    def test_get_group_counts_query_after(self):
+        counts = rpc_interface.get_group_counts(
+            ['job_name'], sort_by=['job_name'], query_after=['myjob1'])
+        self.assertEqual(['myjob2'],
+                         [group['job_name'] for group in counts['groups']])
+        # the number of groups is the one of all the pages
+        self.assertEqual(2, rpc_interface.get_num_groups(
+            ['job_name'], sort_by=['job_name'], query_after=['myjob1']))
+        self.assertRaises(ValueError, rpc_interface.get_group_counts,
+                          ['job_name'], sort_by=['group_count', 'job_name'],
+                          query_after=[1, 'myjob1'])
+
     def test_get_status_counts(self):
         counts = rpc_interface.get_status_counts(group_by=['job_name'])
         group1, group2 = counts['groups']
@@ -327,6 +341,25 @@ class RpcInterfaceTest(unittest.TestCase, TkoTestMixin):
         self.assertEqual(group2['complete_count'], 1)
         self.assertEqual(group2['incomplete_count'], 0)
 
+    def test_status_counts_from_rollup(self):
+        models.StatusCountRollup.objects.all().delete()
+        counts = rpc_interface.get_status_counts(group_by=['job_name'])
+        self.assertEqual(counts['groups'], [])
+
+        # grouping on a field missing from the rollup uses the live query
+        counts = rpc_interface.get_status_counts(group_by=['reason'])
+        self.assertEqual(len(counts['groups']), 1)
+        self.assertEqual(counts['groups'][0]['group_count'], 3)
+
+        models.StatusCountRollup.objects.refresh_jobs(
+            [self.first_test.job.job_idx])
+        counts = rpc_interface.get_status_counts(group_by=['job_name'])
+        group, = counts['groups']
+        self.assertEqual(group['job_name'], 'myjob1')
+        self.assertEqual(group['group_count'], 2)
+        self.assertEqual(group['pass_count'], 1)
+        self.assertEqual(group['complete_count'], 2)
+
     def test_get_latest_tests(self):
         counts = rpc_interface.get_latest_tests(group_by=['job_name'])
         group1, group2 = counts['groups']
@@ -56,6 +56,17 @@ STATUS_FIELDS = {_PASS_COUNT_NAME: _PASS_COUNT_SQL,
                  _INCOMPLETE_COUNT_NAME: _INCOMPLETE_COUNT_SQL}
 _INVALID_STATUSES = ('TEST_NA', 'NOSTATUS')
 
+# the same counts computed from models.StatusCountRollup rows
+_ROLLUP_PASS_COUNT_SQL = 'CAST(SUM(IF(status="GOOD", test_count, 0)) AS SIGNED)'
+_ROLLUP_COMPLETE_COUNT_SQL = ('CAST(SUM(IF(status NOT IN ("TEST_NA", '
+                              '"RUNNING", "NOSTATUS"), test_count, 0)) '
+                              'AS SIGNED)')
+_ROLLUP_INCOMPLETE_COUNT_SQL = ('CAST(SUM(IF(status="RUNNING", test_count, '
+                                '0)) AS SIGNED)')
+ROLLUP_STATUS_FIELDS = {_PASS_COUNT_NAME: _ROLLUP_PASS_COUNT_SQL,
+                        _COMPLETE_COUNT_NAME: _ROLLUP_COMPLETE_COUNT_SQL,
+                        _INCOMPLETE_COUNT_NAME: _ROLLUP_INCOMPLETE_COUNT_SQL}
+
 
 def add_status_counts(group_dict, status):
     pass_count = complete_count = incomplete_count = 0
@@ -117,7 +128,7 @@ class GroupDataProcessor(object):
 
     def _fetch_data(self):
         self._restrict_header_values()
-        self._group_dicts = models.TestView.objects.execute_group_query(
+        self._group_dicts = self._query.model.objects.execute_group_query(
             self._query, self._group_by)
 
     @staticmethod
@@ -1,5 +1,9 @@
+import concurrent.futures
 import heapq
 import os
+import queue
+import threading
+import time
 import traceback
 
 try:
@@ -126,6 +130,49 @@ class _DroneHeapWrapper(object):
         return cmp(self.drone.used_capacity(), other.drone.used_capacity())
 
 
+class _DroneCallPool(object):
+
+    """
+    Worker threads calling drones for DroneManager._fan_out(). They are
+    daemon threads, so a drone that never answers doesn't keep the scheduler
+    from exiting.
+    """
+
+    def __init__(self, workers):
+        self._queue = queue.Queue()
+        self._workers = workers
+        for index in range(workers):
+            thread = threading.Thread(target=self._work,
+                                      name='drone-call-%d' % index)
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, function, args = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def submit(self, function, *args):
+        future = concurrent.futures.Future()
+        self._queue.put((future, function, args))
+        return future
+
+    def shutdown(self):
+        """Stop the workers once they are done, without waiting for them."""
+        for _ in range(self._workers):
+            self._queue.put(None)
+
+
 class DroneManager(object):
 
     """
@@ -156,6 +203,12 @@ class DroneManager(object):
         self._attached_files = {}
         # heapq of _DroneHeapWrappers
         self._drone_queue = []
+        # thread pool used to call drones concurrently, see _fan_out()
+        self._drone_executor = None
+        # maps Drone object to a call that outlived its timeout
+        self._pending_drone_calls = {}
+        # maps Drone object to the results of its last successful refresh
+        self._last_refresh_results = {}
 
     def initialize(self, base_results_dir, drone_hostnames,
                    results_repository_hostname):
@@ -188,6 +241,9 @@ class DroneManager(object):
     def shutdown(self):
         for drone in self.get_drones():
             drone.shutdown()
+        if self._drone_executor is not None:
+            self._drone_executor.shutdown()
+            self._drone_executor = None
 
     def _get_max_pidfile_refreshes(self):
         """
@@ -200,6 +256,24 @@ class DroneManager(object):
             type=int, default=2000)
         return pidfile_timeout
 
+    def _get_drone_fanout_workers(self):
+        """
+        :return: The number of drones called concurrently. 0 calls the drones
+                one after another in the scheduler thread.
+        """
+        return settings.get_value(scheduler_config.CONFIG_SECTION,
+                                  'drone_fanout_workers', type=int, default=0)
+
+    def _get_drone_call_timeout(self):
+        """
+        :return: Seconds to wait for each drone when calling them
+                concurrently, or None to wait as long as it takes.
+        """
+        timeout = settings.get_value(scheduler_config.CONFIG_SECTION,
+                                     'drone_call_timeout_sec', type=int,
+                                     default=0)
+        return timeout or None
+
     def _add_drone(self, hostname):
         logging.info('Adding drone %s' % hostname)
         drone = drones.get_drone(hostname)
@@ -259,12 +333,104 @@ class DroneManager(object):
         self._pidfiles_second_read = {}
         self._drone_queue = []
 
-    def _call_all_drones(self, method, *args, **kwargs):
+    def _collect_pending_drone_call(self, drone):
+        """
+        Check on a call that timed out on a previous cycle.
+
+        :return: True if the drone is still busy with it.
+        """
+        future = self._pending_drone_calls[drone]
+        if not future.done():
+            return True
+        del self._pending_drone_calls[drone]
+        if future.exception() is not None:
+            logging.error('Late call on drone %s failed: %s', drone.hostname,
+                          future.exception())
+        return False
+
+    def _fan_out(self, function, drones):
+        """
+        Call function(drone) for each drone.
+
+        With drone_fanout_workers set, the calls run concurrently and each
+        drone gets drone_call_timeout_sec to answer, counted from when its
+        call starts (or from now, for a call no worker picked up). A drone
+        that fails, times out or is still busy from an earlier timeout is
+        left out of the results and reported, so it only degrades its own
+        results for this cycle.
+
+        :return: A dict mapping each drone that answered to its result.
+        """
+        workers = self._get_drone_fanout_workers()
+        if workers <= 0:
+            return dict((drone, function(drone)) for drone in drones)
+
+        if self._drone_executor is None:
+            self._drone_executor = _DroneCallPool(workers)
+        timeout = self._get_drone_call_timeout()
+        submit_time = time.time()
+        # drone -> time its call started
+        start_times = {}
+
+        def call(drone):
+            start_times[drone] = time.time()
+            return function(drone)
+
+        futures = {}
+        for drone in drones:
+            if (drone in self._pending_drone_calls and
+                    self._collect_pending_drone_call(drone)):
+                logging.warning('Drone %s is still busy with a previous call, '
+                                'skipping it this cycle', drone.hostname)
+                continue
+            futures[self._drone_executor.submit(call, drone)] = drone
+
+        done = set()
+        not_done = set(futures)
+        while not_done:
+            wait_timeout = None
+            if timeout is not None:
+                deadline = min(start_times.get(futures[future], submit_time)
+                               for future in not_done) + timeout
+                wait_timeout = max(0, deadline - time.time())
+            newly_done, not_done = concurrent.futures.wait(
+                not_done, timeout=wait_timeout,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            done |= newly_done
+            if timeout is None:
+                continue
+            now = time.time()
+            for future in list(not_done):
+                drone = futures[future]
+                if now - start_times.get(drone, submit_time) < timeout:
+                    continue
+                not_done.discard(future)
+                if future.cancel():
+                    logging.warning('No worker was free to call drone %s '
+                                    'within %s seconds', drone.hostname,
+                                    timeout)
+                    continue
+                logging.warning('Drone %s did not answer within %s seconds',
+                                drone.hostname, timeout)
+                self._pending_drone_calls[drone] = future
+
         all_results = {}
-        for drone in self.get_drones():
-            all_results[drone] = drone.call(method, *args, **kwargs)
+        for future in done:
+            drone = futures[future]
+            try:
+                all_results[drone] = future.result()
+            except Exception:
+                warning = ('Drone %s failed to execute calls:\n%s' %
+                           (drone.hostname, traceback.format_exc()))
+                logging.error(warning)
+                mail.manager.enqueue_admin('Drone %s error' % drone.hostname,
+                                           warning)
         return all_results
 
+    def _call_all_drones(self, method, *args, **kwargs):
+        return self._fan_out(lambda drone: drone.call(method, *args, **kwargs),
+                             list(self.get_drones()))
+
     def _parse_pidfile(self, drone, raw_contents):
         contents = PidfileContents()
         if not raw_contents:
@@ -333,7 +499,19 @@ class DroneManager(object):
                          for pidfile_id in self._registered_pidfile_info]
         all_results = self._call_all_drones('refresh', pidfile_paths)
 
-        for drone, results_list in all_results.items():
+        for drone in self.get_drones():
+            is_current = drone in all_results
+            if is_current:
+                results_list = all_results[drone]
+                self._last_refresh_results[drone] = results_list
+            elif drone in self._last_refresh_results:
+                # keep the drone's last known processes and pidfiles rather
+                # than treating everything on it as gone
+                logging.warning('Using stale process information for drone '
+                                '%s', drone.hostname)
+                results_list = self._last_refresh_results[drone]
+            else:
+                continue
             results = results_list[0]
 
             for process_info in results['autoserv_processes']:
@@ -346,7 +524,8 @@ class DroneManager(object):
                                    self._pidfiles_second_read)
 
             self._compute_active_processes(drone)
-            if drone.enabled:
+            # don't hand new work to a drone that isn't answering
+            if drone.enabled and is_current:
                 self._enqueue_drone(drone)
 
     def execute_actions(self):
@@ -354,8 +533,11 @@ class DroneManager(object):
         Called at the end of a scheduler cycle to execute all queued actions
         on drones.
         """
-        for drone in list(self._drones.values()):
-            drone.execute_queued_calls()
+        # a batch that timed out may still be running on its drone
+        resend_failed = self._get_drone_fanout_workers() <= 0
+        self._fan_out(
+            lambda drone: drone.execute_queued_calls(resend_failed),
+            list(self._drones.values()))
 
         try:
             self._results_drone.execute_queued_calls()
@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 
 import os
+import threading
+import time
 import unittest
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -91,6 +93,7 @@ class DroneManager(unittest.TestCase):
 
     def tearDown(self):
         self.god.unstub_all()
+        settings.reset_values()
 
     def _test_choose_drone_for_execution_helper(self, processes_info_list,
                                                 requested_processes):
@@ -310,6 +313,70 @@ class DroneManager(unittest.TestCase):
         self.manager._drop_old_pidfiles()
         self.assertFalse(self.manager._registered_pidfile_info)
 
+    def test_fan_out_serial(self):
+        other_drone = MockDrone('other_drone')
+        results = self.manager._fan_out(lambda drone: drone.name,
+                                        [self.mock_drone, other_drone])
+        self.assertEqual({self.mock_drone: 'mock_drone',
+                          other_drone: 'other_drone'}, results)
+
+    def test_fan_out_isolates_failing_drone(self):
+        settings.override_value('SCHEDULER', 'drone_fanout_workers', '2')
+        self.god.stub_with(drone_manager.mail.manager, 'enqueue_admin',
+                           lambda *args: None)
+        bad_drone = MockDrone('bad_drone')
+
+        def call(drone):
+            if drone is bad_drone:
+                raise drones.DroneUnreachable
+            return drone.name
+
+        results = self.manager._fan_out(call, [self.mock_drone, bad_drone])
+        self.assertEqual({self.mock_drone: 'mock_drone'}, results)
+
+    def test_fan_out_skips_hung_drone_until_it_answers(self):
+        settings.override_value('SCHEDULER', 'drone_fanout_workers', '2')
+        settings.override_value('SCHEDULER', 'drone_call_timeout_sec', '1')
+        hung_drone = MockDrone('hung_drone')
+        release = threading.Event()
+
+        def call(drone):
+            if drone is hung_drone:
+                release.wait()
+            return drone.name
+
+        all_drones = [self.mock_drone, hung_drone]
+        self.assertEqual({self.mock_drone: 'mock_drone'},
+                         self.manager._fan_out(call, all_drones))
+        # still busy: not called again, and not waited for
+        self.assertEqual({self.mock_drone: 'mock_drone'},
+                         self.manager._fan_out(lambda drone: drone.name,
+                                               all_drones))
+        release.set()
+        self.manager._pending_drone_calls[hung_drone].result()
+        self.assertEqual({self.mock_drone: 'mock_drone',
+                          hung_drone: 'hung_drone'},
+                         self.manager._fan_out(lambda drone: drone.name,
+                                               all_drones))
+        self.manager.shutdown()
+
+    def test_fan_out_timeout_per_drone(self):
+        settings.override_value('SCHEDULER', 'drone_fanout_workers', '1')
+        settings.override_value('SCHEDULER', 'drone_call_timeout_sec', '1')
+        other_drone = MockDrone('other_drone')
+
+        def call(drone):
+            time.sleep(0.6)
+            return drone.name
+
+        # with one worker the second call starts 0.6s in, and gets its own
+        # second to answer
+        self.assertEqual({self.mock_drone: 'mock_drone',
+                          other_drone: 'other_drone'},
+                         self.manager._fan_out(call, [self.mock_drone,
+                                                      other_drone]))
+        self.manager.shutdown()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -435,7 +435,69 @@ def return_data(data):
     print(pickle.dumps(data))
 
 
+def write_message(stream, data):
+    """
+    Write a single framed message to a binary stream.
+
+    A frame is the length of the pickled payload as an ASCII decimal line,
+    followed by the payload itself, so a reader never has to guess where
+    one batch of calls (or results) ends and the next one begins.
+    """
+    payload = pickle.dumps(data)
+    stream.write(b'%d\n' % len(payload))
+    stream.write(payload)
+    stream.flush()
+
+
+def read_message(stream):
+    """
+    Read a single framed message written by write_message().
+
+    :return: The unpickled message.
+    :raise EOFError: if the stream was closed, either cleanly between
+            messages or in the middle of one.
+    """
+    header = stream.readline()
+    if not header:
+        raise EOFError('Channel closed')
+    try:
+        size = int(header)
+    except ValueError:
+        raise ValueError('Invalid message header: %r' % header)
+    payload = stream.read(size)
+    if len(payload) != size:
+        raise EOFError('Channel closed after %d of %d bytes' %
+                       (len(payload), size))
+    return pickle.loads(payload)
+
+
+def agent_main(input_stream, output_stream):
+    """
+    Serve batches of calls until the scheduler closes the channel.
+
+    The same DroneUtility is kept across batches, so the drone pays for
+    interpreter startup and the ssh handshake only once per connection
+    instead of once per scheduler tick.
+    """
+    drone_utility = DroneUtility()
+    while True:
+        try:
+            calls = read_message(input_stream)
+        except EOFError:
+            break
+        write_message(output_stream, drone_utility.execute_calls(calls))
+    drone_utility.wait_for_all_async_commands()
+
+
 def main():
+    if '--agent' in sys.argv[1:]:
+        # Anything printed by the calls we execute would corrupt the
+        # framing, so keep the real stdout for the channel alone and send
+        # everything else to stderr.
+        channel = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        agent_main(sys.stdin.buffer, channel)
+        return
     calls = parse_input()
     drone_utility = DroneUtility()
     return_value = drone_utility.execute_calls(calls)
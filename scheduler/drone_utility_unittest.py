@@ -3,7 +3,7 @@
 """Tests for drone_utility."""
 
 import unittest
-from io import StringIO
+from io import BytesIO, StringIO
 
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -80,5 +80,40 @@ class TestDroneUtility(unittest.TestCase):
         self.god.check_playback()
 
 
+class TestAgentProtocol(unittest.TestCase):
+
+    def test_message_round_trip(self):
+        stream = BytesIO()
+        drone_utility.write_message(stream, ['foo', {'bar': 1}])
+        drone_utility.write_message(stream, 'baz')
+        stream.seek(0)
+        self.assertEqual(['foo', {'bar': 1}],
+                         drone_utility.read_message(stream))
+        self.assertEqual('baz', drone_utility.read_message(stream))
+        self.assertRaises(EOFError, drone_utility.read_message, stream)
+
+    def test_truncated_message(self):
+        stream = BytesIO()
+        drone_utility.write_message(stream, 'foo' * 10)
+        stream = BytesIO(stream.getvalue()[:-1])
+        self.assertRaises(EOFError, drone_utility.read_message, stream)
+
+    def test_agent_serves_batches_until_eof(self):
+        input_stream = BytesIO()
+        drone_utility.write_message(input_stream, [])
+        drone_utility.write_message(input_stream, [])
+        input_stream.seek(0)
+        output_stream = BytesIO()
+
+        drone_utility.agent_main(input_stream, output_stream)
+
+        output_stream.seek(0)
+        for _ in range(2):
+            self.assertEqual(dict(results=[], warnings=[]),
+                             drone_utility.read_message(output_stream))
+        self.assertRaises(EOFError, drone_utility.read_message,
+                          output_stream)
+
+
 if __name__ == '__main__':
     unittest.main()
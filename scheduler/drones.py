@@ -1,6 +1,9 @@
 import pickle
 import logging
 import os
+import select
+import subprocess
+import time
 
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -21,6 +24,134 @@ class DroneUnreachable(Exception):
     pass
 
 
+class DroneAgentError(Exception):
+
+    """The persistent drone_utility agent channel failed."""
+    pass
+
+
+class _DeadlineReader(object):
+
+    """
+    Reads a pipe with a deadline, for drone_utility.read_message().
+
+    Set deadline before each message, reads raise DroneAgentError once it
+    passed.
+    """
+
+    def __init__(self, fd, description):
+        self._fd = fd
+        self._description = description
+        self._buffer = b''
+        self.deadline = None
+
+    def _fill(self):
+        timeout = max(0, self.deadline - time.time())
+        if not select.select([self._fd], [], [], timeout)[0]:
+            raise DroneAgentError('No reply from the drone agent on %s in '
+                                  'time' % self._description)
+        data = os.read(self._fd, 65536)
+        self._buffer += data
+        return bool(data)
+
+    def _take(self, size):
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self):
+        while b'\n' not in self._buffer:
+            if not self._fill():
+                return self._take(len(self._buffer))
+        return self._take(self._buffer.index(b'\n') + 1)
+
+    def read(self, size):
+        while len(self._buffer) < size:
+            if not self._fill():
+                break
+        return self._take(size)
+
+
+class _DroneAgentChannel(object):
+
+    """
+    A long lived `drone_utility.py --agent` process on a remote drone.
+
+    Batches of calls are written to the agent as framed messages and the
+    results are read back the same way. The ssh session is started through
+    the host's master connection when master ssh is enabled, so reconnecting
+    after a drop is cheap.
+
+    :param timeout: Seconds to wait for the reply to a batch.
+    """
+
+    def __init__(self, host, command, timeout):
+        self._host = host
+        self._command = command
+        self._timeout = timeout
+        self._process = None
+        self._reader = None
+
+    def is_connected(self):
+        return self._process is not None and self._process.poll() is None
+
+    def connect(self):
+        self.close()
+        self._host.start_master_ssh()
+        ssh_cmd = '%s "%s"' % (self._host.ssh_command(connect_timeout=300),
+                               self._command)
+        logging.info("Starting drone agent on %s", self._host.hostname)
+        self._process = subprocess.Popen(ssh_cmd, shell=True,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         close_fds=True)
+        self._reader = _DeadlineReader(self._process.stdout.fileno(),
+                                       self._host.hostname)
+
+    def close(self):
+        if self._process is None:
+            return
+        for stream in (self._process.stdin, self._process.stdout):
+            try:
+                stream.close()
+            except (IOError, OSError):
+                pass
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        self._process = None
+        self._reader = None
+
+    def _send(self, calls):
+        drone_utility.write_message(self._process.stdin, calls)
+
+    def _receive(self):
+        self._reader.deadline = time.time() + self._timeout
+        return drone_utility.read_message(self._reader)
+
+    def execute(self, calls):
+        """
+        Run a batch of calls on the agent and return its reply.
+
+        A dead channel is reconnected before sending. A batch is never
+        resent, since the calls may have already run on the drone, even
+        when it fails partway through: if the batch can't be sent whole or
+        the reply doesn't come back in time, the channel is dropped and an
+        error is raised, and the next batch reconnects.
+        """
+        if not self.is_connected():
+            self.connect()
+        try:
+            self._send(calls)
+            return self._receive()
+        except DroneAgentError:
+            self.close()
+            raise
+        except Exception as exc:
+            self.close()
+            raise DroneAgentError('Lost drone agent on %s: %s' %
+                                  (self._host.hostname, exc))
+
+
 class _AbstractDrone(object):
 
     """
@@ -82,11 +213,32 @@ class _AbstractDrone(object):
     def clear_call_queue(self):
         self._calls = []
 
-    def execute_queued_calls(self):
+    def _can_resend_calls(self):
+        """
+        :return: False if a failed batch may have run on the drone, at
+                least partly, so it must not be sent again.
+        """
+        return True
+
+    def execute_queued_calls(self, resend_failed=True):
+        """
+        :param resend_failed: Keep a failed batch queued, to be sent again
+                with the next batch. Pass False when the batch can still be
+                running after a failure (e.g. after a timeout), since calls
+                like kill_process must not run twice.
+        """
         if not self._calls:
             return
-        self._execute_calls(self._calls)
+        # take the calls off the queue first, so calls queued while these
+        # are executing (e.g. from another thread) are kept for next time
+        calls = self._calls
         self.clear_call_queue()
+        try:
+            self._execute_calls(calls)
+        except Exception:
+            if resend_failed and self._can_resend_calls():
+                self._calls = calls + self._calls
+            raise
 
     def set_autotest_install_dir(self, path):
         pass
@@ -122,20 +274,42 @@ class _RemoteDrone(_AbstractDrone):
             logging.error('Drone %s is unpingable, kicking out', hostname)
             raise DroneUnreachable
         self._autotest_install_dir = AUTOTEST_INSTALL_DIR
+        self._agent = None
+        if settings.get_value('SCHEDULER', 'drone_agent_mode', type=bool,
+                              default=False):
+            self._agent = self._create_agent()
 
     @property
     def _drone_utility_path(self):
         return os.path.join(self._autotest_install_dir,
                             'scheduler', 'drone_utility.py')
 
+    def _create_agent(self):
+        timeout = settings.get_value('SCHEDULER', 'drone_agent_timeout_sec',
+                                     type=int, default=1800)
+        return _DroneAgentChannel(
+            self._host, 'python %s --agent' % self._drone_utility_path,
+            timeout)
+
     def set_autotest_install_dir(self, path):
         self._autotest_install_dir = path
+        if self._agent is not None:
+            self._agent.close()
+            self._agent = self._create_agent()
 
     def shutdown(self):
         super(_RemoteDrone, self).shutdown()
+        if self._agent is not None:
+            self._agent.close()
         self._host.close()
 
+    def _can_resend_calls(self):
+        # the agent never resends a batch, see _DroneAgentChannel.execute()
+        return self._agent is None
+
     def _execute_calls_impl(self, calls):
+        if self._agent is not None:
+            return self._agent.execute(calls)
         logging.info("Running drone_utility on %s", self.hostname)
         result = self._host.run('python %s' % self._drone_utility_path,
                                 stdin=pickle.dumps(calls), stdout_tee=None,
@@ -3,6 +3,9 @@
 """Tests for autotest.scheduler.drones."""
 
 import pickle
+import subprocess
+import sys
+import time
 
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -10,6 +13,7 @@ except ImportError:
     from . import common  # pylint: disable=W0611
 
 from autotest.client.shared import utils
+from autotest.client.shared.settings import settings
 from autotest.client.shared.test_utils import mock, unittest
 from autotest.scheduler import drones
 from autotest.server.hosts import ssh_host
@@ -25,6 +29,7 @@ class RemoteDroneTest(unittest.TestCase):
 
     def tearDown(self):
         self.god.unstub_all()
+        settings.reset_values()
 
     def test_unreachable(self):
         drones.drone_utility.create_host.expect_call('fakehost').and_return(
@@ -51,6 +56,109 @@ class RemoteDroneTest(unittest.TestCase):
         self.assertEqual('mock return', drone._execute_calls_impl(mock_calls))
         self.god.check_playback()
 
+    def test_execute_calls_impl_agent_mode(self):
+        settings.override_value('SCHEDULER', 'drone_agent_mode', 'True')
+        self.god.stub_with(drones._RemoteDrone, '_drone_utility_path',
+                           'mock-drone-utility-path')
+        drones.drone_utility.create_host.expect_call('fakehost').and_return(
+            self._mock_host)
+        self._mock_host.is_up.expect_call().and_return(True)
+        mock_agent = self.god.create_mock_class(drones._DroneAgentChannel,
+                                                'mock agent')
+        self.god.stub_function(drones, '_DroneAgentChannel')
+        drones._DroneAgentChannel.expect_call(
+            self._mock_host, 'python mock-drone-utility-path --agent',
+            1800).and_return(mock_agent)
+        mock_calls = ('foo',)
+        mock_agent.execute.expect_call(mock_calls).and_return('mock return')
+
+        drone = drones._RemoteDrone('fakehost')
+        self.assertEqual('mock return', drone._execute_calls_impl(mock_calls))
+        self.god.check_playback()
+
+
+class FakeAgentHost(object):
+
+    hostname = 'fakehost'
+
+
+class LocalAgentChannel(drones._DroneAgentChannel):
+
+    """Runs the agent command locally instead of through ssh."""
+
+    sends = 0
+
+    def connect(self):
+        self.close()
+        self._process = subprocess.Popen(
+            [sys.executable, '-c', self._command], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, close_fds=True)
+        self._reader = drones._DeadlineReader(self._process.stdout.fileno(),
+                                              self._host.hostname)
+
+    def _send(self, calls):
+        self.sends += 1
+        super(LocalAgentChannel, self)._send(calls)
+
+
+# answers each message with itself
+ECHO_AGENT = """
+import sys
+for header in iter(sys.stdin.buffer.readline, b''):
+    sys.stdout.buffer.write(header + sys.stdin.buffer.read(int(header)))
+    sys.stdout.buffer.flush()
+"""
+
+
+class DroneAgentChannelTest(unittest.TestCase):
+
+    def test_execute(self):
+        channel = LocalAgentChannel(FakeAgentHost(), ECHO_AGENT, 10)
+        self.assertEqual(['batch1'], channel.execute(['batch1']))
+        self.assertEqual(['batch2'], channel.execute(['batch2']))
+        channel.close()
+
+    def test_reply_timeout(self):
+        channel = LocalAgentChannel(FakeAgentHost(),
+                                    'import time; time.sleep(30)', 0.5)
+        start = time.time()
+        self.assertRaises(drones.DroneAgentError, channel.execute, ['batch'])
+        self.assertTrue(time.time() - start < 10)
+        self.assertFalse(channel.is_connected())
+
+    def test_failed_send_not_resent(self):
+        channel = LocalAgentChannel(FakeAgentHost(), ECHO_AGENT, 10)
+        channel.connect()
+        channel._process.stdin.close()
+        self.assertRaises(drones.DroneAgentError, channel.execute, ['batch'])
+        self.assertEqual(1, channel.sends)
+        self.assertFalse(channel.is_connected())
+
+
+class FailingDrone(drones._AbstractDrone):
+
+    def _execute_calls_impl(self, calls):
+        raise drones.DroneUnreachable('lost it')
+
+
+class AbstractDroneTest(unittest.TestCase):
+
+    def test_failed_batch_resent(self):
+        drone = FailingDrone()
+        drone.queue_call('write_to_file', 'path', 'contents')
+        self.assertRaises(drones.DroneUnreachable, drone.execute_queued_calls)
+        drone.queue_call('kill_process', 'process')
+        self.assertEqual(["write_to_file('path', 'contents')",
+                          "kill_process('process')"],
+                         [str(call) for call in drone._calls])
+
+    def test_failed_batch_not_resent(self):
+        drone = FailingDrone()
+        drone.queue_call('kill_process', 'process')
+        self.assertRaises(drones.DroneUnreachable, drone.execute_queued_calls,
+                          resend_failed=False)
+        self.assertEqual([], drone._calls)
+
 
 if __name__ == '__main__':
     unittest.main()
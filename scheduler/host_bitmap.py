@@ -0,0 +1,123 @@
+"""
+Bitmap representation of host sets for the host scheduler.
+
+Each host scheduled in a tick gets one bit, and the hosts in a label, in an
+ACL group, in an atomic group, etc. become arbitrary precision integers.
+Finding the hosts eligible for a queue entry is then a handful of AND and
+AND NOT operations over whole host sets instead of a per-host loop.
+"""
+
+
+class HostBitmaps(object):
+
+    """
+    Bitmaps of host relations, built once per scheduler tick.
+
+    :param host_ids: Ids of all the hosts that can be scheduled this tick.
+    :param host_acls: Dict mapping host ids to sets of ACL group ids.
+    :param host_labels: Dict mapping host ids to sets of label ids.
+    :param labels: Dict mapping label ids to Label objects.
+    :param everyone_acl: Set with the id of the "Everyone" ACL group.
+    """
+
+    def __init__(self, host_ids, host_acls, host_labels, labels,
+                 everyone_acl):
+        self._host_ids = sorted(host_ids)
+        self._bits = dict((host_id, 1 << index)
+                          for index, host_id in enumerate(self._host_ids))
+
+        self._label_masks = self._invert(host_labels)
+        self._acl_masks = self._invert(host_acls)
+
+        self._everyone_only_mask = 0
+        for host_id, acls in host_acls.items():
+            if acls == everyone_acl:
+                self._everyone_only_mask |= self._bits.get(host_id, 0)
+
+        self._only_if_needed_label_ids = [label_id for label_id, label
+                                          in labels.items()
+                                          if label.only_if_needed]
+
+        # maps atomic group id to the hosts with a label in that group
+        self._atomic_group_masks = {}
+        for label_id, mask in self._label_masks.items():
+            label = labels.get(label_id)
+            if label is None or label.atomic_group_id is None:
+                continue
+            group_id = label.atomic_group_id
+            self._atomic_group_masks[group_id] = (
+                self._atomic_group_masks.get(group_id, 0) | mask)
+
+        self._any_atomic_group_mask = 0
+        # hosts with labels in more than one atomic group, a misconfiguration
+        # that is left to the per host checks
+        self.ambiguous_atomic_group_mask = 0
+        for mask in self._atomic_group_masks.values():
+            self.ambiguous_atomic_group_mask |= (
+                self._any_atomic_group_mask & mask)
+            self._any_atomic_group_mask |= mask
+
+    def _invert(self, host_relation):
+        """Turn {host id: set(ids)} into {id: mask of hosts}."""
+        masks = {}
+        for host_id, related_ids in host_relation.items():
+            bit = self._bits.get(host_id)
+            if bit is None:
+                continue
+            for related_id in related_ids:
+                masks[related_id] = masks.get(related_id, 0) | bit
+        return masks
+
+    def mask_for(self, host_ids):
+        """:return: The bitmap of the given hosts, ignoring unknown ones."""
+        mask = 0
+        for host_id in host_ids:
+            mask |= self._bits.get(host_id, 0)
+        return mask
+
+    def host_bit(self, host_id):
+        return self._bits.get(host_id, 0)
+
+    def host_ids_in(self, mask):
+        """Yield the ids of the hosts in mask, lowest id first."""
+        while mask:
+            lowest_bit = mask & -mask
+            yield self._host_ids[lowest_bit.bit_length() - 1]
+            mask ^= lowest_bit
+
+    def label_mask(self, label_id):
+        return self._label_masks.get(label_id, 0)
+
+    def eligible_mask(self, job_acls, job_dependencies, meta_host):
+        """
+        Hosts that pass the ACL, dependency, only_if_needed and metahost ACL
+        checks of BaseHostScheduler.is_host_eligible_for_job().
+
+        Atomic groups are handled separately by atomic_group_mask().
+        """
+        mask = 0
+        for acl_id in job_acls:
+            mask |= self._acl_masks.get(acl_id, 0)
+        for label_id in job_dependencies:
+            mask &= self.label_mask(label_id)
+
+        if meta_host:
+            # only_if_needed labels are bypassed for specific hosts
+            for label_id in self._only_if_needed_label_ids:
+                if label_id != meta_host and label_id not in job_dependencies:
+                    mask &= ~self.label_mask(label_id)
+        if meta_host is not None:
+            # don't schedule metahosts on hosts reserved through other ACLs
+            mask &= self._everyone_only_mask
+        return mask
+
+    def atomic_group_mask(self, atomic_group_id):
+        """
+        Hosts whose only atomic group is atomic_group_id or, for None, hosts
+        in no atomic group at all. The result may be negative (it stands for
+        an infinite set) and is meant to be ANDed with other masks.
+        """
+        if atomic_group_id is None:
+            return ~self._any_atomic_group_mask
+        return (self._atomic_group_masks.get(atomic_group_id, 0) &
+                ~self.ambiguous_atomic_group_mask)
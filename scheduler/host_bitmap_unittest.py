@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+import unittest
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    from . import common  # pylint: disable=W0611
+from autotest.scheduler import host_bitmap
+
+
+class FakeLabel(object):
+
+    def __init__(self, only_if_needed=False, atomic_group_id=None):
+        self.only_if_needed = only_if_needed
+        self.atomic_group_id = atomic_group_id
+
+
+class HostBitmapsTest(unittest.TestCase):
+    _EVERYONE = 1
+    _RESERVED = 2
+
+    def setUp(self):
+        self.labels = {10: FakeLabel(),
+                       11: FakeLabel(),
+                       12: FakeLabel(only_if_needed=True),
+                       20: FakeLabel(atomic_group_id=1),
+                       21: FakeLabel(atomic_group_id=2)}
+        host_labels = {1: set([10]),
+                       2: set([10, 11]),
+                       3: set([10, 12]),
+                       4: set([10, 20]),
+                       5: set([10, 20, 21]),
+                       6: set([10])}
+        host_acls = {1: set([self._EVERYONE]),
+                     2: set([self._EVERYONE]),
+                     3: set([self._EVERYONE]),
+                     4: set([self._EVERYONE]),
+                     5: set([self._EVERYONE]),
+                     6: set([self._EVERYONE, self._RESERVED])}
+        self.bitmaps = host_bitmap.HostBitmaps(
+            range(1, 7), host_acls, host_labels, self.labels,
+            set([self._EVERYONE]))
+
+    def _host_ids(self, mask):
+        return list(self.bitmaps.host_ids_in(mask))
+
+    def test_mask_round_trip(self):
+        self.assertEqual([2, 5], self._host_ids(self.bitmaps.mask_for(
+            [5, 2, 99])))
+        self.assertEqual([], self._host_ids(0))
+
+    def test_label_mask(self):
+        self.assertEqual([2], self._host_ids(self.bitmaps.label_mask(11)))
+        self.assertEqual(0, self.bitmaps.label_mask(99))
+
+    def test_eligible_mask_acls(self):
+        mask = self.bitmaps.eligible_mask(set([self._RESERVED]), set(), None)
+        self.assertEqual([6], self._host_ids(mask))
+        self.assertEqual(0, self.bitmaps.eligible_mask(set(), set(), None))
+
+    def test_eligible_mask_dependencies(self):
+        mask = self.bitmaps.eligible_mask(set([self._EVERYONE]),
+                                          set([10, 11]), None)
+        self.assertEqual([2], self._host_ids(mask))
+
+    def test_eligible_mask_metahost(self):
+        # host 3 has an only_if_needed label, host 6 is reserved
+        mask = self.bitmaps.eligible_mask(set([self._EVERYONE]), set(), 10)
+        self.assertEqual([1, 2, 4, 5], self._host_ids(mask))
+        # unless the job asks for the only_if_needed label
+        mask = self.bitmaps.eligible_mask(set([self._EVERYONE]), set([12]),
+                                          10)
+        self.assertEqual([3], self._host_ids(mask))
+        mask = self.bitmaps.eligible_mask(set([self._EVERYONE]), set(), 12)
+        self.assertEqual([1, 2, 3, 4, 5], self._host_ids(mask))
+
+    def test_atomic_group_mask(self):
+        all_hosts = self.bitmaps.mask_for(range(1, 7))
+        self.assertEqual([1, 2, 3, 6], self._host_ids(
+            all_hosts & self.bitmaps.atomic_group_mask(None)))
+        self.assertEqual([4], self._host_ids(
+            all_hosts & self.bitmaps.atomic_group_mask(1)))
+        self.assertEqual([], self._host_ids(
+            all_hosts & self.bitmaps.atomic_group_mask(2)))
+        self.assertEqual([5], self._host_ids(
+            self.bitmaps.ambiguous_atomic_group_mask))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,10 +3,11 @@ Autotest scheduling utility.
 """
 import logging
 
-from autotest.client.shared import utils
+from autotest.client.shared import mail, utils
 from autotest.client.shared.settings import settings
 from autotest.frontend.afe import models
-from autotest.scheduler import metahost_scheduler, scheduler_config
+from autotest.scheduler import host_bitmap, metahost_scheduler
+from autotest.scheduler import scheduler_config
 from autotest.scheduler import scheduler_models
 
 
@@ -20,6 +21,187 @@ class SchedulerError(Exception):
     """Raised by HostScheduler when an inconsistent state occurs."""
 
 
+class HostSchedulerIndex(object):
+
+    """In-memory copy of the host, label and ACL relations used to schedule.
+
+    Instead of reloading these relations on every tick, each backing table is
+    summarized by a change signature (its row count, highest id and the sums
+    of its two relation columns) and only the relations whose table changed
+    are reloaded. These are many-to-many tables whose rows are only ever
+    inserted and deleted, so a change moves the signature, also when an id
+    is reused after the auto-increment counter was reset by a restart.
+
+    Host relations are kept for all hosts. Job relations are cached per job
+    and filled in on demand for jobs not seen before; the ones that can
+    change for an existing job are dropped whenever their table changes.
+    The ineligible hosts of jobs are not kept, afe_ineligible_host_queues
+    grows with every job run and is cheaper to query for the pending jobs.
+
+    Every check_interval refreshes (0 to never), the index is compared with a
+    full reload and replaced by it if they disagree, which catches changes
+    the signatures could still miss.
+    """
+
+    _HOST_ACLS_TABLE = 'afe_acl_groups_hosts'
+    _HOST_LABELS_TABLE = 'afe_hosts_labels'
+    # maps each job relation to the table that invalidates it, or None when
+    # the relation never changes once the job has been created
+    _JOB_RELATION_TABLES = {
+        'job_acls': 'afe_acl_groups_users',
+        'job_dependencies': None,
+    }
+    # maps each table with a signature to its two relation columns
+    _SIGNATURE_COLUMNS = {
+        'afe_acl_groups_hosts': ('aclgroup_id', 'host_id'),
+        'afe_hosts_labels': ('host_id', 'label_id'),
+        'afe_acl_groups_users': ('aclgroup_id', 'user_id'),
+    }
+
+    def __init__(self, db, check_interval=100):
+        self._db = db
+        self._check_interval = check_interval
+        self._refresh_count = 0
+        # maps table name to its last seen signature
+        self._signatures = {}
+        # maps host id to set of ACL group ids
+        self._host_acls = {}
+        # maps host id to set of label ids
+        self._host_labels = {}
+        # maps job relation name to dict mapping job id to set of ids
+        self._job_relations = dict((name, {}) for name
+                                   in self._JOB_RELATION_TABLES)
+        # maps job relation name to the function that loads it from the db
+        self._job_fetchers = {}
+
+    def _get_signature(self, table):
+        rows = self._db.execute(
+            'SELECT COUNT(*), MAX(id), SUM(%s), SUM(%s) FROM %s'
+            % (self._SIGNATURE_COLUMNS[table] + (table,)))
+        return tuple(rows[0])
+
+    def _has_changed(self, table):
+        signature = self._get_signature(table)
+        changed = self._signatures.get(table) != signature
+        self._signatures[table] = signature
+        return changed
+
+    def _load_host_relation(self, query):
+        result = {}
+        for host_id, other_id in self._db.execute(query):
+            result.setdefault(int(host_id), set()).add(int(other_id))
+        return result
+
+    def _load_host_acls(self):
+        return self._load_host_relation(
+            'SELECT host_id, aclgroup_id FROM %s' % self._HOST_ACLS_TABLE)
+
+    def _load_host_labels(self):
+        return self._load_host_relation(
+            'SELECT host_id, label_id FROM %s' % self._HOST_LABELS_TABLE)
+
+    def refresh(self):
+        """Bring the index up to date with the database.
+
+        Called once per tick, before any of the get_* methods.
+        """
+        if self._has_changed(self._HOST_ACLS_TABLE):
+            self._host_acls = self._load_host_acls()
+        if self._has_changed(self._HOST_LABELS_TABLE):
+            self._host_labels = self._load_host_labels()
+        for name, table in self._JOB_RELATION_TABLES.items():
+            if table is not None and self._has_changed(table):
+                self._job_relations[name] = {}
+
+        self._refresh_count += 1
+        if (self._check_interval and
+                self._refresh_count % self._check_interval == 0):
+            self.check_consistency()
+
+    def _report_inconsistency(self, relation):
+        message = ('Host scheduler index for %s was out of date with the '
+                   'database; it has been rebuilt.' % relation)
+        logging.error(message)
+        mail.manager.enqueue_admin('Host scheduler index inconsistency',
+                                   message)
+
+    def check_consistency(self):
+        """Compare the index with a full reload, fixing it if needed.
+
+        :return: True if the index matched the database.
+        """
+        consistent = True
+        host_acls = self._load_host_acls()
+        if host_acls != self._host_acls:
+            self._report_inconsistency('host ACLs')
+            self._host_acls = host_acls
+            consistent = False
+        host_labels = self._load_host_labels()
+        if host_labels != self._host_labels:
+            self._report_inconsistency('host labels')
+            self._host_labels = host_labels
+            consistent = False
+
+        for name, cache in self._job_relations.items():
+            if not cache:
+                continue
+            fetched = self._job_fetchers[name](list(cache.keys()))
+            rebuilt = dict((job_id, fetched.get(job_id, set()))
+                           for job_id in cache)
+            if rebuilt != cache:
+                self._report_inconsistency(name.replace('_', ' '))
+                self._job_relations[name] = rebuilt
+                consistent = False
+        return consistent
+
+    def get_host_acls(self, host_ids):
+        """:return: A dict mapping each of host_ids to its ACL group ids."""
+        return dict((host_id, set(self._host_acls[host_id]))
+                    for host_id in host_ids if host_id in self._host_acls)
+
+    def get_label_hosts(self, host_ids):
+        """
+        :return: A tuple of a dict mapping label ids to the ids of host_ids
+                with that label, and a dict mapping each of host_ids to its
+                label ids.
+        """
+        labels_to_hosts = {}
+        hosts_to_labels = {}
+        for host_id in host_ids:
+            labels = self._host_labels.get(host_id)
+            if not labels:
+                continue
+            hosts_to_labels[host_id] = set(labels)
+            for label_id in labels:
+                labels_to_hosts.setdefault(label_id, set()).add(host_id)
+        return labels_to_hosts, hosts_to_labels
+
+    def get_job_relation(self, name, job_ids, fetch):
+        """
+        :param name: One of the keys of _JOB_RELATION_TABLES.
+        :param job_ids: Ids of the jobs to look up.
+        :param fetch: Function taking a list of job ids and returning a dict
+                mapping job ids to sets of ids, used for jobs not cached yet.
+
+        :return: A dict mapping the job ids with any related rows to a set
+                of the related ids, as fetch() would return.
+        """
+        self._job_fetchers[name] = fetch
+        cache = self._job_relations[name]
+        missing = set(job_id for job_id in job_ids if job_id not in cache)
+        if missing:
+            fetched = fetch(list(missing))
+            for job_id in missing:
+                cache[job_id] = fetched.get(job_id, set())
+        # forget jobs which are no longer pending
+        job_ids = set(job_ids)
+        for job_id in list(cache.keys()):
+            if job_id not in job_ids:
+                del cache[job_id]
+        return dict((job_id, cache[job_id]) for job_id in job_ids
+                    if cache[job_id])
+
+
 class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
 
     """Handles the logic for choosing when to run jobs and on which hosts.
@@ -58,6 +240,20 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
             [int(acl.id) for acl in
                 scheduler_models.ACLGroup.fetch(where="name like 'Everyone'")])
 
+        self._host_index = None
+        if settings.get_value(scheduler_config.CONFIG_SECTION,
+                              'host_scheduler_incremental_index', type=bool,
+                              default=False):
+            check_interval = settings.get_value(
+                scheduler_config.CONFIG_SECTION,
+                'host_scheduler_index_check_ticks', type=int, default=100)
+            self._host_index = HostSchedulerIndex(db, check_interval)
+
+        self._use_bitmaps = settings.get_value(
+            scheduler_config.CONFIG_SECTION,
+            'host_scheduler_bitmap_eligibility', type=bool, default=False)
+        self._bitmaps = None
+
     def _get_ready_hosts(self):
         # avoid any host with a currently active queue entry against it
         hosts = scheduler_models.Host.fetch(
@@ -145,20 +341,54 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         for metahost_scheduler in self._metahost_schedulers:
             metahost_scheduler.recovery_on_startup()
 
+    def _refresh_from_index(self, relevant_jobs):
+        index = self._host_index
+        index.refresh()
+        self._job_acls = index.get_job_relation(
+            'job_acls', relevant_jobs, self._get_job_acl_groups)
+        self._ineligible_hosts = self._get_job_ineligible_hosts(relevant_jobs)
+        self._job_dependencies = index.get_job_relation(
+            'job_dependencies', relevant_jobs, self._get_job_dependencies)
+
+        host_ids = list(self._hosts_available.keys())
+        self._host_acls = index.get_host_acls(host_ids)
+        self._label_hosts, self._host_labels = index.get_label_hosts(host_ids)
+
+        self._labels = self._get_labels()
+
+    def _refresh_bitmaps(self):
+        self._bitmaps = host_bitmap.HostBitmaps(
+            self._hosts_available.keys(), self._host_acls, self._host_labels,
+            self._labels, self.everyone_acl)
+        usable_host_ids = (host_id for host_id, host
+                           in self._hosts_available.items()
+                           if not host.invalid)
+        self._usable_mask = self._bitmaps.mask_for(usable_host_ids)
+        # maps (job id, meta_host, atomic_group_id) to eligible host mask
+        self._eligible_masks = {}
+
     def refresh(self, pending_queue_entries):
         self._hosts_available = self._get_ready_hosts()
 
         relevant_jobs = [queue_entry.job_id
                          for queue_entry in pending_queue_entries]
-        self._job_acls = self._get_job_acl_groups(relevant_jobs)
-        self._ineligible_hosts = self._get_job_ineligible_hosts(relevant_jobs)
-        self._job_dependencies = self._get_job_dependencies(relevant_jobs)
+        if self._host_index is not None:
+            self._refresh_from_index(relevant_jobs)
+        else:
+            self._job_acls = self._get_job_acl_groups(relevant_jobs)
+            self._ineligible_hosts = self._get_job_ineligible_hosts(
+                relevant_jobs)
+            self._job_dependencies = self._get_job_dependencies(relevant_jobs)
 
-        host_ids = list(self._hosts_available.keys())
-        self._host_acls = self._get_host_acls(host_ids)
-        self._label_hosts, self._host_labels = self._get_label_hosts(host_ids)
+            host_ids = list(self._hosts_available.keys())
+            self._host_acls = self._get_host_acls(host_ids)
+            self._label_hosts, self._host_labels = self._get_label_hosts(
+                host_ids)
 
-        self._labels = self._get_labels()
+            self._labels = self._get_labels()
+
+        if self._use_bitmaps:
+            self._refresh_bitmaps()
 
     def tick(self):
         for metahost_scheduler in self._metahost_schedulers:
@@ -171,6 +401,8 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         self._label_hosts[label_id].remove(host_id)
 
     def pop_host(self, host_id):
+        if self._bitmaps is not None:
+            self._usable_mask &= ~self._bitmaps.host_bit(host_id)
         return self._hosts_available.pop(host_id)
 
     def ineligible_hosts_for_entry(self, queue_entry):
@@ -275,6 +507,10 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
         :return: A subset of group_hosts Host ids that are eligible for the
                 supplied queue_entry.
         """
+        if self._bitmaps is not None:
+            mask = (self._bitmaps.mask_for(group_hosts) & self._usable_mask &
+                    self._get_eligible_mask(queue_entry))
+            return set(self._bitmaps.host_ids_in(mask))
         return set(host_id for host_id in group_hosts if
                    self.is_host_usable(host_id) and
                    self.is_host_eligible_for_job(host_id, queue_entry))
@@ -297,6 +533,41 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
                 self._check_atomic_group_labels(host_labels, queue_entry) and
                 self._check_no_acl_for_metahost(host_id, queue_entry))
 
+    def _get_eligible_mask(self, queue_entry):
+        """
+        :return: The bitmap of hosts eligible for queue_entry's job, whether
+                or not they are still available.
+        """
+        key = (queue_entry.job_id, queue_entry.meta_host,
+               queue_entry.atomic_group_id)
+        if key in self._eligible_masks:
+            return self._eligible_masks[key]
+
+        bitmaps = self._bitmaps
+        job_dependencies = self._job_dependencies.get(queue_entry.job_id,
+                                                      set())
+        mask = bitmaps.eligible_mask(
+            self._job_acls.get(queue_entry.job_id, set()), job_dependencies,
+            queue_entry.meta_host)
+        mask &= ~bitmaps.mask_for(self.ineligible_hosts_for_entry(queue_entry))
+
+        ambiguous_mask = mask & bitmaps.ambiguous_atomic_group_mask
+        mask &= bitmaps.atomic_group_mask(queue_entry.atomic_group_id)
+        for host_id in bitmaps.host_ids_in(ambiguous_mask):
+            if self._check_atomic_group_labels(
+                    self._host_labels.get(host_id, set()), queue_entry):
+                mask |= bitmaps.host_bit(host_id)
+
+        self._eligible_masks[key] = mask
+        return mask
+
+    def eligible_hosts_for_entry(self, queue_entry):
+        if self._bitmaps is None:
+            return None
+        mask = (self._get_eligible_mask(queue_entry) & self._usable_mask &
+                self._bitmaps.label_mask(queue_entry.meta_host))
+        return self._bitmaps.host_ids_in(mask)
+
     def _is_host_invalid(self, host_id):
         host_object = self._hosts_available.get(host_id, None)
         return host_object and host_object.invalid
@@ -304,7 +575,9 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
     def _schedule_non_metahost(self, queue_entry):
         if not self.is_host_eligible_for_job(queue_entry.host_id, queue_entry):
             return None
-        return self._hosts_available.pop(queue_entry.host_id, None)
+        if queue_entry.host_id not in self._hosts_available:
+            return None
+        return self.pop_host(queue_entry.host_id)
 
     def is_host_usable(self, host_id):
         if host_id not in self._hosts_available:
@@ -401,7 +674,7 @@ class BaseHostScheduler(metahost_scheduler.HostSchedulingUtility):
             host_list = []
             for host in eligible_hosts_in_group:
                 hosts_in_label.discard(host.id)
-                self._hosts_available.pop(host.id)
+                self.pop_host(host.id)
                 host_list.append(host)
             return host_list
 
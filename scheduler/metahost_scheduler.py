@@ -41,6 +41,18 @@ class HostSchedulingUtility(object):
         """
         raise NotImplementedError
 
+    def eligible_hosts_for_entry(self, queue_entry):
+        """Find all usable hosts eligible to run a metahost queue entry.
+
+        This is an optional shortcut for utilities that can compute the whole
+        set at once.  Returning None makes callers check the hosts in the
+        label one at a time with the methods above.
+
+        :param queue_entry: a HostQueueEntry DBObject
+        :return: an iterable of host ids, or None
+        """
+        return None
+
 
 class MetahostScheduler(object):
 
@@ -79,7 +91,22 @@ class LabelMetahostScheduler(MetahostScheduler):
     def can_schedule_metahost(self, queue_entry):
         return bool(queue_entry.meta_host)
 
+    def _assign_host(self, queue_entry, scheduling_utility, host_id):
+        # Remove the host from our cached internal state before returning
+        scheduling_utility.remove_host_from_label(host_id,
+                                                  queue_entry.meta_host)
+        host = scheduling_utility.pop_host(host_id)
+        queue_entry.set_host(host)
+
     def schedule_metahost(self, queue_entry, scheduling_utility):
+        eligible_host_ids = scheduling_utility.eligible_hosts_for_entry(
+            queue_entry)
+        if eligible_host_ids is not None:
+            for host_id in eligible_host_ids:
+                self._assign_host(queue_entry, scheduling_utility, host_id)
+                return
+            return
+
         label_id = queue_entry.meta_host
         hosts_in_label = scheduling_utility.hosts_in_label(label_id)
         ineligible_host_ids = scheduling_utility.ineligible_hosts_for_entry(
@@ -95,10 +122,7 @@ class LabelMetahostScheduler(MetahostScheduler):
                                                                queue_entry):
                 continue
 
-            # Remove the host from our cached internal state before returning
-            scheduling_utility.remove_host_from_label(host_id, label_id)
-            host = scheduling_utility.pop_host(host_id)
-            queue_entry.set_host(host)
+            self._assign_host(queue_entry, scheduling_utility, host_id)
             return
 
 
@@ -39,6 +39,8 @@ class LabelMetahostSchedulerTest(unittest.TestCase):
         entry.meta_host = 1
         host = object()
 
+        (self.scheduling_utility.eligible_hosts_for_entry.expect_call(entry)
+         .and_return(None))
         self.scheduling_utility.hosts_in_label.expect_call(1).and_return(
             [2, 3, 4, 5])
         # 2 is in ineligible_hosts
@@ -68,6 +70,8 @@ class LabelMetahostSchedulerTest(unittest.TestCase):
         entry = self.entry()
         entry.meta_host = 1
 
+        (self.scheduling_utility.eligible_hosts_for_entry.expect_call(entry)
+         .and_return(None))
         self.scheduling_utility.hosts_in_label.expect_call(1).and_return(())
         (self.scheduling_utility.ineligible_hosts_for_entry.expect_call(entry)
          .and_return(()))
@@ -76,6 +80,32 @@ class LabelMetahostSchedulerTest(unittest.TestCase):
                                                   self.scheduling_utility)
         self.god.check_playback()
 
+    def test_schedule_metahost_eligible_hosts(self):
+        entry = self.entry()
+        entry.meta_host = 1
+        host = object()
+
+        (self.scheduling_utility.eligible_hosts_for_entry.expect_call(entry)
+         .and_return(iter([4, 5])))
+        self.scheduling_utility.remove_host_from_label.expect_call(4, 1)
+        self.scheduling_utility.pop_host.expect_call(4).and_return(host)
+        entry.set_host.expect_call(host)
+
+        self.metahost_scheduler.schedule_metahost(entry,
+                                                  self.scheduling_utility)
+        self.god.check_playback()
+
+    def test_no_eligible_hosts(self):
+        entry = self.entry()
+        entry.meta_host = 1
+
+        (self.scheduling_utility.eligible_hosts_for_entry.expect_call(entry)
+         .and_return(iter([])))
+
+        self.metahost_scheduler.schedule_metahost(entry,
+                                                  self.scheduling_utility)
+        self.god.check_playback()
+
 
 if __name__ == '__main__':
     unittest.main()
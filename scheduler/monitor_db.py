@@ -30,6 +30,7 @@ from autotest.scheduler import gc_stats, host_scheduler, monitor_db_cleanup
 from autotest.scheduler import scheduler_logging_config
 from autotest.scheduler import scheduler_models
 from autotest.scheduler import status_server, scheduler_config
+from autotest.scheduler import tick_profiler
 
 WATCHER_PID_FILE_PREFIX = 'autotest-scheduler-watcher'
 PID_FILE_PREFIX = 'autotest-scheduler'
@@ -173,6 +174,9 @@ def initialize():
                                 'stresstest_autotest_web')
 
     os.environ['PATH'] = AUTOTEST_SERVER_DIR + ':' + os.environ['PATH']
+    # before any DatabaseConnection creates its cursor on the Django
+    # connection, so that their queries flush the deferred updates too
+    scheduler_models.flush_before_queries(django.db.connection)
     global _db
     _db = database_connection.DatabaseConnection(DB_CONFIG_SECTION)
     _db.connect(db_type='django')
@@ -298,10 +302,21 @@ class Dispatcher(object):
         self._queue_entry_agents = {}
         self._tick_count = 0
         self._last_garbage_stats_time = time.time()
+        self._defer_updates = settings.get_value(
+            scheduler_config.CONFIG_SECTION, 'coalesce_db_updates', type=bool,
+            default=False)
         self._seconds_between_garbage_stats = 60 * (
             settings.get_value(
                 scheduler_config.CONFIG_SECTION,
                 'gc_stats_interval_mins', type=int, default=6 * 60))
+        self._tick_profiler = tick_profiler.instance()
+        self._tick_profiler.configure(settings.get_value(
+            scheduler_config.CONFIG_SECTION, 'tick_profile_window', type=int,
+            default=0))
+        if self._tick_profiler.enabled:
+            self._tick_profiler.add_connection(_db)
+            self._tick_profiler.add_connection(scheduler_models._db)
+            self._tick_profiler.set_django_connection(django.db.connection)
 
     def initialize(self, recover_hosts=True):
         self._periodic_cleanup.initialize()
@@ -316,22 +331,49 @@ class Dispatcher(object):
         self._host_scheduler.recovery_on_startup()
 
     def tick(self):
-        self._garbage_collection()
-        _drone_manager.refresh()
-        self._run_cleanup()
-        self._find_aborting()
-        self._process_recurring_runs()
-        self._schedule_delay_tasks()
-        self._schedule_running_host_queue_entries()
-        self._schedule_special_tasks()
-        self._schedule_new_jobs()
-        self._handle_agents()
-        self._host_scheduler.tick()
-        _drone_manager.execute_actions()
-        mail.manager.send_queued_admin()
-        django.db.reset_queries()
+        profiler = self._tick_profiler
+        with profiler.phase('tick'):
+            self._tick_phases(profiler)
+        profiler.tick_done()
         self._tick_count += 1
 
+    def _tick_phases(self, profiler):
+        with profiler.phase('garbage_collection'):
+            self._garbage_collection()
+        with profiler.phase('drone_manager_refresh'):
+            _drone_manager.refresh()
+        if self._defer_updates:
+            # coalesce the field updates made during this tick, see
+            # scheduler_models.UnitOfWork
+            scheduler_models.begin_deferred_updates()
+        try:
+            with profiler.phase('run_cleanup'):
+                self._run_cleanup()
+            with profiler.phase('find_aborting'):
+                self._find_aborting()
+            with profiler.phase('process_recurring_runs'):
+                self._process_recurring_runs()
+            with profiler.phase('schedule_delay_tasks'):
+                self._schedule_delay_tasks()
+            with profiler.phase('schedule_running_host_queue_entries'):
+                self._schedule_running_host_queue_entries()
+            with profiler.phase('schedule_special_tasks'):
+                self._schedule_special_tasks()
+            with profiler.phase('schedule_new_jobs'):
+                self._schedule_new_jobs()
+            with profiler.phase('handle_agents'):
+                self._handle_agents()
+            with profiler.phase('host_scheduler_tick'):
+                self._host_scheduler.tick()
+        finally:
+            with profiler.phase('flush_updates'):
+                scheduler_models.end_deferred_updates()
+        with profiler.phase('drone_manager_execute_actions'):
+            _drone_manager.execute_actions()
+        with profiler.phase('send_queued_admin'):
+            mail.manager.send_queued_admin()
+        django.db.reset_queries()
+
     def _run_cleanup(self):
         self._periodic_cleanup.run_cleanup_maybe()
         self._24hr_upkeep.run_cleanup_maybe()
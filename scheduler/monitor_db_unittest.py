@@ -421,6 +421,79 @@ class DispatcherSchedulingTest(BaseSchedulerTest):
         self.assertEqual(1, host_scheduler._get_host_atomic_group_id(
             [self.label7.id, self.label5.id]))
 
+    def _host_label_ids(self, host):
+        return set(label.id for label in host.labels.all())
+
+    def test_HostSchedulerIndex_reloads_changed_tables(self):
+        host = self.hosts[0]
+        index = host_scheduler.HostSchedulerIndex(self._database)
+        index.refresh()
+        labels_to_hosts, hosts_to_labels = index.get_label_hosts([host.id])
+        self.assertEqual(self._host_label_ids(host), hosts_to_labels[host.id])
+        self.assertEqual(set([host.id]), labels_to_hosts[self.label1.id])
+
+        new_label = models.Label.objects.create(name='new label')
+        host.labels.add(new_label)
+        index.refresh()
+        _, hosts_to_labels = index.get_label_hosts([host.id])
+        self.assertTrue(new_label.id in hosts_to_labels[host.id])
+
+        host.labels.remove(self.label1)
+        index.refresh()
+        labels_to_hosts, _ = index.get_label_hosts([host.id])
+        self.assertFalse(self.label1.id in labels_to_hosts)
+        self.assertTrue(index.check_consistency())
+
+    def test_HostSchedulerIndex_sees_reused_ids(self):
+        host = self.hosts[0]
+        index = host_scheduler.HostSchedulerIndex(self._database)
+        index.refresh()
+        # the row with the highest id is replaced by one reusing its id, as
+        # after the auto-increment counter was reset by a restart
+        row_id, host_id, label_id = self._database.execute(
+            'SELECT id, host_id, label_id FROM afe_hosts_labels '
+            'ORDER BY id DESC LIMIT 1')[0]
+        new_label = models.Label.objects.create(name='new label')
+        self._database.execute('DELETE FROM afe_hosts_labels WHERE id = %s',
+                               (row_id,))
+        self._database.execute(
+            'INSERT INTO afe_hosts_labels (id, host_id, label_id) '
+            'VALUES (%s, %s, %s)', (row_id, host.id, new_label.id))
+        index.refresh()
+        labels_to_hosts, _ = index.get_label_hosts([host.id])
+        self.assertEqual(set([host.id]), labels_to_hosts[new_label.id])
+        self.assertTrue(index.check_consistency())
+
+    def test_HostSchedulerIndex_check_consistency_rebuilds(self):
+        self.god.stub_function(mail.manager, 'enqueue_admin')
+        mail.manager.enqueue_admin.expect_call(mock.is_string_comparator(),
+                                               mock.is_string_comparator())
+        host = self.hosts[0]
+        index = host_scheduler.HostSchedulerIndex(self._database)
+        index.refresh()
+        index._host_labels = {}
+
+        self.assertFalse(index.check_consistency())
+        _, hosts_to_labels = index.get_label_hosts([host.id])
+        self.assertEqual(self._host_label_ids(host), hosts_to_labels[host.id])
+        self.god.check_playback()
+
+    def test_HostSchedulerIndex_caches_job_relations(self):
+        job = self._create_job(metahosts=[self.label1.id])
+        index = host_scheduler.HostSchedulerIndex(self._database)
+        fetched_job_ids = []
+
+        def fetch(job_ids):
+            fetched_job_ids.extend(job_ids)
+            return {job.id: set([self.label1.id])}
+
+        index.refresh()
+        for _ in range(2):
+            self.assertEqual({job.id: set([self.label1.id])},
+                             index.get_job_relation('job_dependencies',
+                                                    [job.id], fetch))
+        self.assertEqual([job.id], fetched_job_ids)
+
     def test_atomic_group_hosts_blocked_from_non_atomic_jobs(self):
         # Create a job scheduled to run on label6.
         self._create_job(metahosts=[self.label6.id])
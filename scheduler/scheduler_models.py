@@ -20,8 +20,10 @@ _grid_admin_email: Autotest grid administrator email (list of emails or mailing
 _base_url: URL to the local AFE server, used to construct URLs for emails.
 _db: DatabaseConnection for this module.
 _drone_manager: reference to global DroneManager instance.
+_unit_of_work: UnitOfWork collecting deferred DBObject field updates.
 """
 
+import collections
 import datetime
 import itertools
 import logging
@@ -99,6 +101,114 @@ def initialize_globals():
     _drone_manager = drone_manager.instance()
 
 
+class UnitOfWork(object):
+
+    """
+    Collects DBObject.update_field() calls made while it is active, so that
+    all the updates to one row are written with a single UPDATE.
+
+    Pending updates are flushed before any other query made through this
+    module, so DBObjects always read back what they wrote.  Queries made
+    through the Django models, or any other DatabaseConnection, only flush
+    them on a Django connection passed to flush_before_queries().
+    """
+
+    def __init__(self):
+        self.active = False
+        # maps (table, id) to an OrderedDict mapping field to new value
+        self._pending = collections.OrderedDict()
+
+    def begin(self):
+        self.active = True
+
+    def add(self, table, row_id, field, value):
+        key = (table, row_id)
+        self._pending.setdefault(key, collections.OrderedDict())[field] = value
+
+    def flush(self):
+        pending, self._pending = self._pending, collections.OrderedDict()
+        for (table, row_id), fields in pending.items():
+            assignments = ', '.join('%s = %%s' % field for field in fields)
+            query = 'UPDATE %s SET %s WHERE id = %%s' % (table, assignments)
+            _db.execute(query, tuple(fields.values()) + (row_id,))
+
+    def end(self):
+        try:
+            self.flush()
+        finally:
+            self.active = False
+
+
+_unit_of_work = UnitOfWork()
+
+
+def begin_deferred_updates():
+    """Defer DBObject field updates until flush_updates() is called."""
+    _unit_of_work.begin()
+
+
+def flush_updates():
+    """Write out any DBObject field updates deferred so far."""
+    _unit_of_work.flush()
+
+
+def end_deferred_updates():
+    """Flush deferred DBObject field updates and stop deferring them."""
+    _unit_of_work.end()
+
+
+class _FlushingCursor(object):
+
+    """Cursor proxy flushing the deferred updates before each query."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        flush_updates()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        flush_updates()
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._cursor.__exit__(exc_type, exc_value, traceback)
+
+
+def flush_before_queries(connection):
+    """
+    Flush the deferred updates before each query made on a Django
+    connection, so neither the models nor raw queries on it read or
+    overwrite rows with updates pending.  Only the cursors created
+    afterwards are wrapped, through make_debug_cursor(), forced on, which
+    only logs the queries if the connection did already (settings.DEBUG).
+    """
+    if connection.queries_logged:
+        make_cursor = connection.make_debug_cursor
+    else:
+        make_cursor = connection.make_cursor
+
+    def make_flushing_cursor(cursor):
+        return _FlushingCursor(make_cursor(cursor))
+    connection.make_debug_cursor = make_flushing_cursor
+    connection.force_debug_cursor = True
+
+
+def _execute(query, parameters=None):
+    flush_updates()
+    return _db.execute(query, parameters)
+
+
 class DelayedCallTask(object):
 
     """
@@ -230,7 +340,7 @@ class DBObject(object):
         """
         fields = ", ".join(self._fields)
         sql = 'SELECT %s FROM %s WHERE ID=%%s' % (fields, self.__table)
-        rows = _db.execute(sql, (row_id,))
+        rows = _execute(sql, (row_id,))
         if not rows:
             raise DBError("row not found (table=%s, row id=%s)"
                           % (self.__table, row_id))
@@ -291,7 +401,7 @@ class DBObject(object):
         if not table:
             table = self.__table
 
-        rows = _db.execute("""
+        rows = _execute("""
                 SELECT count(*) FROM %s
                 WHERE %s
         """ % (table, where))
@@ -306,8 +416,12 @@ class DBObject(object):
         if getattr(self, field) == value:
             return
 
-        query = "UPDATE %s SET %s = %%s WHERE id = %%s" % (self.__table, field)
-        _db.execute(query, (value, self.id))
+        if _unit_of_work.active:
+            _unit_of_work.add(self.__table, self.id, field, value)
+        else:
+            query = ("UPDATE %s SET %s = %%s WHERE id = %%s" %
+                     (self.__table, field))
+            _execute(query, (value, self.id))
 
         setattr(self, field, value)
 
@@ -325,16 +439,16 @@ class DBObject(object):
             values_str = ','.join(values)
             query = ('INSERT INTO %s (%s) VALUES (%s)' %
                      (self.__table, columns, values_str))
-            _db.execute(query)
+            _execute(query)
             # Update our id to the one the database just assigned to us.
-            self.id = _db.execute('SELECT LAST_INSERT_ID()')[0][0]
+            self.id = _execute('SELECT LAST_INSERT_ID()')[0][0]
 
     def delete(self):
         self._instances_by_type_and_id.pop((type(self), id), None)
         self._initialized = False
         self._valid_fields.clear()
         query = 'DELETE FROM %s WHERE id=%%s' % self.__table
-        _db.execute(query, (self.id,))
+        _execute(query, (self.id,))
 
     @staticmethod
     def _prefix_with(string, prefix):
@@ -343,12 +457,7 @@ class DBObject(object):
         return string
 
     @classmethod
-    def fetch(cls, where='', params=(), joins='', order_by=''):
-        """
-        Construct instances of our class based on the given database query.
-
-        @yields One class instance for each row fetched.
-        """
+    def _fetch_rows(cls, where='', params=(), joins='', order_by=''):
         order_by = cls._prefix_with(order_by, 'ORDER BY ')
         where = cls._prefix_with(where, 'WHERE ')
         # construct field names table.field for all fields in a class
@@ -359,9 +468,38 @@ class DBObject(object):
                                              'joins': joins,
                                              'where': where,
                                              'order_by': order_by})
-        rows = _db.execute(query, params)
+        return _execute(query, params)
+
+    @classmethod
+    def fetch(cls, where='', params=(), joins='', order_by=''):
+        """
+        Construct instances of our class based on the given database query.
+
+        @yields One class instance for each row fetched.
+        """
+        rows = cls._fetch_rows(where, params, joins, order_by)
         return [cls(id=row[0], row=row) for row in rows]
 
+    _FETCH_MANY_CHUNK_SIZE = 1000
+
+    @classmethod
+    def fetch_many(cls, ids):
+        """
+        Construct instances of our class for the given ids, querying the
+        database once per _FETCH_MANY_CHUNK_SIZE ids instead of once per id.
+
+        :param ids: An iterable of ids; ids without a row are skipped.
+        :return: A list of class instances, in no particular order.
+        """
+        ids = sorted(set(ids))
+        instances = []
+        for start in range(0, len(ids), cls._FETCH_MANY_CHUNK_SIZE):
+            chunk = ids[start:start + cls._FETCH_MANY_CHUNK_SIZE]
+            where = '%s.id IN (%s)' % (cls._table_name,
+                                       ','.join(['%s'] * len(chunk)))
+            instances.extend(cls.fetch(where=where, params=chunk))
+        return instances
+
 
 class IneligibleHostQueue(DBObject):
     _table_name = 'afe_ineligible_host_queues'
@@ -406,7 +544,7 @@ class Host(DBObject):
         """
         Returns a tuple (platform_name, list_of_all_label_names).
         """
-        rows = _db.execute("""
+        rows = _execute("""
                 SELECT afe_labels.name, afe_labels.platform
                 FROM afe_labels
                 INNER JOIN afe_hosts_labels ON
@@ -467,13 +605,21 @@ class HostQueueEntry(DBObject):
                'active', 'complete', 'deleted', 'execution_subdir',
                'atomic_group_id', 'aborted', 'started_on')
 
-    def __init__(self, id=None, row=None, **kwargs):
+    def __init__(self, id=None, row=None, related_loaded=False, **kwargs):
+        """
+        :param related_loaded: True when the job and host of this entry have
+                just been loaded (see fetch()), so they need not be queried
+                again.
+        """
         assert id or row
         super(HostQueueEntry, self).__init__(id=id, row=row, **kwargs)
-        self.job = Job(self.job_id)
+        related_kwargs = {}
+        if related_loaded:
+            related_kwargs['always_query'] = False
+        self.job = Job(self.job_id, **related_kwargs)
 
         if self.host_id:
-            self.host = Host(self.host_id)
+            self.host = Host(self.host_id, **related_kwargs)
         else:
             self.host = None
 
@@ -486,6 +632,24 @@ class HostQueueEntry(DBObject):
         self.queue_log_path = os.path.join(self.job.tag(),
                                            'queue.log.' + str(self.id))
 
+    @classmethod
+    def fetch(cls, where='', params=(), joins='', order_by=''):
+        """
+        Like DBObject.fetch(), but loads the jobs and hosts of all the
+        entries with one query each instead of one query per entry.
+        """
+        rows = cls._fetch_rows(where, params, joins, order_by)
+        job_index = cls._fields.index('job_id')
+        host_index = cls._fields.index('host_id')
+        # keep references so the instance cache holds on to them
+        jobs = Job.fetch_many(row[job_index] for row in rows)
+        hosts = Host.fetch_many(row[host_index] for row in rows
+                                if row[host_index])
+        entries = [cls(id=row[0], row=row, related_loaded=True)
+                   for row in rows]
+        del jobs, hosts
+        return entries
+
     @classmethod
     def clone(cls, template):
         """
@@ -760,7 +924,7 @@ class HostQueueEntry(DBObject):
         """ Fetch info about who aborted the job. """
         if hasattr(self, "_aborted_by"):
             return
-        rows = _db.execute("""
+        rows = _execute("""
                 SELECT afe_users.login,
                         afe_aborted_host_queue_entries.aborted_on
                 FROM afe_aborted_host_queue_entries
@@ -889,7 +1053,7 @@ class Job(DBObject):
         return "%s-%s" % (self.id, self.owner)
 
     def get_host_queue_entries(self):
-        rows = _db.execute("""
+        rows = _execute("""
                 SELECT * FROM afe_host_queue_entries
                 WHERE job_id= %s
         """, (self.id,))
@@ -987,7 +1151,7 @@ class Job(DBObject):
 
         stats = {}
 
-        rows = _db.execute("""
+        rows = _execute("""
                 SELECT t.test, s.word, t.reason
                 FROM tko_tests AS t, tko_jobs AS j, tko_status AS s
                 WHERE t.job_idx = j.job_idx
@@ -1023,7 +1187,7 @@ class Job(DBObject):
         stats['skip_detail'] = _format_rows(skipped_rows)
         stats['pass_detail'] = _format_rows(passed_rows)
 
-        time_row = _db.execute("""
+        time_row = _execute("""
                    SELECT started_time, finished_time
                    FROM tko_jobs
                    WHERE afe_job_id = %s
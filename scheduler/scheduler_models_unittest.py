@@ -2,10 +2,12 @@
 
 import datetime
 import unittest
+
 try:
     import autotest.common as common  # pylint: disable=W0611
 except ImportError:
     from . import common  # pylint: disable=W0611
+import django.db
 from autotest.frontend import setup_django_environment  # pylint: disable=W0611
 from autotest.frontend import test_utils
 from autotest.client.shared.test_utils import mock
@@ -142,6 +144,68 @@ class DBObjectTest(BaseSchedulerModelsTest):
         host = self.assertRaises(scheduler_models.DBError, scheduler_models.Host, id=3,
                                  always_query=True)
 
+    def test_fetch_many(self):
+        hosts = scheduler_models.Host.fetch_many([3, 1, 1, 999])
+        self.assertEqual(['host1', 'host3'],
+                         sorted(host.hostname for host in hosts))
+        self.assertEqual([], scheduler_models.Host.fetch_many([]))
+
+    def test_fetch_many_chunks(self):
+        self.god.stub_with(scheduler_models.DBObject, '_FETCH_MANY_CHUNK_SIZE',
+                           2)
+        hosts = scheduler_models.Host.fetch_many([1, 2, 3])
+        self.assertEqual([1, 2, 3], sorted(host.id for host in hosts))
+
+    def test_deferred_updates_are_coalesced(self):
+        host = scheduler_models.Host(id=2)
+        queries = []
+        real_execute = self._database.execute
+
+        def execute(query, parameters=None):
+            queries.append(query)
+            return real_execute(query, parameters)
+        self.god.stub_with(self._database, 'execute', execute)
+
+        scheduler_models.begin_deferred_updates()
+        try:
+            host.update_field('status', 'Running')
+            host.update_field('dirty', True)
+            host.update_field('status', 'Ready')
+            self.assertEqual([], queries)
+        finally:
+            scheduler_models.end_deferred_updates()
+        self.assertEqual(1, len(queries))
+
+        self.god.unstub(self._database, 'execute')
+        host.update_from_database()
+        self.assertEqual('Ready', host.status)
+        self.assertTrue(host.dirty)
+
+    def test_deferred_updates_flushed_before_queries(self):
+        host = scheduler_models.Host(id=2)
+        scheduler_models.begin_deferred_updates()
+        try:
+            host.update_field('status', 'Running')
+            hosts = scheduler_models.Host.fetch(where="status = 'Running'")
+            self.assertEqual([2], [fetched.id for fetched in hosts])
+        finally:
+            scheduler_models.end_deferred_updates()
+
+    def test_deferred_updates_flushed_before_django_queries(self):
+        connection = django.db.connection
+        self.god.stub_with(connection, 'make_debug_cursor',
+                           connection.make_debug_cursor)
+        self.god.stub_with(connection, 'force_debug_cursor',
+                           connection.force_debug_cursor)
+        scheduler_models.flush_before_queries(connection)
+        host = scheduler_models.Host(id=2)
+        scheduler_models.begin_deferred_updates()
+        try:
+            host.update_field('status', 'Running')
+            self.assertEqual('Running', models.Host.objects.get(id=2).status)
+        finally:
+            scheduler_models.end_deferred_updates()
+
     def test_save(self):
         # Dummy Job to avoid creating a one in the HostQueueEntry __init__.
         class MockJob(object):
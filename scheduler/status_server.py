@@ -1,6 +1,7 @@
 import http.server
 import cgi
 import fcntl
+import json
 import logging
 import threading
 import urllib.request, urllib.parse, urllib.error
@@ -10,9 +11,13 @@ try:
 except ImportError:
     from . import common  # pylint: disable=W0611
 from autotest.scheduler import drone_manager, scheduler_config
+from autotest.scheduler import tick_profiler
 
 _PORT = 13467
 
+# machine readable per-phase statistics of the scheduler tick
+_TICK_PROFILE_PATH = '/tick_profile'
+
 _HEADER = """
 <html>
 <head><title>Scheduler status</title></head>
@@ -20,6 +25,7 @@ _HEADER = """
 Actions:<br>
 <a href="?reparse_config=1">Reparse global config values</a><br>
 <a href="?restart_scheduler=1">Restart the scheduler</a><br>
+<a href="/tick_profile">Tick profile (JSON)</a><br>
 <br>
 """
 
@@ -84,7 +90,19 @@ class StatusServerRequestHandler(http.server.BaseHTTPRequestHandler):
             self._write_line('Posted the shutdown request')
         self._write_line()
 
+    def _write_tick_profile(self):
+        body = json.dumps(self.server._tick_profiler.summary(), indent=2,
+                          sort_keys=True)
+        self.send_response(200, 'OK')
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode())
+
     def do_GET(self):
+        if self.path.split('?', 1)[0] == _TICK_PROFILE_PATH:
+            self._write_tick_profile()
+            return
+
         self._send_headers()
         self.wfile.write(_HEADER)
 
@@ -105,6 +123,7 @@ class StatusServer(http.server.HTTPServer):
                                            StatusServerRequestHandler)
         self._shutting_down = False
         self._drone_manager = drone_manager.instance()
+        self._tick_profiler = tick_profiler.instance()
         self._shutdown_scheduler = False
 
         # ensure the listening socket is not inherited by child processes
@@ -0,0 +1,195 @@
+"""
+Per-phase instrumentation of the scheduler tick.
+
+Each phase of Dispatcher.tick() is timed and the number of database queries
+and rows it caused is recorded. The last samples of every phase are kept in a
+rolling window so percentiles can be reported by the status server.
+"""
+
+import collections
+import contextlib
+import threading
+import time
+
+# percentiles reported for every measure
+PERCENTILES = (50, 90, 99)
+
+_MEASURES = ('wall_sec', 'queries', 'rows')
+
+
+def _percentile(sorted_values, percent):
+    """Nearest rank percentile of a non empty sorted list."""
+    rank = int(round(percent / 100.0 * len(sorted_values) + 0.5)) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+
+def _summarize(values):
+    sorted_values = sorted(values)
+    summary = dict(('p%d' % percent, _percentile(sorted_values, percent))
+                   for percent in PERCENTILES)
+    summary['max'] = sorted_values[-1]
+    summary['mean'] = sum(sorted_values) / float(len(sorted_values))
+    summary['last'] = values[-1]
+    return summary
+
+
+class _QueryCountingCursor(object):
+
+    """Cursor proxy counting the queries executed through it."""
+
+    def __init__(self, cursor, profiler):
+        self._cursor = cursor
+        self._profiler = profiler
+
+    def execute(self, *args, **kwargs):
+        self._profiler._django_queries += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._profiler._django_queries += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._cursor.__exit__(exc_type, exc_value, traceback)
+
+
+class TickProfiler(object):
+
+    """
+    Rolling per-phase statistics of the scheduler tick.
+
+    Phases are recorded with the phase() context manager, they may nest (the
+    whole tick is itself a phase). Statistics are read from the status server
+    thread through summary().
+
+    Queries are counted on the cursors of the Django connection when one is
+    set, it covers both the ORM and the DatabaseConnections using the django
+    backend. Otherwise, and for rows in any case, the query_count and
+    row_count of the registered DatabaseConnections are used.
+    """
+
+    def __init__(self, window=0):
+        self._lock = threading.Lock()
+        self._connections = []
+        self._django_connection = None
+        # never reset, unlike the query log of the connection
+        self._django_queries = 0
+        self._samples = collections.OrderedDict()
+        self._tick_count = 0
+        self.configure(window)
+
+    def configure(self, window):
+        """
+        :param window: Number of samples kept per phase, 0 disables profiling.
+        """
+        with self._lock:
+            self.window = window
+            self._samples.clear()
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def add_connection(self, connection):
+        """Count the queries and rows of a DatabaseConnection."""
+        if connection not in self._connections:
+            self._connections.append(connection)
+
+    def set_django_connection(self, connection):
+        """
+        Count the queries of a Django connection. Its cursors are wrapped
+        through make_debug_cursor(), forced on, which only logs the queries
+        if the connection did already (settings.DEBUG).
+        """
+        if connection.queries_logged:
+            make_cursor = connection.make_debug_cursor
+        else:
+            make_cursor = connection.make_cursor
+
+        def make_counting_cursor(cursor):
+            return _QueryCountingCursor(make_cursor(cursor), self)
+        connection.make_debug_cursor = make_counting_cursor
+        connection.force_debug_cursor = True
+        self._django_connection = connection
+
+    def _counters(self):
+        rows = sum(connection.row_count for connection in self._connections)
+        if self._django_connection is not None:
+            queries = self._django_queries
+        else:
+            queries = sum(connection.query_count
+                          for connection in self._connections)
+        return queries, rows
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start_queries, start_rows = self._counters()
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            wall_sec = time.time() - start_time
+            end_queries, end_rows = self._counters()
+            self.record(name, wall_sec, end_queries - start_queries,
+                        end_rows - start_rows)
+
+    def record(self, name, wall_sec, queries, rows):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = collections.deque(maxlen=self.window)
+                self._samples[name] = samples
+            samples.append((wall_sec, queries, rows))
+
+    def tick_done(self):
+        with self._lock:
+            self._tick_count += 1
+
+    def summary(self):
+        """
+        :return: A dict, ready to be serialized as JSON, with the number of
+                samples and the percentiles, max, mean and last value of each
+                measure for every phase, in the order phases were first seen.
+        """
+        with self._lock:
+            samples = [(name, list(phase_samples))
+                       for name, phase_samples in self._samples.items()]
+            summary = {'enabled': self.enabled,
+                       'window': self.window,
+                       'ticks': self._tick_count,
+                       'phase_order': [name for name, _ in samples],
+                       'phases': {}}
+
+        for name, phase_samples in samples:
+            phase_summary = {'samples': len(phase_samples)}
+            for index, measure in enumerate(_MEASURES):
+                phase_summary[measure] = _summarize(
+                    [sample[index] for sample in phase_samples])
+            summary['phases'][name] = phase_summary
+        return summary
+
+
+_the_instance = None
+
+
+def instance():
+    if _the_instance is None:
+        _set_instance(TickProfiler())
+    return _the_instance
+
+
+def _set_instance(instance):  # usable for testing
+    global _the_instance
+    _the_instance = instance
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+import unittest
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    from . import common  # pylint: disable=W0611
+from autotest.scheduler import tick_profiler
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.query_count = 0
+        self.row_count = 0
+
+    def execute(self, rows):
+        self.query_count += 1
+        self.row_count += rows
+
+
+class FakeCursor(object):
+
+    def execute(self, sql):
+        pass
+
+
+class FakeDjangoConnection(object):
+
+    def __init__(self):
+        self.force_debug_cursor = False
+        self.queries_log = []
+
+    @property
+    def queries_logged(self):
+        return self.force_debug_cursor
+
+    def make_cursor(self, cursor):
+        return cursor
+
+    def make_debug_cursor(self, cursor):
+        self.queries_log.append('logged')
+        return cursor
+
+    def cursor(self):
+        if self.queries_logged:
+            return self.make_debug_cursor(FakeCursor())
+        return self.make_cursor(FakeCursor())
+
+
+class TickProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = tick_profiler.TickProfiler(window=3)
+        self.connection = FakeConnection()
+        self.profiler.add_connection(self.connection)
+
+    def test_disabled(self):
+        profiler = tick_profiler.TickProfiler()
+        with profiler.phase('tick'):
+            pass
+        summary = profiler.summary()
+        self.assertFalse(summary['enabled'])
+        self.assertEqual({}, summary['phases'])
+
+    def test_counts_queries_and_rows(self):
+        with self.profiler.phase('tick'):
+            with self.profiler.phase('first'):
+                self.connection.execute(5)
+            with self.profiler.phase('second'):
+                self.connection.execute(0)
+                self.connection.execute(2)
+        self.profiler.tick_done()
+
+        summary = self.profiler.summary()
+        self.assertEqual(1, summary['ticks'])
+        self.assertEqual(['first', 'second', 'tick'], summary['phase_order'])
+        phases = summary['phases']
+        self.assertEqual(1, phases['first']['queries']['last'])
+        self.assertEqual(5, phases['first']['rows']['last'])
+        self.assertEqual(2, phases['second']['queries']['last'])
+        self.assertEqual(3, phases['tick']['queries']['last'])
+        self.assertEqual(7, phases['tick']['rows']['last'])
+
+    def test_django_queries(self):
+        django_connection = FakeDjangoConnection()
+        self.profiler.set_django_connection(django_connection)
+        with self.profiler.phase('tick'):
+            with self.profiler.phase('orm'):
+                cursor = django_connection.cursor()
+                cursor.execute('q1')
+                cursor.execute('q2')
+                self.connection.execute(4)
+            # what django.db.reset_queries() does
+            django_connection.queries_log = []
+            django_connection.cursor().execute('q3')
+        phases = self.profiler.summary()['phases']
+        self.assertEqual(2, phases['orm']['queries']['last'])
+        self.assertEqual(4, phases['orm']['rows']['last'])
+        self.assertEqual(3, phases['tick']['queries']['last'])
+        # queries are only logged if they were before
+        self.assertEqual([], django_connection.queries_log)
+
+    def test_rolling_percentiles(self):
+        for rows in (10, 1, 3, 2):
+            self.profiler.record('phase', rows / 10.0, 1, rows)
+        phase = self.profiler.summary()['phases']['phase']
+        # only the last 3 samples are kept
+        self.assertEqual(3, phase['samples'])
+        self.assertEqual(2, phase['rows']['p50'])
+        self.assertEqual(3, phase['rows']['p99'])
+        self.assertEqual(3, phase['rows']['max'])
+        self.assertEqual(2, phase['rows']['last'])
+        self.assertEqual(2.0, phase['rows']['mean'])
+
+    def test_records_failing_phase(self):
+        def fail():
+            with self.profiler.phase('failing'):
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(1, self.profiler.summary()['phases']['failing'][
+            'samples'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,16 @@
 # Copyright 2007 Google Inc. Released under the GPL v2
 
+import concurrent.futures
 import glob
+import hashlib
+import json
 import logging
 import os
 import re
 import sys
+import tarfile
 import tempfile
+import threading
 import time
 import traceback
 
@@ -61,6 +66,77 @@ UNINSTALL_CLIENT_CMD_MAPPING = {'Fedora': _yum_uninstall_cmd,
                                 'RHEL': _yum_uninstall_cmd}
 
 
+# manifest of the client files installed on a host, relative to its autodir
+INSTALL_MANIFEST = '.autotest_install_manifest'
+
+# directories of the client that are not sent when autoserv serves packages,
+# they are fetched as packages by the client when needed
+LIGHT_INSTALL_EXCLUDED_DIRS = ("tests", "site_tests", "deps", "profilers")
+
+# install manifests of local client trees, by (path, light install)
+_install_manifests = {}
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fileobj:
+        for block in iter(lambda: fileobj.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _get_install_manifest(source_dir, light):
+    """
+    Describe the client files installed from source_dir.
+
+    :param source_dir: The local client directory.
+    :param light: If True, describe what _install_using_send_file installs,
+            which are also the files of the client package installed from
+            the repositories, otherwise a copy of the whole directory.
+
+    :return: A dict with the sha1 of each installed file by its path relative
+            to the autodir ('files'), the local path of each of them
+            ('sources') and a digest of the whole install ('digest').
+    """
+    key = (source_dir, light)
+    if key in _install_manifests:
+        return _install_manifests[key]
+
+    sources = {}
+    for dirpath, dirnames, filenames in os.walk(source_dir, followlinks=True):
+        reldir = os.path.relpath(dirpath, source_dir)
+        if reldir == '.':
+            reldir = ''
+            if light:
+                dirnames[:] = [name for name in dirnames
+                               if name not in LIGHT_INSTALL_EXCLUDED_DIRS]
+        # compiled files are regenerated by the client
+        dirnames[:] = [name for name in dirnames if name != '__pycache__']
+        for filename in filenames:
+            if filename.endswith('.pyc'):
+                continue
+            path = os.path.join(dirpath, filename)
+            if os.path.isfile(path):
+                sources[os.path.join(reldir, filename)] = path
+    if light:
+        sources['profilers/__init__.py'] = os.path.join(
+            source_dir, 'profilers', '__init__.py')
+        grubby_glob = os.path.join(source_dir, "deps/grubby/grubby-*.tar.bz2")
+        for grubby_tarball_path in glob.glob(grubby_glob)[:1]:
+            sources[os.path.basename(grubby_tarball_path)] = (
+                grubby_tarball_path)
+
+    files = dict((relpath, _file_digest(path))
+                 for relpath, path in sources.items())
+    digest = hashlib.sha1()
+    for relpath in sorted(files):
+        digest.update(('%s %s\n' % (files[relpath], relpath)).encode())
+    manifest = {'digest': digest.hexdigest(), 'light': light,
+                'files': files, 'sources': sources}
+    _install_manifests[key] = manifest
+    return manifest
+
+
 class BaseAutotest(installable_object.InstallableObject):
 
     """
@@ -207,8 +283,169 @@ class BaseAutotest(installable_object.InstallableObject):
         logging.info("Installation of autotest completed")
         self.installed = True
 
+    def _read_install_manifest(self, host, autodir):
+        """
+        :return: The install manifest written on host by a previous install,
+                or None.
+        """
+        path = os.path.join(autodir, INSTALL_MANIFEST)
+        result = host.run('cat %s' % utils.sh_escape(path),
+                          ignore_status=True)
+        if result.exit_status != 0:
+            return None
+        try:
+            return json.loads(result.stdout)
+        except ValueError:
+            logging.debug('Ignoring invalid install manifest on %s',
+                          host.hostname)
+            return None
+
+    def _write_install_manifest(self, host, autodir, manifest):
+        fd, local_path = tempfile.mkstemp(prefix='install_manifest')
+        try:
+            with os.fdopen(fd, 'w') as manifest_file:
+                json.dump({'digest': manifest['digest'],
+                           'light': manifest['light'],
+                           'files': manifest['files']}, manifest_file)
+            host.send_file(local_path, os.path.join(autodir,
+                                                    INSTALL_MANIFEST))
+        finally:
+            os.remove(local_path)
+
+    def _read_host_files(self, host, autodir):
+        """
+        :return: The sha1 of every file in the autodir of host, by path
+                relative to it, except for the packages directory, compiled
+                python files and the install manifest. None if some file
+                couldn't be read.
+        """
+        result = host.run(
+            "cd %s && find . -path ./packages -prune -o -name __pycache__ "
+            "-prune -o -type f ! -name '*.pyc' ! -name %s -print0 | "
+            "xargs -0 -r sha1sum" % (utils.sh_escape(autodir),
+                                     INSTALL_MANIFEST), ignore_status=True)
+        if result.exit_status != 0:
+            logging.info('Could not check the autotest client files on %s: '
+                         '%s', host.hostname, result.stderr.strip())
+            return None
+        host_files = {}
+        for line in result.stdout.splitlines():
+            digest, path = line.split('  ', 1)
+            if path.startswith('./'):
+                path = path[2:]
+            host_files[path] = digest
+        return host_files
+
+    def _update_install(self, host, autodir, manifest, changed, removed):
+        """
+        Bring the install on host up to date with manifest, sending the
+        changed files in a tarball and removing the files it doesn't list.
+        """
+        logging.info('Updating autotest client on %s: %d file(s) changed, '
+                     '%d removed', host.hostname, len(changed), len(removed))
+
+        # invalidate the manifest until the update completes
+        host.run('rm -f %s' % utils.sh_escape(os.path.join(autodir,
+                                                           INSTALL_MANIFEST)))
+        if removed:
+            # left by earlier jobs: built tests, fetched packages, state...
+            host.run("cd %s && xargs -0 -r rm -f && find . -mindepth 1 "
+                     "-depth -type d -empty ! -path ./packages "
+                     "! -path './packages/*' -delete" %
+                     utils.sh_escape(autodir), stdin='\0'.join(removed))
+        if changed:
+            fd, tarball_path = tempfile.mkstemp(suffix='.tar.gz')
+            os.close(fd)
+            try:
+                tarball = tarfile.open(tarball_path, 'w:gz', dereference=True)
+                try:
+                    for relpath in changed:
+                        tarball.add(manifest['sources'][relpath],
+                                    arcname=relpath)
+                finally:
+                    tarball.close()
+                remote_tarball = os.path.join(autodir, '.install_update.tar.gz')
+                host.send_file(tarball_path, remote_tarball)
+                host.run('tar -xzf %s -C %s && rm -f %s' % (
+                    utils.sh_escape(remote_tarball), utils.sh_escape(autodir),
+                    utils.sh_escape(remote_tarball)))
+            finally:
+                os.remove(tarball_path)
+        if manifest['light']:
+            self._create_excluded_dirs(
+                host, autodir, [path for path in LIGHT_INSTALL_EXCLUDED_DIRS
+                                if path != 'profilers'])
+
+    def _is_light_install(self, use_autoserv, use_packaging):
+        """
+        :return: True if the client installed on hosts leaves out the tests,
+                deps and profilers, that the client then fetches as
+                packages: from autoserv, or from the repositories the client
+                package itself is installed from.
+        """
+        if use_autoserv and settings.get_value(
+                'PACKAGES', 'serve_packages_from_autoserv', type=bool):
+            return True
+        return bool(use_packaging and self.get_fetch_location())
+
+    def _install_from_cache(self, host, autodir, use_autoserv,
+                            use_packaging):
+        """
+        Use the client already installed on host if it was installed in the
+        same mode, after checking its files: the ones that differ from the
+        local client are sent again, and the ones the local client doesn't
+        have are removed. A client installed from the repositories is
+        checked against the local client too, it is built from it.
+
+        :return: A tuple (manifest, installed): the install manifest of the
+                local client, None if the cache is disabled, and whether it
+                is now installed on host. If not, host needs a full install.
+        """
+        if not (self.source_material and os.path.isdir(self.source_material)):
+            return None, False
+        if not settings.get_value('AUTOSERV', 'client_install_cache',
+                                  type=bool, default=True):
+            return None, False
+        light = self._is_light_install(use_autoserv, use_packaging)
+        manifest = _get_install_manifest(self.source_material, light)
+        host_manifest = self._read_install_manifest(host, autodir)
+        if host_manifest is None or host_manifest.get('light') != light:
+            return manifest, False
+
+        host_files = self._read_host_files(host, autodir)
+        if host_files is None:
+            return manifest, False
+        expected_files = set(manifest['files'])
+        if light:
+            # created empty by _create_excluded_dirs()
+            expected_files.update(os.path.join(path, '__init__.py')
+                                  for path in LIGHT_INSTALL_EXCLUDED_DIRS)
+        changed = [relpath for relpath, digest in manifest['files'].items()
+                   if host_files.get(relpath) != digest]
+        removed = [relpath for relpath in host_files
+                   if relpath not in expected_files]
+        if (changed or removed or
+                host_manifest.get('digest') != manifest['digest']):
+            self._update_install(host, autodir, manifest, changed, removed)
+            self._write_install_manifest(host, autodir, manifest)
+        else:
+            logging.info('Autotest client on %s is up to date (%s), '
+                         'skipping installation', host.hostname,
+                         manifest['digest'])
+        return manifest, True
+
+    def _create_excluded_dirs(self, host, autodir, dirs_to_exclude):
+        """Create empty dirs for the stuff a light install excludes."""
+        commands = []
+        for path in dirs_to_exclude:
+            abs_path = os.path.join(autodir, path)
+            abs_path = utils.sh_escape(abs_path)
+            commands.append("mkdir -p '%s'" % abs_path)
+            commands.append("touch '%s'/__init__.py" % abs_path)
+        host.run(';'.join(commands))
+
     def _install_using_send_file(self, host, autodir):
-        dirs_to_exclude = set(["tests", "site_tests", "deps", "profilers"])
+        dirs_to_exclude = set(LIGHT_INSTALL_EXCLUDED_DIRS)
         light_files = [os.path.join(self.source_material, f)
                        for f in os.listdir(self.source_material)
                        if f not in dirs_to_exclude]
@@ -232,13 +469,7 @@ class BaseAutotest(installable_object.InstallableObject):
         dirs_to_exclude.discard("profilers")
 
         # create empty dirs for all the stuff we excluded
-        commands = []
-        for path in dirs_to_exclude:
-            abs_path = os.path.join(autodir, path)
-            abs_path = utils.sh_escape(abs_path)
-            commands.append("mkdir -p '%s'" % abs_path)
-            commands.append("touch '%s'/__init__.py" % abs_path)
-        host.run(';'.join(commands))
+        self._create_excluded_dirs(host, autodir, dirs_to_exclude)
 
     def _install(self, host=None, autodir=None, use_autoserv=True,
                  use_packaging=True):
@@ -298,10 +529,21 @@ class BaseAutotest(installable_object.InstallableObject):
         host.run('rm -rf %s/*' % utils.sh_escape(results_path),
                  ignore_status=True)
 
+        # Reuse or update a client installed from the same source
+        manifest, installed = self._install_from_cache(host, autodir,
+                                                       use_autoserv,
+                                                       use_packaging)
+        if installed:
+            self._create_test_output_dir(host, autodir)
+            self.installed = True
+            return
+
         # Fetch the autotest client from the nearest repository
         if use_packaging:
             try:
                 self._install_using_packaging(host, autodir)
+                if manifest:
+                    self._write_install_manifest(host, autodir, manifest)
                 self._create_test_output_dir(host, autodir)
                 logging.info("Installation of autotest completed")
                 self.installed = True
@@ -321,6 +563,8 @@ class BaseAutotest(installable_object.InstallableObject):
                 self._install_using_send_file(host, autodir)
             else:
                 host.send_file(self.source_material, autodir, delete_dest=True)
+            if manifest:
+                self._write_install_manifest(host, autodir, manifest)
             self._create_test_output_dir(host, autodir)
             logging.info("Installation of autotest completed")
             self.installed = True
@@ -862,6 +1106,7 @@ class _BaseRun(object):
             self.host.job.add_client_log(hostname, remote_results,
                                          local_results)
             job_record_context = self.host.job.get_record_context()
+            collector.start_background_collection()
 
         section = 0
         start_time = time.time()
@@ -902,6 +1147,7 @@ class _BaseRun(object):
         finally:
             logger.close()
             if not self.background:
+                collector.stop_background_collection()
                 collector.collect_client_job_results()
                 collector.remove_redundant_client_logs()
                 state_file = os.path.basename(self.remote_control_state)
@@ -931,6 +1177,18 @@ class log_collector(object):
                                                "results", client_tag)
 
         self.server_results_dir = results_dir
+        # number of rsync transfers the results are split into
+        self.streams = settings.get_value("AUTOSERV",
+                                          "client_results_streams",
+                                          type=int, default=1)
+        # seconds between collections while the client runs, 0 to only
+        # collect after each test and at the end
+        self.collect_interval = settings.get_value(
+            "AUTOSERV", "client_results_collect_interval", type=int,
+            default=0)
+        self._collect_lock = threading.Lock()
+        self._background = None
+        self._stop_background = threading.Event()
         logging.debug("Log collector initialized")
         logging.debug("Client results dir: %s", self.client_results_dir)
         logging.debug("Server results dir: %s", self.server_results_dir)
@@ -951,14 +1209,98 @@ class log_collector(object):
 
         # Copy all dirs in default to results_dir
         try:
-            self.host.get_file(self.client_results_dir + "/",
-                               self.server_results_dir, preserve_symlinks=True)
+            self._collect()
         except Exception:
             # well, don't stop running just because we couldn't get logs
             e_msg = "Unexpected error copying test result logs, continuing ..."
             logging.error(e_msg)
             traceback.print_exc(file=sys.stdout)
 
+    def _collect(self):
+        """
+        Get the client results dir. rsync only transfers what changed since
+        the previous collection, and resumes files whose transfer was
+        interrupted. Large results are split across self.streams parallel
+        transfers.
+        """
+        with self._collect_lock:
+            if self.streams > 1 and self.host.use_rsync():
+                groups = self._split_results(self.streams)
+            else:
+                groups = []
+            if len(groups) < 2:
+                self.host.get_file(self.client_results_dir + "/",
+                                   self.server_results_dir,
+                                   preserve_symlinks=True, resume=True)
+                return
+
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(groups)) as executor:
+                transfers = [executor.submit(
+                    self.host.get_file,
+                    [os.path.join(self.client_results_dir, name)
+                     for name in names],
+                    self.server_results_dir, preserve_symlinks=True,
+                    resume=True)
+                    for names in groups]
+            for transfer in transfers:
+                transfer.result()
+
+    def _split_results(self, streams):
+        """
+        Split the entries of the client results dir in at most streams
+        groups of about the same size.
+
+        :return: A list of lists of entry names, empty if the results dir
+                could not be listed.
+        """
+        result = self.host.run("cd %s && du -sk -- * .[!.]* 2>/dev/null" %
+                               utils.sh_escape(self.client_results_dir),
+                               ignore_status=True)
+        entries = []
+        for line in result.stdout.splitlines():
+            size, _, name = line.partition("\t")
+            if name:
+                entries.append((int(size), name))
+
+        groups = [[0, []] for _ in range(min(streams, len(entries)))]
+        # largest first, each into the smallest group so far
+        for size, name in sorted(entries, reverse=True):
+            group = min(groups, key=lambda group: group[0])
+            group[0] += size
+            group[1].append(name)
+        return [names for _, names in groups]
+
+    def start_background_collection(self):
+        """
+        Collect the results every collect_interval seconds while the client
+        runs, so that only the latest results are left to collect at the end.
+        """
+        if not self.collect_interval or self._background is not None:
+            return
+        self._stop_background.clear()
+        self._background = threading.Thread(
+            target=self._collect_periodically,
+            name="log_collector-%s" % self.host.hostname)
+        self._background.daemon = True
+        self._background.start()
+
+    def stop_background_collection(self):
+        if self._background is None:
+            return
+        self._stop_background.set()
+        self._background.join()
+        self._background = None
+
+    def _collect_periodically(self):
+        while not self._stop_background.wait(self.collect_interval):
+            try:
+                self._collect()
+            except Exception:
+                # the client may be rebooting, the next collection retries
+                logging.debug("Background collection of client results "
+                              "failed", exc_info=True)
+
     def remove_redundant_client_logs(self):
         """Remove client.*.log files in favour of client.*.DEBUG files."""
         debug_dir = os.path.join(self.server_results_dir, 'debug')
@@ -4,6 +4,7 @@ __author__ = "raphtee@google.com (Travis Miller)"
 
 import logging
 import os
+import shutil
 import tempfile
 import unittest
 
@@ -335,6 +336,243 @@ class TestBaseAutotest(unittest.TestCase):
                              '/autotest/dest/:/autotest/fifo3')
 
 
+class test_install_manifest(unittest.TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp(suffix='unittest')
+        for path in ('a', 'sub/b', 'tests/t', 'profilers/__init__.py',
+                     'profilers/p', '__pycache__/a.pyc'):
+            path = os.path.join(self.source_dir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').write(path)
+        autotest_remote._install_manifests.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir, ignore_errors=True)
+        autotest_remote._install_manifests.clear()
+
+    def test_full_install(self):
+        manifest = autotest_remote._get_install_manifest(self.source_dir,
+                                                         False)
+        self.assertEqual(['a', 'profilers/__init__.py', 'profilers/p',
+                          'sub/b', 'tests/t'], sorted(manifest['files']))
+
+    def test_light_install(self):
+        manifest = autotest_remote._get_install_manifest(self.source_dir,
+                                                         True)
+        self.assertEqual(['a', 'profilers/__init__.py', 'sub/b'],
+                         sorted(manifest['files']))
+
+    def test_digest_follows_content(self):
+        digest = autotest_remote._get_install_manifest(self.source_dir,
+                                                       False)['digest']
+        open(os.path.join(self.source_dir, 'a'), 'w').write('changed')
+        autotest_remote._install_manifests.clear()
+        manifest = autotest_remote._get_install_manifest(self.source_dir,
+                                                         False)
+        self.assertNotEqual(digest, manifest['digest'])
+
+
+class LocalInstallHost(object):
+
+    """Runs the install commands on a local directory."""
+
+    hostname = 'localhost'
+
+    def __init__(self):
+        self.commands = []
+
+    def run(self, command, ignore_status=False, stdin=None):
+        self.commands.append(command)
+        return client_utils.run(command, ignore_status=ignore_status,
+                                stdin=stdin, verbose=False)
+
+    def send_file(self, source, dest, delete_dest=False):
+        if os.path.isdir(source):
+            shutil.rmtree(dest, ignore_errors=True)
+            shutil.copytree(source, dest)
+        else:
+            shutil.copy(source, dest)
+
+
+class test_install_from_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp(suffix='unittest')
+        for path in ('a', 'sub/b', 'tests/t/control'):
+            path = os.path.join(self.source_dir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').write(path)
+        self.autodir = os.path.join(tempfile.mkdtemp(suffix='unittest'),
+                                    'autodir')
+        autotest_remote._install_manifests.clear()
+        autotest_remote.settings.override_value(
+            'AUTOSERV', 'client_install_cache', 'True')
+        self.host = LocalInstallHost()
+        self.autotest = autotest_remote.BaseAutotest(self.host)
+        self.autotest.source_material = self.source_dir
+
+    def tearDown(self):
+        autotest_remote.settings.reset_values()
+        autotest_remote._install_manifests.clear()
+        shutil.rmtree(self.source_dir, ignore_errors=True)
+        shutil.rmtree(os.path.dirname(self.autodir), ignore_errors=True)
+
+    def _full_install(self):
+        manifest, installed = self.autotest._install_from_cache(
+            self.host, self.autodir, False, False)
+        self.assertFalse(installed)
+        self.host.send_file(self.source_dir, self.autodir, delete_dest=True)
+        self.autotest._write_install_manifest(self.host, self.autodir,
+                                              manifest)
+        self.host.commands = []
+
+    def _install_from_cache(self):
+        manifest, installed = self.autotest._install_from_cache(
+            self.host, self.autodir, False, False)
+        self.assertTrue(installed)
+
+    def _read(self, relpath):
+        return open(os.path.join(self.autodir, relpath)).read()
+
+    def test_up_to_date(self):
+        self._full_install()
+        os.makedirs(os.path.join(self.autodir, 'packages'))
+        open(os.path.join(self.autodir, 'packages', 'p.tar.bz2'), 'w').close()
+        self._install_from_cache()
+        self.assertFalse([command for command in self.host.commands
+                          if 'rm -f' in command or 'tar' in command])
+        self.assertTrue(os.path.exists(os.path.join(self.autodir, 'packages',
+                                                    'p.tar.bz2')))
+
+    def test_repairs_and_cleans_host(self):
+        self._full_install()
+        open(os.path.join(self.autodir, 'a'), 'w').write('edited')
+        os.remove(os.path.join(self.autodir, 'sub', 'b'))
+        os.makedirs(os.path.join(self.autodir, 'tests', 't', 'src'))
+        open(os.path.join(self.autodir, 'tests', 't', 'src', 'built'),
+             'w').close()
+        self._install_from_cache()
+        self.assertEqual(os.path.join(self.source_dir, 'a'), self._read('a'))
+        self.assertEqual(os.path.join(self.source_dir, 'sub/b'),
+                         self._read('sub/b'))
+        self.assertFalse(os.path.exists(os.path.join(self.autodir, 'tests',
+                                                     't', 'src')))
+        # the host is now up to date
+        self.host.commands = []
+        self._install_from_cache()
+        self.assertFalse([command for command in self.host.commands
+                          if 'tar' in command])
+
+    def test_updates_changed_client(self):
+        self._full_install()
+        open(os.path.join(self.source_dir, 'a'), 'w').write('new')
+        os.remove(os.path.join(self.source_dir, 'sub', 'b'))
+        autotest_remote._install_manifests.clear()
+        self._install_from_cache()
+        self.assertEqual('new', self._read('a'))
+        self.assertFalse(os.path.exists(os.path.join(self.autodir, 'sub')))
+
+    def test_full_install_when_host_files_unreadable(self):
+        self._full_install()
+        real_run = self.host.run
+
+        def run(command, ignore_status=False, stdin=None):
+            if 'sha1sum' in command:
+                command += ' && false'
+            return real_run(command, ignore_status, stdin)
+        self.host.run = run
+        manifest, installed = self.autotest._install_from_cache(
+            self.host, self.autodir, False, False)
+        self.assertFalse(installed)
+
+    def test_packaging_install_is_light(self):
+        autotest_remote.settings.override_value('PACKAGES', 'fetch_location',
+                                                'repo')
+        os.makedirs(os.path.join(self.source_dir, 'profilers'))
+        open(os.path.join(self.source_dir, 'profilers', '__init__.py'),
+             'w').close()
+        os.makedirs(self.autodir)
+        manifest, installed = self.autotest._install_from_cache(
+            self.host, self.autodir, False, True)
+        self.assertFalse(installed)
+        self.assertEqual(['a', 'profilers/__init__.py', 'sub/b'],
+                         sorted(manifest['files']))
+
+    def test_full_install_without_manifest(self):
+        os.makedirs(self.autodir)
+        manifest, installed = self.autotest._install_from_cache(
+            self.host, self.autodir, False, False)
+        self.assertFalse(installed)
+        self.assertEqual(['a', 'sub/b', 'tests/t/control'],
+                         sorted(manifest['files']))
+
+
+class FakeResultsHost(object):
+
+    hostname = 'hostname'
+
+    def __init__(self, du_output):
+        self.du_output = du_output
+        self.commands = []
+        self.get_file_calls = []
+
+    def get_autodir(self):
+        return '/autodir'
+
+    def use_rsync(self):
+        return True
+
+    def run(self, command, ignore_status=False):
+        self.commands.append(command)
+        return client_utils.CmdResult(command, stdout=self.du_output)
+
+    def get_file(self, source, dest, **dargs):
+        self.get_file_calls.append((source, dest, dargs))
+
+
+class test_log_collector(unittest.TestCase):
+
+    def _collector(self, du_output, streams):
+        host = FakeResultsHost(du_output)
+        collector = autotest_remote.log_collector(host, 'tag', '/results')
+        collector.client_results_dir = '/autodir/results/tag'
+        collector.streams = streams
+        return collector
+
+    def test_split_results(self):
+        collector = self._collector('100\tcore\n60\tdebug\n'
+                                    '50\tsysinfo\n5\tstatus\n', 2)
+        self.assertEqual([['core', 'status'], ['debug', 'sysinfo']],
+                         collector._split_results(2))
+
+    def test_split_results_escapes_dir(self):
+        collector = self._collector('', 2)
+        collector.client_results_dir = '/autodir/results/$tag'
+        self.assertEqual([], collector._split_results(2))
+        self.assertEqual(['cd /autodir/results/\\$tag && '
+                          'du -sk -- * .[!.]* 2>/dev/null'],
+                         collector.host.commands)
+
+    def test_collect_single_stream(self):
+        collector = self._collector('100\tcore\n60\tdebug\n', 1)
+        collector._collect()
+        self.assertEqual([('/autodir/results/tag/', '/results',
+                           {'preserve_symlinks': True, 'resume': True})],
+                         collector.host.get_file_calls)
+
+    def test_collect_parallel_streams(self):
+        collector = self._collector('100\tcore\n60\tdebug\n'
+                                    '50\tsysinfo\n', 2)
+        collector._collect()
+        sources = sorted(call[0] for call in collector.host.get_file_calls)
+        self.assertEqual([['/autodir/results/tag/core'],
+                          ['/autodir/results/tag/debug',
+                           '/autodir/results/tag/sysinfo']], sources)
+
+
 class test_autotest_mixin(unittest.TestCase):
 
     def setUp(self):
@@ -10,7 +10,7 @@ import traceback
 from autotest.client.shared import autotemp, error
 from autotest.client.shared.settings import settings
 from autotest.server import utils, autotest_remote
-from autotest.server.hosts import remote
+from autotest.server.hosts import remote, ssh_pool
 
 enable_master_ssh = settings.get_value('AUTOSERV', 'enable_master_ssh',
                                        type=bool, default=False)
@@ -60,12 +60,12 @@ class AbstractSSHHost(SiteHost):
         self.known_hosts_file = tempfile.mkstemp()[1]
 
         """
-        Master SSH connection background job, socket temp directory and socket
-        control path option. If master-SSH is enabled, these fields will be
-        initialized by start_master_ssh when a new SSH connection is initiated.
+        Master SSH connection, shared through the process wide pool, and its
+        socket control path option. If master-SSH is enabled, these fields
+        will be initialized by start_master_ssh when a new SSH connection is
+        initiated.
         """
-        self.master_ssh_job = None
-        self.master_ssh_tempdir = None
+        self.master_ssh = None
         self.master_ssh_option = ''
 
     def use_rsync(self):
@@ -99,11 +99,13 @@ class AbstractSSHHost(SiteHost):
             paths = [utils.scp_remote_escape(path) for path in paths]
         return '%s@%s:"%s"' % (self.user, self.hostname, " ".join(paths))
 
-    def _make_rsync_cmd(self, sources, dest, delete_dest, preserve_symlinks):
+    def _make_rsync_cmd(self, sources, dest, delete_dest, preserve_symlinks,
+                        resume=False):
         """
         Given a list of source paths and a destination path, produces the
         appropriate rsync command for copying them. Remote paths must be
-        pre-encoded.
+        pre-encoded. With resume, partially transferred files are kept so
+        that the next transfer picks up where the interrupted one stopped.
         """
         ssh_cmd = make_ssh_command(user=self.user, port=self.port,
                                    opts=self.master_ssh_option,
@@ -116,6 +118,8 @@ class AbstractSSHHost(SiteHost):
             symlink_flag = ""
         else:
             symlink_flag = "-L"
+        if resume:
+            symlink_flag += " --partial-dir=.rsync-partial"
         command = "rsync %s %s --timeout=1800 --rsh='%s' -az %s %s"
         return command % (symlink_flag, delete_flag, ssh_cmd,
                           " ".join(sources), dest)
@@ -232,7 +236,7 @@ class AbstractSSHHost(SiteHost):
             set_file_privs(dest)
 
     def get_file(self, source, dest, delete_dest=False, preserve_perm=True,
-                 preserve_symlinks=False):
+                 preserve_symlinks=False, resume=False):
         """
         Copy files from the remote host to a local path.
 
@@ -257,6 +261,9 @@ class AbstractSSHHost(SiteHost):
                                permissions on files and dirs
                 preserve_symlinks: try to preserve symlinks instead of
                                    transforming them into files/dirs on copy
+                resume: keep partially transferred files, so that getting
+                        the same files again after a failure resumes the
+                        transfer (rsync only)
 
         Raises:
                 AutoservRunError: the scp command failed
@@ -276,7 +283,8 @@ class AbstractSSHHost(SiteHost):
                 remote_source = self._encode_remote_paths(source)
                 local_dest = utils.sh_escape(dest)
                 rsync = self._make_rsync_cmd([remote_source], local_dest,
-                                             delete_dest, preserve_symlinks)
+                                             delete_dest, preserve_symlinks,
+                                             resume)
                 utils.run(rsync)
                 try_scp = False
             except error.CmdError as e:
@@ -559,50 +567,46 @@ class AbstractSSHHost(SiteHost):
 
     def _cleanup_master_ssh(self):
         """
-        Release all resources (process, temporary directory) used by an active
-        master SSH connection.
+        Release the master SSH connection of this host. The pool stops it
+        once no host has used it for a while.
         """
-        # If a master SSH connection is running, kill it.
-        if self.master_ssh_job is not None:
-            utils.nuke_subprocess(self.master_ssh_job.sp)
-            self.master_ssh_job = None
-
-        # Remove the temporary directory for the master SSH socket.
-        if self.master_ssh_tempdir is not None:
-            self.master_ssh_tempdir.clean()
-            self.master_ssh_tempdir = None
+        if self.master_ssh is not None:
+            ssh_pool.instance().release(self.master_ssh)
+            self.master_ssh = None
             self.master_ssh_option = ''
 
     def start_master_ssh(self):
         """
         Called whenever a slave SSH connection needs to be initiated (e.g., by
         run, rsync, scp). If master SSH support is enabled and a master SSH
-        connection is not active already, start a new one in the background.
-        Also, cleanup any zombie master SSH connections (e.g., dead due to
-        reboot).
+        connection is not active already, get one from the process wide pool,
+        which starts a new one in the background if no other host for the same
+        user, hostname and port has one. Also, replace any zombie master SSH
+        connections (e.g., dead due to reboot).
         """
         if not enable_master_ssh:
             return
 
-        # If a previously started master SSH connection is not running
-        # anymore, it needs to be cleaned up and then restarted.
-        if self.master_ssh_job is not None:
-            if self.master_ssh_job.sp.poll() is not None:
-                logging.info("Master ssh connection to %s is down.",
-                             self.hostname)
-                self._cleanup_master_ssh()
-
-        # Start a new master SSH connection.
-        if self.master_ssh_job is None:
-            # Create a shared socket in a temp location.
-            self.master_ssh_tempdir = autotemp.tempdir(unique_id='ssh-master')
-            self.master_ssh_option = ("-o ControlPath=%s/socket" %
-                                      self.master_ssh_tempdir.name)
+        pool = ssh_pool.instance()
+        # If a previously acquired master SSH connection is not running
+        # anymore, it needs to be released and then restarted.
+        if self.master_ssh is not None:
+            if pool.is_alive(self.master_ssh):
+                return
+            logging.info("Master ssh connection to %s is down.",
+                         self.hostname)
+            self._cleanup_master_ssh()
 
+        def start_master(master_ssh_option):
+            self.master_ssh_option = master_ssh_option
             # Start the master SSH connection in the background.
             master_cmd = self.ssh_command(options="-N -o ControlMaster=yes")
             logging.info("Starting master ssh connection '%s'" % master_cmd)
-            self.master_ssh_job = utils.BgJob(master_cmd)
+            return utils.BgJob(master_cmd)
+
+        self.master_ssh = pool.acquire((self.user, self.hostname, self.port),
+                                       start_master)
+        self.master_ssh_option = self.master_ssh.option
 
     def clear_known_hosts(self):
         """Clears out the temporary ssh known_hosts file.
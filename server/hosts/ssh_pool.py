@@ -0,0 +1,225 @@
+"""
+Process wide pool of OpenSSH master connections.
+
+Hosts for the same (user, hostname, port) share one ControlMaster connection
+instead of each starting its own. The control socket is a file, so processes
+forked after a connection was started (subcommands, parallel machines) reuse
+it as well; only the process that started a connection ever stops it.
+Connections nobody uses are stopped after an idle timeout, except in forked
+children: they leave through os._exit(), so their own connections are
+stopped as soon as no host uses them, and when the subcommand joins.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from autotest.client.shared import autotemp
+from autotest.client.shared.settings import settings
+from autotest.server import subcommand, utils
+
+
+class master_connection(object):
+
+    """
+    A master SSH connection and the temporary directory of its socket.
+
+    :param key: The (user, hostname, port) of the connection.
+    :param start_function: Called with the ControlPath ssh option, returns
+            the BgJob running the master ssh.
+    """
+
+    def __init__(self, key, start_function):
+        self.key = key
+        self.tempdir = autotemp.tempdir(unique_id='ssh-master')
+        self.control_path = os.path.join(self.tempdir.name, 'socket')
+        self.option = '-o ControlPath=%s' % self.control_path
+        self.pid = os.getpid()
+        self.users = 0
+        self.start_time = self.last_used = time.time()
+        # time it took for the socket to show up, as seen by the pool
+        self.setup_seconds = None
+        self.job = start_function(self.option)
+
+    @property
+    def owned(self):
+        return self.pid == os.getpid()
+
+    def is_ready(self):
+        """Whether the master is accepting connections on its socket."""
+        if self.setup_seconds is None and os.path.exists(self.control_path):
+            self.setup_seconds = time.time() - self.start_time
+        return self.setup_seconds is not None
+
+    def is_alive(self):
+        if self.owned:
+            return self.job.sp.poll() is None
+        # started by a parent process, the socket goes away with the master
+        return not self.is_ready() or os.path.exists(self.control_path)
+
+    def stop(self):
+        if self.owned:
+            utils.nuke_subprocess(self.job.sp)
+            self.tempdir.clean()
+        else:
+            # the parent process still uses the socket directory
+            self.tempdir.name = None
+
+
+class master_ssh_pool(object):
+
+    """
+    Master SSH connections shared by all the hosts of the process.
+
+    :param idle_timeout: Seconds after which a connection no host uses is
+            stopped.
+    """
+
+    def __init__(self, idle_timeout=300):
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._started = 0
+        self._reused = 0
+        self._restarted = 0
+        self._evicted = 0
+        self._setup_seconds = []
+        self._pid = os.getpid()
+
+    def _after_fork(self):
+        # another thread may have held the lock when the process forked
+        self._lock = threading.Lock()
+
+    def _remove(self, connection):
+        del self._connections[connection.key]
+        if connection.is_ready() and connection.owned:
+            self._setup_seconds.append(connection.setup_seconds)
+        connection.stop()
+
+    def _evict_idle(self, now):
+        for connection in list(self._connections.values()):
+            if (not connection.users and
+                    now - connection.last_used > self.idle_timeout):
+                logging.debug('Stopping idle master ssh connection to %s',
+                              connection.key[1])
+                self._remove(connection)
+                self._evicted += 1
+
+    def acquire(self, key, start_function):
+        """
+        Get a live master connection for key, starting one if needed. Each
+        acquire() must be matched by a release().
+
+        :param key: The (user, hostname, port) of the connection.
+        :param start_function: See master_connection.
+        :return: A master_connection.
+        """
+        with self._lock:
+            now = time.time()
+            self._evict_idle(now)
+            connection = self._connections.get(key)
+            if connection is not None and not connection.is_alive():
+                logging.info("Master ssh connection to %s is down.", key[1])
+                self._remove(connection)
+                self._restarted += 1
+                connection = None
+
+            if connection is None:
+                connection = master_connection(key, start_function)
+                self._connections[key] = connection
+                self._started += 1
+            else:
+                connection.is_ready()
+                self._reused += 1
+            connection.users += 1
+            connection.last_used = now
+            return connection
+
+    def release(self, connection):
+        with self._lock:
+            connection.users -= 1
+            connection.last_used = time.time()
+            if (not connection.users and connection.owned and
+                    os.getpid() != self._pid and
+                    self._connections.get(connection.key) is connection):
+                # nothing stops it once this forked child exits
+                self._remove(connection)
+
+    def is_alive(self, connection):
+        """Whether connection is still pooled and its master running."""
+        with self._lock:
+            return (self._connections.get(connection.key) is connection and
+                    connection.is_alive())
+
+    def stats(self):
+        """
+        :return: A dict with the number of pooled connections, of masters
+                started, reused and restarted, of idle connections evicted,
+                and an estimate of the connection setup time saved by the
+                reuses, based on the mean time masters took to be ready.
+        """
+        with self._lock:
+            setup_seconds = list(self._setup_seconds)
+            setup_seconds.extend(connection.setup_seconds for connection
+                                 in self._connections.values()
+                                 if connection.owned and connection.is_ready())
+            if setup_seconds:
+                mean_setup_seconds = sum(setup_seconds) / len(setup_seconds)
+            else:
+                mean_setup_seconds = 0.0
+            return {'connections': len(self._connections),
+                    'started': self._started,
+                    'reused': self._reused,
+                    'restarted': self._restarted,
+                    'evicted': self._evicted,
+                    'mean_setup_seconds': mean_setup_seconds,
+                    'setup_seconds_saved': self._reused * mean_setup_seconds}
+
+    def close(self):
+        """Stop all the connections started by this process."""
+        with self._lock:
+            for connection in list(self._connections.values()):
+                self._remove(connection)
+        stats = self.stats()
+        if stats['started']:
+            logging.debug('Master ssh pool: %(started)d started, %(reused)d '
+                          'reused, %(restarted)d restarted, about '
+                          '%(setup_seconds_saved).1fs of connection setup '
+                          'saved', stats)
+
+
+_the_instance = None
+
+
+def instance():
+    if _the_instance is None:
+        _set_instance(master_ssh_pool(settings.get_value(
+            'AUTOSERV', 'master_ssh_idle_timeout', type=int, default=300)))
+    return _the_instance
+
+
+def _set_instance(instance):  # usable for testing
+    global _the_instance
+    _the_instance = instance
+
+
+def _close_instance():
+    if _the_instance is not None:
+        _the_instance.close()
+
+
+def _instance_after_fork():
+    if _the_instance is not None:
+        _the_instance._after_fork()
+
+
+def _close_instance_on_join(cmd):
+    _close_instance()
+
+
+atexit.register(_close_instance)
+os.register_at_fork(after_in_child=_instance_after_fork)
+# forked subcommands leave through os._exit(), without the atexit handlers
+subcommand.subcommand.register_join_hook(_close_instance_on_join)
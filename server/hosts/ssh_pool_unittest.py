@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+import os
+import pickle
+import subprocess
+import unittest
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    from . import common  # pylint: disable=W0611
+
+from autotest.server import subcommand
+from autotest.server.hosts import ssh_pool
+
+
+class FakeBgJob(object):
+
+    def __init__(self, option):
+        self.option = option
+        self.sp = subprocess.Popen(['sleep', '60'])
+
+
+class test_master_ssh_pool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ssh_pool.master_ssh_pool(idle_timeout=300)
+        self.key = ('root', 'host1', 22)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_connection_shared(self):
+        first = self.pool.acquire(self.key, FakeBgJob)
+        second = self.pool.acquire(self.key, FakeBgJob)
+        self.assertTrue(first is second)
+        self.assertEqual(2, first.users)
+        self.assertEqual('-o ControlPath=%s' % first.control_path,
+                         first.job.option)
+        other = self.pool.acquire(('root', 'host2', 22), FakeBgJob)
+        self.assertFalse(other is first)
+        stats = self.pool.stats()
+        self.assertEqual(2, stats['started'])
+        self.assertEqual(1, stats['reused'])
+
+    def test_dead_master_restarted(self):
+        first = self.pool.acquire(self.key, FakeBgJob)
+        first.job.sp.kill()
+        first.job.sp.wait()
+        self.assertFalse(self.pool.is_alive(first))
+        self.pool.release(first)
+        second = self.pool.acquire(self.key, FakeBgJob)
+        self.assertFalse(second is first)
+        self.assertTrue(self.pool.is_alive(second))
+        self.assertEqual(1, self.pool.stats()['restarted'])
+
+    def test_idle_connection_evicted(self):
+        self.pool.idle_timeout = 0
+        first = self.pool.acquire(self.key, FakeBgJob)
+        busy = self.pool.acquire(('root', 'host2', 22), FakeBgJob)
+        self.pool.release(first)
+        self.pool.acquire(('root', 'host3', 22), FakeBgJob)
+        self.assertNotEqual(None, first.job.sp.poll())
+        self.assertEqual(None, first.tempdir.name)
+        self.assertTrue(self.pool.is_alive(busy))
+        self.assertEqual(1, self.pool.stats()['evicted'])
+
+    def test_setup_time_saved(self):
+        connection = self.pool.acquire(self.key, FakeBgJob)
+        open(connection.control_path, 'w').close()
+        connection.start_time -= 2
+        self.pool.acquire(self.key, FakeBgJob)
+        self.pool.acquire(self.key, FakeBgJob)
+        stats = self.pool.stats()
+        self.assertTrue(stats['mean_setup_seconds'] >= 2)
+        self.assertEqual(2 * stats['mean_setup_seconds'],
+                         stats['setup_seconds_saved'])
+
+    def test_forked_child_does_not_stop_parent_master(self):
+        connection = self.pool.acquire(self.key, FakeBgJob)
+        pid = os.fork()
+        if not pid:
+            reused = self.pool.acquire(self.key, FakeBgJob)
+            self.pool.close()
+            os._exit(int(reused is not connection))
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+        self.assertTrue(self.pool.is_alive(connection))
+        self.assertTrue(os.path.isdir(os.path.dirname(
+            connection.control_path)))
+
+    def _master_alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def test_forked_child_stops_released_master(self):
+        pid = os.fork()
+        if not pid:
+            connection = self.pool.acquire(self.key, FakeBgJob)
+            self.pool.release(connection)
+            os._exit(int(connection.job.sp.poll() is None or
+                         connection.tempdir.name is not None))
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, status)
+
+    def test_subcommand_join_stops_child_masters(self):
+        ssh_pool._set_instance(self.pool)
+        self.addCleanup(ssh_pool._set_instance, None)
+
+        def run():
+            connection = ssh_pool.instance().acquire(self.key, FakeBgJob)
+            return connection.job.sp.pid, connection.tempdir.name
+        cmd = subcommand.subcommand(run, ())
+        cmd.fork_start()
+        self.assertEqual(0, cmd.fork_waitfor())
+        master_pid, tempdir = pickle.loads(cmd.result_pickle.read())
+        self.assertFalse(self._master_alive(master_pid))
+        self.assertFalse(os.path.exists(tempdir))
+
+
+if __name__ == "__main__":
+    unittest.main()
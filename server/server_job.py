@@ -11,6 +11,7 @@ import os
 import sys
 import re
 import tempfile
+import threading
 import time
 import select
 import platform
@@ -29,6 +30,7 @@ from autotest.client.shared import error
 from autotest.client.shared import utils
 from autotest.client.shared import packages
 from autotest.client.shared import logging_manager
+from autotest.client.shared.settings import settings
 from autotest.server import test
 from autotest.server import subcommand
 from autotest.server import profilers
@@ -240,6 +242,8 @@ class base_server_job(base_job.base_job):
         self.num_tests_failed = 0
 
         self._register_subcommand_hooks()
+        # the machine a parallel_simple(threads=True) thread works on
+        self._machine_thread = threading.local()
 
         # these components aren't usable on the server
         self.bootloader = None
@@ -249,7 +253,10 @@ class base_server_job(base_job.base_job):
         self._indenter = status_indenter()
         self._logger = base_job.status_logger(
             self, self._indenter, 'status.log', 'status.log',
-            record_hook=server_job_record_hook(self))
+            record_hook=server_job_record_hook(self),
+            buffer_entries=settings.get_value('COMMON',
+                                              'status_log_buffer_entries',
+                                              type=int, default=0))
 
     @classmethod
     # The unittests will hide this method, well, for unittesting
@@ -421,8 +428,32 @@ class base_server_job(base_job.base_job):
             wrapper = function
         return wrapper
 
+    def _make_threaded_wrapper(self, function, machines, log):
+        """
+        Wrap function for calling by parallel_simple in threads. The job
+        state can't be switched per machine in threads, so this only writes
+        the machine keyval into its results subdirectory, and marks the
+        thread so record_entry() refuses to log from it.
+        """
+        if len(machines) <= 1:
+            return function
+
+        def wrapper(machine):
+            if log:
+                machine_data = {'hostname': machine,
+                                'status_version': str(self._STATUS_VERSION)}
+                utils.write_keyval(os.path.join(self.resultdir, machine),
+                                   machine_data)
+            self._machine_thread.machine = machine
+            try:
+                return function(machine)
+            finally:
+                self._machine_thread.machine = None
+        return wrapper
+
     def parallel_simple(self, function, machines, log=True, timeout=None,
-                        return_results=False):
+                        return_results=False, max_parallel=None,
+                        threads=False):
         """
         Run 'function' using parallel_simple, with an extra wrapper to handle
         the necessary setup for continuous parsing, if possible. If continuous
@@ -437,13 +468,40 @@ class base_server_job(base_job.base_job):
         :param return_results: If True instead of an AutoServError being raised
                 on any error a list of the results|exceptions from the function
                 called on each arg is returned.  [default: False]
+        :param max_parallel: Maximum number of machines worked on at the same
+                time, defaults to AUTOSERV.max_parallel_machines.
+        :param threads: If True function runs in threads instead of forked
+                autoserv processes. function must then be thread safe and not
+                depend on per machine job state: the execution context isn't
+                switched to the machine and continuous parsing isn't set up.
+                The status log is shared by all the machines, so function
+                must not record status (e.g. through run_test()), which
+                raises error.JobError.
 
         :raise error.AutotestError: If any of the functions failed.
         """
-        wrapper = self._make_parallel_wrapper(function, machines, log)
+        if max_parallel is None:
+            max_parallel = settings.get_value('AUTOSERV',
+                                              'max_parallel_machines',
+                                              type=int, default=0)
+        if threads:
+            wrapper = self._make_threaded_wrapper(function, machines, log)
+        else:
+            wrapper = self._make_parallel_wrapper(function, machines, log)
         return subcommand.parallel_simple(wrapper, machines,
                                           log=log, timeout=timeout,
-                                          return_results=return_results)
+                                          return_results=return_results,
+                                          max_parallel=max_parallel,
+                                          threads=threads)
+
+    def record_entry(self, entry, log_in_subdir=True):
+        machine = getattr(self._machine_thread, 'machine', None)
+        if machine is not None:
+            raise error.JobError(
+                'Cannot record status from the thread working on %s, use '
+                'parallel_simple() without threads=True for functions that '
+                'record status' % machine)
+        super(base_server_job, self).record_entry(entry, log_in_subdir)
 
     def parallel_on_machines(self, function, machines, timeout=None):
         """
@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 
+import threading
 import unittest
 
 try:
@@ -8,6 +9,7 @@ except ImportError:
     from . import common  # pylint: disable=W0611
 
 from autotest.server import server_job
+from autotest.client.shared import error
 from autotest.client.shared import base_job_unittest
 from autotest.client.shared.test_utils import mock
 
@@ -68,6 +70,22 @@ class test_init(base_job_unittest.test_init.generic_tests, unittest.TestCase):
         self.god.unstub_all()
 
 
+class test_threaded_wrapper(unittest.TestCase):
+
+    def setUp(self):
+        self.job = server_job.base_server_job.__new__(
+            server_job.base_server_job)
+        self.job._machine_thread = threading.local()
+
+    def test_record_refused_in_machine_thread(self):
+        def function(machine):
+            self.job.record_entry(None)
+        wrapper = self.job._make_threaded_wrapper(function,
+                                                  ['mach1', 'mach2'], False)
+        self.assertRaises(error.JobError, wrapper, 'mach1')
+        self.assertEqual(None, self.job._machine_thread.machine)
+
+
 class WarningManagerTest(unittest.TestCase):
 
     def test_never_disabled(self):
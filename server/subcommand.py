@@ -3,8 +3,11 @@ __author__ = """Copyright Andy Whitcroft, Martin J. Bligh - 2006, 2007"""
 import pickle
 import logging
 import os
+import queue
+import select
 import signal
 import sys
+import threading
 import time
 
 from autotest.client.shared import error, utils
@@ -14,38 +17,78 @@ from autotest.client.shared import error, utils
 logging_manager_object = None
 
 
-def parallel(tasklist, timeout=None, return_results=False):
+def _abort_task(task, timeout):
+    utils.nuke_pid(task.pid)
+    # reap it, or it stays a zombie for the rest of the run
+    os.waitpid(task.pid, 0)
+    print("subcommand failed pid %d" % task.pid)
+    print("%s" % (task.func,))
+    print("timeout after %ds" % timeout)
+    print()
+    task.result_pickle.close()
+
+
+def parallel(tasklist, timeout=None, return_results=False, max_parallel=None):
     """
     Run a set of predefined subcommands in parallel.
 
+    Results are collected as the subcommands finish, in whatever order, by
+    waiting on their result pipes.
+
     :param tasklist: A list of subcommand instances to execute.
     :param timeout: Number of seconds after which the commands should timeout.
     :param return_results: If True instead of an AutoServError being raised
             on any error a list of the results|exceptions from the tasks is
             returned.  [default: False]
+    :param max_parallel: Maximum number of subcommands running at the same
+            time, the others are started as running ones finish. None or 0
+            for no limit.  [default: None]
     """
     run_error = False
-    for task in tasklist:
-        task.fork_start()
+    results = [None] * len(tasklist)
+    pending = list(enumerate(tasklist))
+    running = {}
 
-    remaining_timeout = None
     if timeout:
         endtime = time.time() + timeout
 
-    results = []
-    for task in tasklist:
+    while pending or running:
+        while pending and (not max_parallel or len(running) < max_parallel):
+            index, task = pending.pop(0)
+            task.fork_start()
+            running[task.result_pickle.fileno()] = (index, task)
+
+        remaining_timeout = None
         if timeout:
-            remaining_timeout = max(endtime - time.time(), 1)
-        try:
-            status = task.fork_waitfor(timeout=remaining_timeout)
-        except error.AutoservSubcommandError:
+            remaining_timeout = max(endtime - time.time(), 0)
+        ready = select.select(list(running), [], [], remaining_timeout)[0]
+        if not ready:
+            # timed out, abort what is running and don't start the rest
             run_error = True
-        else:
-            if status != 0:
+            for index, task in running.values():
+                _abort_task(task, timeout)
+                results[index] = error.AutoservSubcommandError(task.func, -1)
+            for index, task in pending:
+                results[index] = error.AutoservSubcommandError(task.func, -1)
+            break
+
+        for fd in ready:
+            index, task = running.pop(fd)
+            # the pipe is readable once the child wrote its result or exited
+            try:
+                results[index] = pickle.load(task.result_pickle)
+            except EOFError:
+                results[index] = None
+            task.result_pickle.close()
+            try:
+                status = task.wait()
+            except error.AutoservSubcommandError as e:
                 run_error = True
-
-        results.append(pickle.load(task.result_pickle))
-        task.result_pickle.close()
+                if results[index] is None:
+                    results[index] = e
+            else:
+                if status != 0:
+                    run_error = True
 
     if return_results:
         return results
@@ -56,8 +99,129 @@ def parallel(tasklist, timeout=None, return_results=False):
         raise error.AutoservError(message)
 
 
+class _thread_log_filter(logging.Filter):
+
+    """Only let through the records logged by one thread."""
+
+    def __init__(self, thread_id):
+        logging.Filter.__init__(self)
+        self.thread_id = thread_id
+
+    def filter(self, record):
+        return record.thread == self.thread_id
+
+
+def _run_in_thread(function, arg, debug_dir):
+    """
+    Call function(arg), copying the records logged meanwhile by the calling
+    thread to debug_dir, the way a forked subcommand tees its logs.
+    """
+    if not debug_dir:
+        return function(arg)
+    handler = logging.FileHandler(os.path.join(debug_dir, 'autoserv.DEBUG'))
+    handler.setLevel(logging.DEBUG)
+    if logging_manager_object:
+        handler.setFormatter(
+            logging_manager_object.logging_config_object.file_formatter)
+    handler.addFilter(_thread_log_filter(threading.current_thread().ident))
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    try:
+        return function(arg)
+    finally:
+        root_logger.removeHandler(handler)
+        handler.close()
+
+
+def parallel_threads(function, arglist, log=True, timeout=None,
+                     return_results=False, max_parallel=None):
+    """
+    Like parallel_simple, but call function in threads of this process
+    instead of forked subcommands.
+
+    function must be thread safe: it can't rely on per process state such
+    as the working directory, and it should leave the job object alone.
+    Threads that are still running when the timeout expires can't be
+    killed, they are abandoned and reported as failed.
+
+    :param max_parallel: Maximum number of threads running function at the
+            same time. None or 0 for one thread per arg.  [default: None]
+
+    See parallel_simple for the other parameters.
+    """
+    if not max_parallel:
+        max_parallel = len(arglist)
+    work = queue.Queue()
+    for index, arg in enumerate(arglist):
+        debug_dir = None
+        if log:
+            debug_dir = os.path.join(os.path.abspath(str(arg)), 'debug')
+            if not os.path.exists(debug_dir):
+                os.makedirs(debug_dir)
+        work.put((index, arg, debug_dir))
+    done = queue.Queue()
+
+    def worker():
+        while True:
+            try:
+                index, arg, debug_dir = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                done.put((index, True, _run_in_thread(function, arg,
+                                                      debug_dir)))
+            except Exception as e:
+                logging.exception('function failed')
+                done.put((index, False, e))
+
+    for _ in range(min(max_parallel, len(arglist))):
+        thread = threading.Thread(target=worker)
+        # abandoned after a timeout, they must not hold up the exit
+        thread.daemon = True
+        thread.start()
+
+    if timeout:
+        endtime = time.time() + timeout
+    run_error = False
+    results = [None] * len(arglist)
+    finished = set()
+    while len(finished) < len(arglist):
+        remaining_timeout = None
+        if timeout:
+            remaining_timeout = max(endtime - time.time(), 0)
+        try:
+            index, success, result = done.get(timeout=remaining_timeout)
+        except queue.Empty:
+            run_error = True
+            for index, arg in enumerate(arglist):
+                if index not in finished:
+                    logging.error('%s(%s) timed out after %ds', function,
+                                  arg, timeout)
+                    results[index] = error.AutoservError(
+                        'timeout after %ds' % timeout)
+            # keep the threads that didn't start yet from starting
+            while not work.empty():
+                try:
+                    work.get_nowait()
+                except queue.Empty:
+                    break
+            break
+        finished.add(index)
+        results[index] = result
+        if not success:
+            run_error = True
+
+    if return_results:
+        return results
+    elif run_error:
+        message = 'One or more threads failed:\n'
+        for arg, result in zip(arglist, results):
+            message += 'arg: %s returned/raised: %r\n' % (arg, result)
+        raise error.AutoservError(message)
+
+
 def parallel_simple(function, arglist, log=True, timeout=None,
-                    return_results=False):
+                    return_results=False, max_parallel=None, threads=False):
     """
     Each element in the arglist used to create a subcommand object,
     where that arg is used both as a subdir name, and a single argument
@@ -77,6 +241,10 @@ def parallel_simple(function, arglist, log=True, timeout=None,
     :param return_results: If True instead of an AutoServError being raised
             on any error a list of the results|exceptions from the function
             called on each arg is returned.  [default: False]
+    :param max_parallel: Maximum number of args being worked on at the same
+            time, None or 0 for no limit.  [default: None]
+    :param threads: If True function is called in threads instead of forked
+            subcommands, see parallel_threads.  [default: False]
 
     :return: None or a list of results/exceptions.
     """
@@ -96,6 +264,11 @@ def parallel_simple(function, arglist, log=True, timeout=None,
             function(arg)
             return
 
+    if threads:
+        return parallel_threads(function, arglist, log=log, timeout=timeout,
+                                return_results=return_results,
+                                max_parallel=max_parallel)
+
     subcommands = []
     for arg in arglist:
         args = [arg]
@@ -104,7 +277,8 @@ def parallel_simple(function, arglist, log=True, timeout=None,
         else:
             subdir = None
         subcommands.append(subcommand(function, args, subdir))
-    return parallel(subcommands, timeout, return_results=return_results)
+    return parallel(subcommands, timeout, return_results=return_results,
+                    max_parallel=max_parallel)
 
 
 class subcommand(object):
@@ -160,7 +334,7 @@ class subcommand(object):
 
         if self.pid:                            # I am the parent
             os.close(w)
-            self.result_pickle = os.fdopen(r, 'r')
+            self.result_pickle = os.fdopen(r, 'rb')
             return
         else:
             os.close(r)
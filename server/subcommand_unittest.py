@@ -1,6 +1,12 @@
 #!/usr/bin/python3
 # Copyright 2009 Google Inc. Released under the GPL v2
 
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 try:
@@ -252,91 +258,130 @@ class subcommand_test(unittest.TestCase):
 
 class parallel_test(unittest.TestCase):
 
-    def setUp(self):
-        self.god = mock.mock_god()
-        self.god.stub_function(subcommand.cPickle, 'load')
-
-    def tearDown(self):
-        self.god.unstub_all()
-
-    def _get_cmd(self, func, args):
-        cmd = _create_subcommand(func, args)
-        cmd.result_pickle = self.god.create_mock_class(file, 'file')
-        return self.god.create_mock_class(cmd, 'subcommand')
-
-    def _get_tasklist(self):
-        return [self._get_cmd(lambda x: x * 2, (3,)),
-                self._get_cmd(lambda: None, [])]
-
-    def _setup_common(self):
-        tasklist = self._get_tasklist()
-
-        for task in tasklist:
-            task.fork_start.expect_call()
-
-        return tasklist
+    def _get_tasklist(self, *sleeps):
+        def task_func(seconds):
+            time.sleep(seconds)
+            return seconds * 2
+        return [subcommand.subcommand(task_func, [seconds])
+                for seconds in sleeps]
 
     def test_success(self):
-        tasklist = self._setup_common()
-
-        for task in tasklist:
-            task.fork_waitfor.expect_call(timeout=None).and_return(0)
-            (subcommand.cPickle.load.expect_call(task.result_pickle)
-             .and_return(6))
-            task.result_pickle.close.expect_call()
-
-        subcommand.parallel(tasklist)
-        self.god.check_playback()
+        self.assertEqual(subcommand.parallel(self._get_tasklist(0, 0.1),
+                                             return_results=True),
+                         [0, 0.2])
 
     def test_failure(self):
-        tasklist = self._setup_common()
-
-        for task in tasklist:
-            task.fork_waitfor.expect_call(timeout=None).and_return(1)
-            (subcommand.cPickle.load.expect_call(task.result_pickle)
-             .and_return(6))
-            task.result_pickle.close.expect_call()
-
+        def fail():
+            raise Exception('fail')
+        tasklist = [subcommand.subcommand(fail, [])]
         self.assertRaises(subcommand.error.AutoservError, subcommand.parallel,
                           tasklist)
-        self.god.check_playback()
 
-    def test_timeout(self):
-        self.god.stub_function(subcommand.time, 'time')
-
-        tasklist = self._setup_common()
-        timeout = 10
-
-        subcommand.time.time.expect_call().and_return(1)
+    def test_return_results(self):
+        def fail():
+            raise ValueError('fail')
+        tasklist = self._get_tasklist(0) + [subcommand.subcommand(fail, [])]
+        results = subcommand.parallel(tasklist, return_results=True)
+        self.assertEqual(0, results[0])
+        self.assertTrue(isinstance(results[1], ValueError))
+
+    def test_collects_in_completion_order(self):
+        finished = []
+        tasklist = self._get_tasklist(0.5, 0)
+        for task in tasklist:
+            task.wait = (lambda task=task, wait=task.wait:
+                         finished.append(task.args[0]) or wait())
+        subcommand.parallel(tasklist)
+        self.assertEqual([0, 0.5], finished)
 
+    def test_max_parallel(self):
+        started = []
+        tasklist = self._get_tasklist(0, 0, 0)
         for task in tasklist:
-            subcommand.time.time.expect_call().and_return(1)
-            task.fork_waitfor.expect_call(timeout=timeout).and_return(None)
-            (subcommand.cPickle.load.expect_call(task.result_pickle)
-             .and_return(6))
-            task.result_pickle.close.expect_call()
+            task.fork_start = (lambda task=task, fork_start=task.fork_start:
+                               started.append(len(started)) or fork_start())
+        self.assertEqual(subcommand.parallel(tasklist, return_results=True,
+                                             max_parallel=1),
+                         [0, 0, 0])
+        self.assertEqual([0, 1, 2], started)
 
-        self.assertRaises(subcommand.error.AutoservError, subcommand.parallel,
-                          tasklist, timeout=timeout)
-        self.god.check_playback()
+    def test_timeout(self):
+        tasklist = self._get_tasklist(0, 30, 0)
+        start = time.time()
+        results = subcommand.parallel(tasklist, timeout=1,
+                                      return_results=True, max_parallel=1)
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual(0, results[0])
+        self.assertTrue(isinstance(results[1],
+                                   subcommand.error.AutoservSubcommandError))
+        self.assertTrue(isinstance(results[2],
+                                   subcommand.error.AutoservSubcommandError))
+        # the aborted subcommand was reaped
+        self.assertRaises(ChildProcessError, os.waitpid, tasklist[1].pid,
+                          os.WNOHANG)
+
+
+class parallel_threads_test(unittest.TestCase):
 
-    def test_return_results(self):
-        tasklist = self._setup_common()
+    def setUp(self):
+        self.testdir = tempfile.mkdtemp(suffix='unittest')
+        self.original_wd = os.getcwd()
+        os.chdir(self.testdir)
 
-        tasklist[0].fork_waitfor.expect_call(timeout=None).and_return(0)
-        (subcommand.cPickle.load.expect_call(tasklist[0].result_pickle)
-         .and_return(6))
-        tasklist[0].result_pickle.close.expect_call()
+    def tearDown(self):
+        os.chdir(self.original_wd)
+        shutil.rmtree(self.testdir, ignore_errors=True)
 
-        error = Exception('fail')
-        tasklist[1].fork_waitfor.expect_call(timeout=None).and_return(1)
-        (subcommand.cPickle.load.expect_call(tasklist[1].result_pickle)
-         .and_return(error))
-        tasklist[1].result_pickle.close.expect_call()
+    def test_results(self):
+        self.assertEqual(subcommand.parallel_threads(lambda x: x * 2,
+                                                     [1, 2, 3], log=False,
+                                                     return_results=True),
+                         [2, 4, 6])
 
-        self.assertEqual(subcommand.parallel(tasklist, return_results=True),
-                          [6, error])
-        self.god.check_playback()
+    def test_failure(self):
+        def func(arg):
+            if arg == 2:
+                raise ValueError(arg)
+            return arg
+        self.assertRaises(subcommand.error.AutoservError,
+                          subcommand.parallel_threads, func, [1, 2],
+                          log=False)
+        results = subcommand.parallel_threads(func, [1, 2], log=False,
+                                              return_results=True)
+        self.assertEqual(1, results[0])
+        self.assertTrue(isinstance(results[1], ValueError))
+
+    def test_max_parallel(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def func(arg):
+            with lock:
+                running.append(arg)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(arg)
+        subcommand.parallel_threads(func, list(range(6)), log=False,
+                                    max_parallel=2)
+        self.assertEqual(2, max(peak))
+
+    def test_timeout(self):
+        results = subcommand.parallel_threads(time.sleep, [0, 30], log=False,
+                                              timeout=0.5,
+                                              return_results=True)
+        self.assertEqual(None, results[0])
+        self.assertTrue(isinstance(results[1],
+                                   subcommand.error.AutoservError))
+
+    def test_logs_isolated(self):
+        def func(arg):
+            logging.warning('message from %s', arg)
+        subcommand.parallel_threads(func, ['host1', 'host2'])
+        log = open(os.path.join('host1', 'debug', 'autoserv.DEBUG')).read()
+        self.assertTrue('message from host1' in log)
+        self.assertFalse('message from host2' in log)
 
 
 class test_parallel_simple(unittest.TestCase):
@@ -398,7 +443,8 @@ class test_parallel_simple(unittest.TestCase):
             (subcommand.subcommand.expect_call(func, [arg], subdir)
              .and_return(cmd))
 
-        subcommand.parallel.expect_call(cmds, None, return_results=False)
+        subcommand.parallel.expect_call(cmds, None, return_results=False,
+                                        max_parallel=None)
         return func, args
 
     def test_passthrough(self):
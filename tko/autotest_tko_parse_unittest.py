@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+import fcntl
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    from . import common  # pylint: disable=W0611
+from autotest.client.shared.test_utils import mock
+
+
+def _load_parse_script():
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'autotest-tko-parse')
+    dont_write_bytecode = sys.dont_write_bytecode
+    sys.dont_write_bytecode = True
+    try:
+        return imp.load_source('autotest_tko_parse', script_path)
+    finally:
+        sys.dont_write_bytecode = dont_write_bytecode
+
+
+parse = _load_parse_script()
+
+
+class FakeJob(object):
+
+    def __init__(self, test_count):
+        self.tests = [None] * test_count
+
+
+def fake_parse_one(jobname, path, reparse, mail_on_failure):
+    """Leave a record of the parse in path, the workers are other processes."""
+    with open(os.path.join(path, 'parsed'), 'a') as parsed:
+        parsed.write(jobname + '\n')
+    name = os.path.basename(path)
+    if name.startswith('fail'):
+        raise Exception('unparsable job %s' % jobname)
+    if name.startswith('skip'):
+        return None
+    return FakeJob(2)
+
+
+class AutotestTkoParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        self.god.stub_with(parse, 'parse_one', fake_parse_one)
+        self.results_dir = tempfile.mkdtemp(suffix='unittest')
+        # a single machine job
+        self._make_job_dir('1-job')
+        # a multi-machine job, with a lock file of an earlier parse
+        self._make_job_dir('2-job', 'host1')
+        self._make_job_dir('2-job', 'host2')
+        open(self._path('2-job', '.parse.lock'), 'w').close()
+        # a synchronous multi-machine job, with results of its own
+        self._make_job_dir('3-job')
+        self._make_job_dir('3-job', 'host1')
+        with open(self._path('3-job', '.machines'), 'w') as machines:
+            machines.write('host1\nmissing-host\n')
+        self._make_job_dir('skip-job')
+        self._make_job_dir('fail-job')
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.results_dir)
+
+    def _path(self, *components):
+        return os.path.join(self.results_dir, *components)
+
+    def _make_job_dir(self, *components):
+        path = self._path(*components)
+        os.makedirs(path)
+        open(os.path.join(path, 'status.log'), 'w').close()
+
+    def _options(self, noblock=False, workers=1):
+        options = parse.OptionParser().get_default_values()
+        options.noblock = noblock
+        options.workers = workers
+        return options
+
+    def _jobs_list(self):
+        return sorted(self._path(subdir)
+                      for subdir in os.listdir(self.results_dir))
+
+    def _parsed_jobnames(self):
+        jobnames = []
+        for dirpath, _, filenames in os.walk(self.results_dir):
+            if 'parsed' in filenames:
+                with open(os.path.join(dirpath, 'parsed')) as parsed:
+                    jobnames.extend(parsed.read().split())
+                os.remove(os.path.join(dirpath, 'parsed'))
+        return sorted(jobnames)
+
+    def test_find_leaf_paths(self):
+        self.assertEqual([(self._path('1-job'), 1)],
+                         list(parse.find_leaf_paths(self._path('1-job'), 1)))
+        self.assertEqual([(self._path('2-job', 'host1'), 2),
+                          (self._path('2-job', 'host2'), 2)],
+                         sorted(parse.find_leaf_paths(self._path('2-job'),
+                                                      1)))
+        self.assertEqual([(self._path('3-job'), 1),
+                          (self._path('3-job', 'host1'), 2)],
+                         list(parse.find_leaf_paths(self._path('3-job'), 1)))
+
+    def test_parse_locked_path(self):
+        stats = parse.parse_locked_path(self._path('2-job'),
+                                        self._options(noblock=True))
+        self.assertEqual({'parsed': 2, 'tests': 4}, dict(stats))
+        self.assertEqual(['2-job/host1', '2-job/host2'],
+                         self._parsed_jobnames())
+
+    def test_locked_path_skipped(self):
+        lockfile = open(self._path('2-job', '.parse.lock'), 'w')
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            stats = parse.parse_locked_path(self._path('2-job'),
+                                            self._options(noblock=True))
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+        self.assertEqual({'locked': 1}, dict(stats))
+        self.assertEqual([], self._parsed_jobnames())
+
+    def test_parallel_parse_matches_serial_parse(self):
+        serial_stats = parse.parse_all(self._jobs_list(), self._options())
+        serial_jobnames = self._parsed_jobnames()
+        self.assertEqual({'parsed': 5, 'tests': 10, 'skipped': 1,
+                          'failed': 1}, dict(serial_stats))
+        self.assertEqual(['1-job', '2-job/host1', '2-job/host2', '3-job',
+                          '3-job/host1', 'fail-job', 'skip-job'],
+                         serial_jobnames)
+
+        parallel_stats = parse.parse_all(self._jobs_list(),
+                                         self._options(workers=3))
+        self.assertEqual(serial_stats, parallel_stats)
+        self.assertEqual(serial_jobnames, self._parsed_jobnames())
+
+    def test_parallel_parse_splits_one_directory(self):
+        """The jobs of one directory are handed out to several workers."""
+        works = []
+
+        class FakePool(object):
+
+            def __init__(self, processes):
+                pass
+
+            def imap_unordered(self, func, work):
+                works.append(work)
+                return [func(args) for args in work]
+
+            def close(self):
+                pass
+
+            def join(self):
+                pass
+
+        self.god.stub_with(parse.multiprocessing, 'Pool', FakePool)
+        stats = parse.parse_all([self.results_dir], self._options(workers=3))
+        self.assertEqual({'parsed': 5, 'tests': 10, 'skipped': 1,
+                          'failed': 1}, dict(stats))
+        self.assertEqual([self._path('1-job'), self._path('2-job', 'host1'),
+                          self._path('2-job', 'host2'), self._path('3-job'),
+                          self._path('3-job', 'host1'),
+                          self._path('fail-job'), self._path('skip-job')],
+                         sorted(args[0] for args in works[0]))
+
+    def test_parallel_parse_skips_locked_path(self):
+        lockfile = open(self._path('2-job', '.parse.lock'), 'w')
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            stats = parse.parse_all(self._jobs_list(),
+                                    self._options(noblock=True, workers=3))
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+            lockfile.close()
+        self.assertEqual({'parsed': 3, 'tests': 6, 'skipped': 1,
+                          'failed': 1, 'locked': 1}, dict(stats))
+        self.assertEqual(['1-job', '3-job', '3-job/host1', 'fail-job',
+                          'skip-job'], self._parsed_jobnames())
+
+
+if __name__ == '__main__':
+    unittest.main()
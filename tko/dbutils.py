@@ -2,10 +2,75 @@ import os
 import re
 
 from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+from django.db import transaction
 from autotest.frontend.tko import models as tko_models
 from autotest.frontend.tko import models_utils as tko_models_utils
 from autotest.tko import utils
 
+# maximum number of rows written by a single multi-row INSERT
+BULK_INSERT_BATCH_SIZE = 500
+
+
+class TestResultRows(object):
+
+    """
+    Iteration attributes, iteration results and test attributes of parsed
+    tests, built in memory and written with multi-row INSERTs.
+    """
+    _MODELS = (tko_models.IterationAttribute, tko_models.IterationResult,
+               tko_models.TestAttribute)
+
+    def __init__(self, batch_size=BULK_INSERT_BATCH_SIZE):
+        self._batch_size = batch_size
+        self._rows = dict((model, []) for model in self._MODELS)
+
+    def __len__(self):
+        return sum(len(rows) for rows in self._rows.values())
+
+    def add_test(self, tko_test, test):
+        for i in test.iterations:
+            for key, value in i.attr_keyval.items():
+                self._rows[tko_models.IterationAttribute].append(
+                    tko_models.IterationAttribute(test=tko_test,
+                                                  attribute=key,
+                                                  iteration=i.index,
+                                                  value=value))
+
+            for key, value in i.perf_keyval.items():
+                self._rows[tko_models.IterationResult].append(
+                    tko_models.IterationResult(test=tko_test,
+                                               iteration=i.index,
+                                               attribute=key,
+                                               value=value))
+
+        for key, value in test.attributes.items():
+            self._rows[tko_models.TestAttribute].append(
+                tko_models.TestAttribute(test=tko_test,
+                                         attribute=key,
+                                         value=value))
+
+    def flush(self):
+        for model in self._MODELS:
+            rows = self._rows[model]
+            if rows:
+                model.objects.bulk_create(rows, batch_size=self._batch_size)
+            self._rows[model] = []
+
+
+def delete_test_results(test_indexes):
+    """
+    Delete the iteration results/attributes and the parser created test
+    attributes of the given tests, with one DELETE per table.
+    """
+    if not test_indexes:
+        return
+    tko_models.IterationResult.objects.filter(
+        test__in=test_indexes).delete()
+    tko_models.IterationAttribute.objects.filter(
+        test__in=test_indexes).delete()
+    tko_models.TestAttribute.objects.filter(test__in=test_indexes,
+                                            user_created=False).delete()
+
 
 def insert_patch(tko_kernel, patch):
     name = os.path.basename(patch.reference)[:80]
@@ -46,7 +111,15 @@ def insert_kernel(kernel):
     return tko_kernel
 
 
-def insert_test(job, test, tko_job=None, tko_machine=None):
+def insert_test(job, test, tko_job=None, tko_machine=None, result_rows=None):
+    """
+    Insert or update a test and its results.
+
+    :param result_rows: TestResultRows the results are added to, the caller
+            is then responsible for deleting the old results of a reparsed
+            test, for flushing the rows and for refreshing the job's status
+            count rollup. By default all of this is done before returning.
+    """
     tko_kernel = insert_kernel(test.kernel)
     status = tko_models.Status.objects.get(word=test.status)
 
@@ -77,40 +150,23 @@ def insert_test(job, test, tko_job=None, tko_machine=None):
         tko_models.Test.objects.filter(pk=test.test_idx).update(**tko_test_data)
         tko_test = tko_models.Test.objects.get(pk=test.test_idx)
 
-        # clean up iteration result/attributes and test attributes that will
-        # be re-added shortly
-        tko_models.IterationResult.objects.filter(
-            test=test.test_idx).delete()
-        tko_models.IterationAttribute.objects.filter(
-            test=test.test_idx).delete()
-        tko_models.TestAttribute.objects.filter(test=test.test_idx,
-                                                user_created=False).delete()
+        if result_rows is None:
+            # clean up iteration result/attributes and test attributes that
+            # will be re-added shortly
+            delete_test_results([test.test_idx])
 
     else:
         tko_test = tko_models.Test.objects.create(**tko_test_data)
         tko_test.save()
         test.test_idx = tko_test.test_idx
 
-    for i in test.iterations:
-        for key, value in i.attr_keyval.items():
-            tko_models.IterationAttribute.objects.create(
-                test=tko_test,
-                attribute=key,
-                iteration=i.index,
-                value=value)
-
-        for key, value in i.perf_keyval.items():
-            tko_models.IterationResult.objects.create(
-                test=tko_test,
-                iteration=i.index,
-                attribute=key,
-                value=value)
-
-    for key, value in test.attributes.items():
-        tko_models.TestAttribute.objects.create(
-            test=tko_test,
-            attribute=key,
-            value=value)
+    if result_rows is None:
+        rows = TestResultRows()
+        rows.add_test(tko_test, test)
+        rows.flush()
+        tko_models.StatusCountRollup.objects.refresh_jobs([tko_job.pk])
+    else:
+        result_rows.add_test(tko_test, test)
 
     for label_index in test.labels:
         label = tko_models_utils.test_label_get_by_idx(label_index)
@@ -119,7 +175,16 @@ def insert_test(job, test, tko_job=None, tko_machine=None):
 
 
 def insert_job(jobname, job):
+    """
+    Write the job and its tests into the database in a single transaction.
+    """
+    with transaction.atomic():
+        _insert_job(jobname, job)
+
+
+def _insert_job(jobname, job):
     # write the job into the database
+    old_machine = tko_models_utils.machine_get_by_hostname(job.machine)
     machine = tko_models_utils.machine_create(job.machine,
                                               job.machine_group,
                                               job.machine_owner)
@@ -163,6 +228,21 @@ def insert_job(jobname, job):
         job_keyval.value = value
         job_keyval.save()
 
+    # clean up the results of reparsed tests, they are re-added below
+    delete_test_results([test.test_idx for test in job.tests
+                         if hasattr(test, 'test_idx')])
+
     # now insert the tests
+    result_rows = TestResultRows()
     for test in job.tests:
-        insert_test(job, test, tko_job, machine)
+        insert_test(job, test, tko_job, machine, result_rows=result_rows)
+        if len(result_rows) >= BULK_INSERT_BATCH_SIZE:
+            result_rows.flush()
+    result_rows.flush()
+
+    rollup = tko_models.StatusCountRollup.objects
+    rollup.refresh_jobs([tko_job.pk])
+    # the rollup rows of the machine's other jobs hold its platform too
+    if (old_machine is not None and
+            old_machine.machine_group != machine.machine_group):
+        rollup.refresh_machine(machine.pk)
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+
+import unittest
+try:
+    import autotest.common as common  # pylint: disable=W0611
+except ImportError:
+    from . import common  # pylint: disable=W0611
+from autotest.frontend import setup_django_environment  # pylint: disable=W0611
+from autotest.frontend import setup_test_environment
+from autotest.client.shared.test_utils import mock
+from autotest.frontend.tko import models as tko_models
+from autotest.frontend.tko import rpc_interface_unittest
+from autotest.tko import dbutils, models
+
+JOB_NAME = '1-myuser/myhost'
+
+
+class DbutilsTest(unittest.TestCase, rpc_interface_unittest.TkoTestMixin):
+
+    def setUp(self):
+        self.god = mock.mock_god()
+        setup_test_environment.set_up()
+        self._patch_sqlite_stuff()
+        rpc_interface_unittest.setup_test_view()
+        tko_models.Status.objects.create(word='GOOD')
+        tko_models.Status.objects.create(word='FAILED')
+
+    def tearDown(self):
+        setup_test_environment.tear_down()
+        self.god.unstub_all()
+
+    def _make_test(self, name, iteration_count=2, status='GOOD'):
+        kernel = models.kernel('2.6.32', [], 'mykernelhash')
+        iterations = [models.iteration(index, {'iattr': 'ival%d' % index},
+                                       {'iresult': float(index)})
+                      for index in range(1, iteration_count + 1)]
+        return models.test(name, name, status, '', kernel, 'myhost', None,
+                           None, iterations, {'attr': name}, [])
+
+    def _make_job(self, tests, jobname=JOB_NAME, platform=None):
+        job = models.job('/results/' + jobname, 'myuser', 'myjob', 'myhost',
+                         None, None, None, None, platform, None, None,
+                         {'jobkey': 'jobvalue'})
+        job.tests = tests
+        return job
+
+    def _iteration_rows(self, model, test):
+        return sorted(model.objects.filter(test=test.test_idx).values_list(
+            'iteration', 'attribute', 'value'))
+
+    def _test_attributes(self, test):
+        return sorted(tko_models.TestAttribute.objects.filter(
+            test=test.test_idx).values_list('attribute', 'value',
+                                            'user_created'))
+
+    def _check_results(self, test, iteration_count):
+        self.assertEqual(
+            [(index, 'iattr', 'ival%d' % index)
+             for index in range(1, iteration_count + 1)],
+            self._iteration_rows(tko_models.IterationAttribute, test))
+        self.assertEqual(
+            [(index, 'iresult', float(index))
+             for index in range(1, iteration_count + 1)],
+            self._iteration_rows(tko_models.IterationResult, test))
+
+    def test_insert_job(self):
+        tests = [self._make_test('test1'), self._make_test('test2', 3)]
+        job = self._make_job(tests)
+        dbutils.insert_job(JOB_NAME, job)
+
+        tko_job = tko_models.Job.objects.get(pk=job.index)
+        self.assertEqual(JOB_NAME, tko_job.tag)
+        self.assertEqual(1, tko_job.afe_job_id)
+        self.assertEqual({'jobkey': 'jobvalue'},
+                         dict(tko_job.jobkeyval_set.values_list('key',
+                                                                'value')))
+        self.assertEqual(sorted(test.test_idx for test in tests),
+                         sorted(tko_job.test_set.values_list('test_idx',
+                                                             flat=True)))
+        self._check_results(tests[0], 2)
+        self._check_results(tests[1], 3)
+        self.assertEqual([('attr', 'test1', False)],
+                         self._test_attributes(tests[0]))
+
+    def test_insert_job_in_batches(self):
+        self.god.stub_with(dbutils, 'BULK_INSERT_BATCH_SIZE', 3)
+        tests = [self._make_test('test%d' % index) for index in range(5)]
+        dbutils.insert_job(JOB_NAME, self._make_job(tests))
+        for test in tests:
+            self._check_results(test, 2)
+            self.assertEqual([('attr', test.testname, False)],
+                             self._test_attributes(test))
+
+    def test_reparse_replaces_results(self):
+        test = self._make_test('test1', 3)
+        job = self._make_job([test])
+        dbutils.insert_job(JOB_NAME, job)
+        job_index, test_idx = job.index, test.test_idx
+        tko_models.TestAttribute.objects.create(
+            test_id=test_idx, attribute='user', value='set by user',
+            user_created=True)
+
+        # a reparse reuses the indexes of the job and its tests
+        reparsed = self._make_test('test1', 1, status='FAILED')
+        reparsed.test_idx = test_idx
+        job = self._make_job([reparsed])
+        job.index = job_index
+        dbutils.insert_job(JOB_NAME, job)
+
+        self.assertEqual(job_index, job.index)
+        self.assertEqual(test_idx, reparsed.test_idx)
+        self.assertEqual(1, tko_models.Job.objects.count())
+        self.assertEqual(1, tko_models.Test.objects.count())
+        self.assertEqual('FAILED',
+                         tko_models.Test.objects.get(pk=test_idx).status.word)
+        self._check_results(reparsed, 1)
+        self.assertEqual([('attr', 'test1', False),
+                          ('user', 'set by user', True)],
+                         self._test_attributes(reparsed))
+
+    def test_platform_change_refreshes_rollup(self):
+        dbutils.insert_job(JOB_NAME, self._make_job(
+            [self._make_test('test1')], platform='platform1'))
+        dbutils.insert_job('2-myuser/myhost', self._make_job(
+            [self._make_test('test1')], jobname='2-myuser/myhost',
+            platform='platform2'))
+        self.assertEqual(['platform2', 'platform2'], list(
+            tko_models.StatusCountRollup.objects.values_list('platform',
+                                                             flat=True)))
+
+    def test_delete_test_results(self):
+        tests = [self._make_test('test1'), self._make_test('test2')]
+        dbutils.insert_job(JOB_NAME, self._make_job(tests))
+
+        dbutils.delete_test_results([])
+        dbutils.delete_test_results([tests[0].test_idx])
+
+        self.assertEqual([], self._iteration_rows(
+            tko_models.IterationAttribute, tests[0]))
+        self.assertEqual([], self._iteration_rows(
+            tko_models.IterationResult, tests[0]))
+        self.assertEqual([], self._test_attributes(tests[0]))
+        self._check_results(tests[1], 2)
+        self.assertEqual([('attr', 'test2', False)],
+                         self._test_attributes(tests[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
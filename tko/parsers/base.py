@@ -3,6 +3,9 @@ import traceback
 
 from autotest.tko import status_lib
 
+# number of lines buffered at a time by parser.process_stream()
+STREAM_CHUNK_SIZE = 1000
+
 
 class parser(object):
 
@@ -37,6 +40,22 @@ class parser(object):
                          "".join(traceback.format_stack()))
             return []
 
+    def process_stream(self, lines, chunk_size=STREAM_CHUNK_SIZE):
+        """ Feed the lines of the iterable 'lines' into the parser state
+        machine, at most chunk_size at a time, and return a list of all the
+        new test results produced. The lines are never all held in
+        memory."""
+        new_tests = []
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                new_tests.extend(self.process_lines(chunk))
+                chunk = []
+        if chunk:
+            new_tests.extend(self.process_lines(chunk))
+        return new_tests
+
     def end(self, lines=[]):
         """ Feed 'lines' into the parser state machine, signal to the
         state machine that no more lines are forthcoming, and then
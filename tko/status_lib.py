@@ -1,4 +1,5 @@
 import collections
+import locale
 import re
 try:
     import autotest.common as common  # pylint: disable=W0611
@@ -80,6 +81,38 @@ class line_buffer(object):
         return len(self.buffer)
 
 
+class status_log_reader(object):
+
+    """
+    Incremental reader of a status log, yielding its lines one at a time
+    instead of loading the whole file. The lines are the ones
+    open(path).readlines() returns: decoded with the locale encoding and
+    with universal newlines.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.encoding = locale.getpreferredencoding(False)
+
+    def lines(self):
+        """
+        Yield the lines of the log.
+        """
+        with open(self.path, 'rb') as status_log:
+            for raw_line in status_log:
+                line = raw_line.decode(self.encoding)
+                if '\r' in line:
+                    # universal newlines, as in text mode
+                    line = line.replace('\r\n', '\n').replace('\r', '\n')
+                    split_lines = line.split('\n')
+                    for split_line in split_lines[:-1]:
+                        yield split_line + '\n'
+                    if split_lines[-1]:
+                        yield split_lines[-1]
+                else:
+                    yield line
+
+
 def parser(version):
     library = "autotest.tko.parsers.version_%d" % version
     module = __import__(library, globals(), locals(), ["parser"])
@@ -1,11 +1,16 @@
 #!/usr/bin/python3
 
+import locale
+import os
+import shutil
+import tempfile
 import unittest
 try:
     import autotest.common as common  # pylint: disable=W0611
 except ImportError:
     from . import common  # pylint: disable=W0611
 from autotest.tko import status_lib
+from autotest.tko.parsers import base
 from autotest.client.shared import log
 
 
@@ -161,6 +166,55 @@ class status_stack_test(unittest.TestCase):
         self.assertEqual(stack.end(), "NOSTATUS")
 
 
+class status_log_reader_test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'status.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, data, mode='wb'):
+        with open(self.path, mode) as status_log:
+            status_log.write(data)
+
+    def test_reads_all_lines(self):
+        self._write(b'first\nsecond\nlast')
+        reader = status_lib.status_log_reader(self.path)
+        self.assertEqual(list(reader.lines()), ['first\n', 'second\n', 'last'])
+
+    def test_universal_newlines(self):
+        self._write(b'first\r\nsecond\rthird\nlast\r')
+        reader = status_lib.status_log_reader(self.path)
+        self.assertEqual(list(reader.lines()), open(self.path).readlines())
+        self.assertEqual(['first\n', 'second\n', 'third\n', 'last\n'],
+                         list(status_lib.status_log_reader(self.path).lines()))
+
+    def test_decoded_like_text_mode(self):
+        self._write('caf\xe9\n'.encode(locale.getpreferredencoding(False),
+                                      'replace'))
+        self.assertEqual(open(self.path).readlines(),
+                         list(status_lib.status_log_reader(self.path).lines()))
+        self._write(b'\xff\xfe\xfa\n')
+        reader = status_lib.status_log_reader(self.path)
+        reader.encoding = 'utf-8'
+        self.assertRaises(UnicodeDecodeError, list, reader.lines())
+
+
+class line_echo_parser(base.parser):
+
+    def state_iterator(self, buffer):
+        new_tests = []
+        while not self.finished or buffer.size():
+            if buffer.size() == 0:
+                yield new_tests
+                new_tests = []
+                continue
+            new_tests.append(buffer.get())
+        yield new_tests
+
+
 class parser_test(unittest.TestCase):
     available_versions = [0, 1]
 
@@ -169,6 +223,14 @@ class parser_test(unittest.TestCase):
             p = status_lib.parser(0)
             self.assertNotEqual(p, None)
 
+    def test_process_stream(self):
+        lines = ["line #%d" % x for x in range(10)]
+        p = line_echo_parser()
+        p.start(None)
+        self.assertEqual(p.process_stream(iter(lines), chunk_size=3), lines)
+        self.assertEqual(p.line_buffer.size(), 0)
+        self.assertEqual(p.end(), [])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -80,42 +80,49 @@ def process_packages(pkgmgr, pkg_type, pkg_names, src_dir,
     include_string = " ."
     exclude_string = None
     names = [p.strip() for p in pkg_names.split(',')]
-    for name in names:
-        print("Processing %s ... " % name)
-        if pkg_type == 'client':
-            pkg_dir = src_dir
-            exclude_string = get_exclude_string(pkg_dir)
-        elif pkg_type == 'test':
-            # if the package is a test then look whether it is in client/tests
-            # or client/site_tests
-            pkg_dir = os.path.join(get_test_dir(name, src_dir), name)
-        else:
-            # for the profilers and deps
-            pkg_dir = os.path.join(src_dir, name)
+    with pkgmgr.checksum_batch():
+        for name in names:
+            _process_package(pkgmgr, pkg_type, name, src_dir, remove,
+                             include_string, exclude_string)
+
+
+def _process_package(pkgmgr, pkg_type, name, src_dir, remove, include_string,
+                     exclude_string):
+    print("Processing %s ... " % name)
+    if pkg_type == 'client':
+        pkg_dir = src_dir
+        exclude_string = get_exclude_string(pkg_dir)
+    elif pkg_type == 'test':
+        # if the package is a test then look whether it is in client/tests
+        # or client/site_tests
+        pkg_dir = os.path.join(get_test_dir(name, src_dir), name)
+    else:
+        # for the profilers and deps
+        pkg_dir = os.path.join(src_dir, name)
 
-        pkg_name = pkgmgr.get_tarball_name(name, pkg_type)
-        if not remove:
-            # Tar the source and upload
-            temp_dir = tempfile.mkdtemp()
+    pkg_name = pkgmgr.get_tarball_name(name, pkg_type)
+    if not remove:
+        # Tar the source and upload
+        temp_dir = tempfile.mkdtemp()
+        try:
             try:
-                try:
-                    base_packages.check_diskspace(temp_dir)
-                except error.RepoDiskFullError as e:
-                    msg = ("Temporary directory for packages %s does not have "
-                           "enough space available: %s" % (temp_dir, e))
-                    raise error.RepoDiskFullError(msg)
-                tarball_path = pkgmgr.tar_package(pkg_name=pkg_name,
-                                                  src_dir=pkg_dir,
-                                                  dest_dir=temp_dir,
-                                                  include_string=include_string,
-                                                  exclude_string=exclude_string)
-                pkgmgr.upload_pkg(tarball_path, update_checksum=True)
-            finally:
-                # remove the temporary directory
-                shutil.rmtree(temp_dir)
-        else:
-            pkgmgr.remove_pkg(pkg_name, remove_checksum=True)
-        print("Done.")
+                base_packages.check_diskspace(temp_dir)
+            except error.RepoDiskFullError as e:
+                msg = ("Temporary directory for packages %s does not have "
+                       "enough space available: %s" % (temp_dir, e))
+                raise error.RepoDiskFullError(msg)
+            tarball_path = pkgmgr.tar_package(pkg_name=pkg_name,
+                                              src_dir=pkg_dir,
+                                              dest_dir=temp_dir,
+                                              include_string=include_string,
+                                              exclude_string=exclude_string)
+            pkgmgr.upload_pkg(tarball_path, update_checksum=True)
+        finally:
+            # remove the temporary directory
+            shutil.rmtree(temp_dir)
+    else:
+        pkgmgr.remove_pkg(pkg_name, remove_checksum=True)
+    print("Done.")
 
 
 def tar_packages(pkgmgr, pkg_type, pkg_names, src_dir, temp_dir):